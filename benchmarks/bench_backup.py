@@ -0,0 +1,123 @@
+"""
+Effect of an online backup on the latency of the bot's foreground database work.
+
+A foreground loop makes the lookups and the write of a "reading a book" message (the user's books, the book's page
+count, a progress update) against a synthetic database and records each message's latency, first with nothing else
+running, then while backups copy the database back to back:
+    idle          no backup
+    one_step      the whole file copied in one backup step
+    stepped       DatabaseBackup's defaults: MYSCRIBE_BACKUP_PAGES pages per step, MYSCRIBE_BACKUP_STEP_PAUSE between
+
+It reports p50, p99 and max message latency and how long a backup took on average.
+
+Usage:
+    python benchmarks/bench_backup.py
+    python benchmarks/bench_backup.py --rows 50000
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "backup.json")
+
+
+def foreground(book_database, rows: int, until: threading.Event) -> list:
+    """
+    Simulates messages until ``until`` is set; returns their latencies in ms.
+    """
+    generator = random.Random(0)
+    latencies = []
+    while not until.is_set():
+        user_id = generator.randint(1, rows)
+        start = time.perf_counter()
+        book_database.retrieve_user_books(user_id)
+        book_database.retrieve_total_pages(f"book {user_id}")
+        book_database.execute_write("UPDATE books_and_users SET pages_read = ? WHERE user_id = ?",
+                                    (generator.randint(0, 150), user_id), user_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.001)
+    return latencies
+
+
+def summarize(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {"p50_ms": round(statistics.median(latencies), 3),
+            "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 3),
+            "max_ms": round(latencies[-1], 3),
+            "messages": len(latencies)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000, help="books, users and reading rows in the database")
+    parser.add_argument("--seconds", type=float, default=5, help="length of each run")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    path = common.create_database(args.rows)
+    backup_dir = tempfile.mkdtemp(prefix="myscribe-bench-backups-")
+    os.environ["MYSCRIBE_DATABASE"] = path
+    from backup import DatabaseBackup
+    from book_database import BookDatabase
+
+    results = {}
+    try:
+        book_database = BookDatabase(write_behind=False)
+        size = os.path.getsize(path)
+        # Warms the page cache and the bot's caches before anything is measured
+        warm_up = threading.Event()
+        threading.Timer(1, warm_up.set).start()
+        foreground(book_database, args.rows, warm_up)
+        for name, pages in (("idle", None), ("one_step", -1), ("stepped", DatabaseBackup().pages_per_step)):
+            done = threading.Event()
+            backup_seconds = []
+
+            def take_backups() -> None:
+                database_backup = DatabaseBackup(backup_dir=backup_dir, pages_per_step=pages, keep=1)
+                while not done.is_set():
+                    start = time.perf_counter()
+                    database_backup.backup()
+                    backup_seconds.append(time.perf_counter() - start)
+                    database_backup.rotate()
+
+            threading.Timer(args.seconds, done.set).start()
+            backups = threading.Thread(target=take_backups)
+            if pages is not None:
+                backups.start()
+            measurement = summarize(foreground(book_database, args.rows, done))
+            if pages is not None:
+                backups.join()
+                measurement.update({"backups": len(backup_seconds),
+                                    "backup_seconds": round(statistics.fmean(backup_seconds), 3)})
+            results[f"backup.{name}[{args.rows}]"] = measurement
+        book_database.close()
+    finally:
+        shutil.rmtree(backup_dir)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    print(f"database: {size / 1_000_000:.1f} MB")
+    for name, measurement in results.items():
+        backup_seconds = measurement.get("backup_seconds")
+        print(f"{name:<28} p50 {measurement['p50_ms']:>8.3f} ms   p99 {measurement['p99_ms']:>8.3f} ms   "
+              f"max {measurement['max_ms']:>9.3f} ms"
+              + (f"   {measurement['backups']} backups of {backup_seconds:.2f} s" if backup_seconds is not None
+                 else ""))
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Memory and construction cost of holding book details in memory.
+
+Builds the same books in three shapes and measures the memory they hold (tracemalloc) and the time to build them:
+    dict         the ``book_*`` dicts BookApi and BookDatabase used to return
+    namespace    objects with a ``__dict__``, like the attributes BookBot used to carry
+    book_record  the slotted, immutable BookRecord
+
+String values are shared by all shapes, so the difference is the per-book container overhead.
+
+Usage:
+    python benchmarks/bench_book_records.py                   # 100k books
+    python benchmarks/bench_book_records.py --books 1000000
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "book_records.json")
+DICT_KEYS = ("book_title", "book_author", "book_genre", "book_language", "book_total_page_count", "book_isbn13",
+             "book_description", "book_cover")
+
+
+def book_values(books: int) -> list:
+    return [(f"book {i}", f"author {i % 997}", "fiction", "english", 100 + i % 900, str(9780000000000 + i),
+             common.DESCRIPTION, None) for i in range(books)]
+
+
+def measure_shape(build, values: list) -> dict:
+    """
+    Builds one container per book and reports the memory they hold and the build time.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    held = [build(book) for book in values]
+    duration = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {"bytes": size, "bytes_per_book": round(size / len(values), 1),
+              "build_ms": round(duration * 1000, 1), "books": len(held)}
+    del held
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=100_000, help="number of books held")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    from book_record import BookRecord
+
+    values = book_values(args.books)
+    shapes = {
+        "dict": lambda book: dict(zip(DICT_KEYS, book)),
+        "namespace": lambda book: SimpleNamespace(**dict(zip(DICT_KEYS, book))),
+        "book_record": lambda book: BookRecord(*book),
+    }
+    results = {f"book_records.{shape}[{args.books}]": measure_shape(build, values) for shape, build in shapes.items()}
+    baseline = results[f"book_records.dict[{args.books}]"]["bytes"]
+    for name, measurement in results.items():
+        measurement["relative_to_dict"] = round(measurement["bytes"] / baseline, 2)
+        print(f"{name:<34} {measurement['bytes'] / 1_000_000:>8.1f} MB   {measurement['bytes_per_book']:>7.1f} B/book   "
+              f"build {measurement['build_ms']:>8.1f} ms   x{measurement['relative_to_dict']}")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
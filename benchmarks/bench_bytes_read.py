@@ -0,0 +1,133 @@
+"""
+Bytes read per message by the book lookups a "reading a book" message makes.
+
+A message about a stored book checks that the book exists, fetches its details to show them and reads its page count.
+The benchmark runs that sequence against a synthetic database (descriptions of about 3 KB) in three variants:
+    select_star       the queries as they were: SELECT * for the existence check and the details
+    projection        BookDatabase's projected queries; descriptions still inline in books
+    compressed_side   projected queries, descriptions moved compressed into book_descriptions, then VACUUM
+
+For each it reports the bytes of column values handed to Python per message and, on Linux, the bytes SQLite read
+from the database file per message (with a minimal page cache, so every page touched is read).
+
+Usage:
+    python benchmarks/bench_bytes_read.py
+    python benchmarks/bench_bytes_read.py --rows 100000 --messages 2000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "bytes_read.json")
+
+
+def value_bytes(row) -> int:
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row or ()) if row else 0
+
+
+def file_bytes_read() -> int | None:
+    """
+    Bytes this process has read through read() calls so far, or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/io") as io:
+            return int(next(line for line in io if line.startswith("rchar:")).split()[1])
+    except (OSError, StopIteration):
+        return None
+
+
+def run(path: str, variant: str, titles: list) -> dict:
+    from book_database import BookDatabase
+    from metrics import InstrumentedCursor
+
+    class CountingCursor(InstrumentedCursor):
+        """
+        Tallies the size of the column values every fetch returns.
+        """
+        fetched = 0
+
+        def fetchone(self):
+            row = super().fetchone()
+            CountingCursor.fetched += value_bytes(row)
+            return row
+
+        def fetchall(self):
+            rows = super().fetchall()
+            CountingCursor.fetched += sum(value_bytes(row) for row in rows)
+            return rows
+
+    os.environ["MYSCRIBE_DATABASE"] = path
+    book_database = BookDatabase(compress_descriptions=variant == "compressed_side")
+    if variant == "compressed_side":
+        book_database.move_descriptions_to_side_table()
+        # Packs the now small book rows together, as a maintenance VACUUM would
+        book_database.conn.execute("VACUUM")
+    # Every page touched is read from the file instead of SQLite's page cache
+    book_database.conn.execute("PRAGMA cache_size = 1")
+    book_database.conn.execute("PRAGMA mmap_size = 0")
+    cursor = book_database._local.cursor = book_database.conn.cursor(CountingCursor)
+
+    def select_star_message(title: str) -> None:
+        cursor.execute("SELECT * FROM books WHERE title = ?", (title,)).fetchone()
+        cursor.execute("SELECT * FROM books WHERE title = ?", (title,)).fetchone()
+        cursor.execute("SELECT total_pages FROM books WHERE title = ?", (title,)).fetchone()
+
+    def projected_message(title: str) -> None:
+        book_database.check_if_book_exist(title)
+        book_database.fetch_book_details_from_db(title)
+        book_database.retrieve_total_pages(title)
+
+    message = select_star_message if variant == "select_star" else projected_message
+    CountingCursor.fetched = 0
+    file_before = file_bytes_read()
+    for title in titles:
+        message(title)
+    file_after = file_bytes_read()
+    book_database.close()
+    return {"python_bytes_per_message": round(CountingCursor.fetched / len(titles), 1),
+            "file_bytes_per_message": round((file_after - file_before) / len(titles), 1)
+            if file_before is not None else None,
+            "messages": len(titles)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000, help="books in the synthetic database")
+    parser.add_argument("--messages", type=int, default=1000, help="messages simulated per variant")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    source = common.create_database(args.rows)
+    generator = random.Random(0)
+    titles = [f"book {generator.randint(1, args.rows)}" for _ in range(args.messages)]
+    results = {}
+    try:
+        for variant in ("select_star", "projection", "compressed_side"):
+            path = f"{source}.{variant}"
+            shutil.copyfile(source, path)
+            try:
+                results[f"bytes_read.{variant}[{args.rows}]"] = run(path, variant, titles)
+            finally:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+    finally:
+        os.remove(source)
+
+    for name, measurement in results.items():
+        file_bytes = measurement["file_bytes_per_message"]
+        print(f"{name:<40} python {measurement['python_bytes_per_message']:>9.1f} B/message   "
+              f"file {file_bytes if file_bytes is not None else 'n/a':>9} B/message")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
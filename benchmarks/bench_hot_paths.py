@@ -0,0 +1,148 @@
+"""
+Microbenchmarks for the BookDatabase and parsing hot paths.
+
+Usage:
+    python benchmarks/bench_hot_paths.py                           # 1k, 100k and 1M rows
+    python benchmarks/bench_hot_paths.py --sizes 1000 --repeat 50
+    python benchmarks/bench_hot_paths.py --save-baseline           # store the run as the new baseline
+    python benchmarks/bench_hot_paths.py --threshold 0.25          # fail if anything got 25 % slower
+
+Results are written to ``benchmarks/results/hot_paths.json``. When ``benchmarks/baseline/hot_paths.json`` exists the
+run is compared against it and the script exits with status 1 if any median regressed beyond the threshold.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "hot_paths.json")
+BASELINE_PATH = os.path.join(common.BENCHMARKS_DIR, "baseline", "hot_paths.json")
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+
+
+class FixtureScraper:
+    """
+    Stands in for BookWebScraping so parsing benchmarks never touch the network.
+    """
+
+    def get_book_genre_language_wikipedia(self, book_name: str, author_name: str) -> tuple:
+        return "science fiction", "english"
+
+
+def bench_database(rows: int, repeat: int, seed: int) -> dict:
+    """
+    Benchmarks the BookDatabase hot paths against a synthetic database of the given size.
+    """
+    path = common.create_database(rows)
+    os.environ["MYSCRIBE_DATABASE"] = path
+    from book_database import BookDatabase
+    from book_record import BookRecord
+
+    book_database = BookDatabase()
+    rng = random.Random(seed)
+    pick = lambda: rng.randint(1, rows)  # noqa: E731
+    new_book_ids = itertools.count(rows + 1)
+
+    def insert_book_details():
+        book_id = next(new_book_ids)
+        book_database.insert_book_details(BookRecord(
+            title=f"new book {book_id}", author="new author", genre="fiction", language="english",
+            total_pages=320, isbn13=9790000000000 + book_id, description=common.DESCRIPTION))
+
+    def with_random_reader(method, *extra):
+        def call():
+            reader = pick()
+            method(reader, f"book {reader}", *extra)
+        return call
+
+    cases = {
+        "retrieve_book_id": lambda: book_database.retrieve_book_id(f"book {pick()}"),
+        "update_pages_read": with_random_reader(book_database.update_pages_read, 1),
+        "calculate_reading_time_left": with_random_reader(book_database.calculate_reading_time_left),
+        "insert_book_details": insert_book_details,
+        "check_if_book_status_exists": with_random_reader(book_database.check_if_book_status_exists),
+    }
+
+    results = {}
+    try:
+        for name, case in cases.items():
+            results[f"db.{name}[{rows}]"] = common.measure(case, repeat=repeat)
+    finally:
+        book_database.conn.close()
+        os.remove(path)
+    return results
+
+
+def bench_parsing(repeat: int) -> dict:
+    """
+    Benchmarks extract_genre and extract_book_details_from_api_result on the stored fixtures.
+    """
+    import bs4
+    from book_api import BookApi
+    from book_webscraping import BookWebScraping
+
+    with open(os.path.join(common.FIXTURES_DIR, "google_books_response.json")) as fixture:
+        api_response = json.load(fixture)
+    with open(os.path.join(common.FIXTURES_DIR, "wikipedia_infobox.html")) as fixture:
+        soup = bs4.BeautifulSoup(fixture.read(), "html.parser")
+
+    genre_tag = soup.find("th", string="Genre")
+    book_webscraping = BookWebScraping()
+
+    book_api = BookApi()
+    book_api.books_ws = FixtureScraper()
+    result_count = len(api_response["items"])
+    cursor = itertools.cycle(range(result_count))
+
+    return {
+        "parse.extract_genre": common.measure(lambda: book_webscraping.extract_genre(genre_tag), repeat=repeat),
+        "parse.extract_book_details_from_api_result": common.measure(
+            lambda: book_api.extract_book_details_from_api_result(api_response, next(cursor)), repeat=repeat),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="row counts to benchmark")
+    parser.add_argument("--repeat", type=int, default=200, help="measured calls per case")
+    parser.add_argument("--seed", type=int, default=1965, help="random seed for row selection")
+    parser.add_argument("--threshold", type=float, default=0.20, help="allowed slowdown before failing (fraction)")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    results = {}
+    for rows in args.sizes:
+        results.update(bench_database(rows, args.repeat, args.seed))
+    results.update(bench_parsing(args.repeat))
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    for name, measurement in sorted(results.items()):
+        print(f"{name:<55} median {measurement['median_us']:>12.1f} us   p95 {measurement['p95_us']:>12.1f} us")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found. Run with --save-baseline to create one.")
+        return 0
+
+    regressions = common.compare_with_baseline(results, args.baseline, args.threshold)
+    for name, previous, current, change in regressions:
+        print(f"REGRESSION {name}: {previous:.1f} us -> {current:.1f} us (+{change:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Cost of scheduling reading reminders as the number of readers grows.
+
+For each size a database with that many reminder rows is built (one per reader, about 1 % of them due). The benchmark
+times the operations the reminder scheduler performs on every wake-up and the one a progress log performs: fetching a
+batch of due reminders, loading the timer heap window, claiming a due reminder, and rescheduling after a progress
+log. All of them use the partial index on the due time, so their latency should stay flat from 100 to 1M readers.
+
+Usage:
+    python benchmarks/bench_reminders.py                           # 100, 10k, 100k and 1M readers
+    python benchmarks/bench_reminders.py --sizes 100 1000000 --repeat 500
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "reminders.json")
+# Reminders point at a limited catalogue, like real readers do
+BOOKS = 10_000
+
+
+def create_reminder_database(readers: int) -> str:
+    """
+    Creates a database with the production schema, BOOKS books and one reminder per reader.
+    """
+    handle, path = tempfile.mkstemp(prefix=f"myscribe-bench-reminders-{readers}-", suffix=".db")
+    os.close(handle)
+    conn = sqlite3.connect(path)
+    conn.executescript(common.SCHEMA)
+    conn.executemany("INSERT INTO books (id, title, author, total_pages) VALUES (?,?,?,?)",
+                     ((i, f"book {i}", f"author {i % 997}", 300) for i in range(1, BOOKS + 1)))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def fill_reminders(path: str, readers: int, now: float) -> None:
+    conn = sqlite3.connect(path)
+    generator = random.Random(readers)
+    day = 24 * 60 * 60
+    conn.executemany("INSERT INTO reading_reminders (user_id, book_id, due_at, interval_seconds, last_logged_at, "
+                     "reminders_sent) VALUES (?,?,?,?,?,0)",
+                     ((user_id, 1 + user_id % BOOKS,
+                       # About 1 % are due, the rest spread over the next week
+                       now - generator.uniform(0, 3600) if generator.random() < 0.01
+                       else now + generator.uniform(0, 7 * day), 2 * day, now - day)
+                      for user_id in range(1, readers + 1)))
+    conn.commit()
+    conn.close()
+
+
+def run(readers: int, repeat: int) -> dict:
+    """
+    Measures the reminder operations against a table of ``readers`` reminders.
+    """
+    from reminders import HEAP_WINDOW, REMINDER_BATCH_SIZE, ReadingReminders
+
+    path = create_reminder_database(readers)
+    try:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        lock = threading.RLock()
+
+        def execute_writes(statements, telegram_id=None):
+            with lock:
+                for sql, parameters in statements:
+                    conn.execute(sql, parameters)
+                conn.commit()
+
+        reminders = ReadingReminders(conn, lock, execute_writes)
+        now = time.time()
+        fill_reminders(path, readers, now)
+        generator = random.Random(0)
+        # Every claim needs a due reminder of its own
+        claimed = generator.sample(range(1, readers + 1), min(readers, repeat + 10))
+        with lock:
+            conn.executemany("UPDATE reading_reminders SET due_at = ? WHERE user_id = ?",
+                             ((now - 1, user_id) for user_id in claimed))
+            conn.commit()
+
+        def claim():
+            user_id = claimed.pop()
+            reminders.claim(user_id, 1 + user_id % BOOKS, now - 1)
+
+        def record_progress():
+            user_id = generator.randint(1, readers)
+            reminders.record_progress(user_id, 1 + user_id % BOOKS)
+
+        results = {
+            "due_batch": common.measure(lambda: reminders.due(now, REMINDER_BATCH_SIZE), repeat=repeat),
+            "heap_window": common.measure(lambda: reminders.upcoming(HEAP_WINDOW), repeat=max(10, repeat // 10)),
+            "claim": common.measure(claim, repeat=len(claimed) - 10),
+            "record_progress": common.measure(record_progress, repeat=repeat),
+        }
+        conn.close()
+        return results
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=(100, 10_000, 100_000, 1_000_000),
+                        help="numbers of readers with a reminder")
+    parser.add_argument("--repeat", type=int, default=200, help="measured calls per operation")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    results = {}
+    for readers in args.sizes:
+        for operation, measurement in run(readers, args.repeat).items():
+            results[f"reminders.{operation}[{readers}]"] = measurement
+
+    smallest = min(args.sizes)
+    for name, measurement in results.items():
+        base = results[name.replace(name[name.index("[") + 1:-1], str(smallest))]["median_us"]
+        measurement["relative_to_smallest"] = round(measurement["median_us"] / base, 2) if base else None
+        print(f"{name:<40} median {measurement['median_us']:>10.1f} us   "
+              f"p95 {measurement['p95_us']:>10.1f} us   x{measurement['relative_to_smallest']}")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Throughput of the sharded deployment mode (one ingress, N worker processes) on the local machine.
+
+The ingress routes synthetic message updates for many chats through ShardedIngress. Each worker simulates handler
+work: a lookup by title on a shared SQLite database plus a fixed amount of CPU time. The benchmark reports
+updates per second and the speed-up over one worker, and checks that every chat's updates were handled in order.
+
+Usage:
+    python benchmarks/bench_sharding.py                          # 1, 2 and 4 workers
+    python benchmarks/bench_sharding.py --workers 1 2 4 8 --updates 20000 --work-us 500
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "sharding.json")
+
+
+def simulated_worker(updates, name, results, database_path, work_us):
+    """
+    Worker target: handles updates like a bot worker would and reports per-chat ordering violations.
+    """
+    conn = sqlite3.connect(database_path)
+    last_sequence = {}
+    handled = violations = 0
+    while True:
+        update = updates.get()
+        try:
+            if update is None:
+                results.put((name, handled, violations))
+                return
+            message = update["message"]
+            chat_id = message["chat"]["id"]
+            conn.execute("SELECT id FROM books WHERE title = ?", (message["text"],)).fetchone()
+            deadline = time.perf_counter() + work_us / 1_000_000
+            while time.perf_counter() < deadline:
+                pass
+            if message["message_id"] <= last_sequence.get(chat_id, 0):
+                violations += 1
+            last_sequence[chat_id] = message["message_id"]
+            handled += 1
+        finally:
+            updates.task_done()
+
+
+def synthetic_updates(count: int, chats: int, rows: int) -> list:
+    """
+    Builds raw message updates spread round-robin over ``chats`` chats, numbered per chat.
+    """
+    sequences = {}
+    updates = []
+    for update_id in range(count):
+        chat_id = 100_000 + update_id % chats
+        sequences[chat_id] = sequences.get(chat_id, 0) + 1
+        updates.append({"update_id": update_id,
+                        "message": {"message_id": sequences[chat_id], "date": 0, "text": f"book {update_id % rows + 1}",
+                                    "chat": {"id": chat_id, "type": "private"},
+                                    "from": {"id": chat_id, "is_bot": False, "first_name": "reader"}}})
+    return updates
+
+
+def run(workers: int, updates: list, database_path: str, work_us: int) -> dict:
+    """
+    Routes all updates through a fresh ingress with the given number of workers and measures the throughput.
+    """
+    import multiprocessing
+    from sharding import ShardedIngress
+
+    results = multiprocessing.Queue()
+    ingress = ShardedIngress(workers, worker_target=simulated_worker, worker_args=(results, database_path, work_us))
+    start = time.perf_counter()
+    for update in updates:
+        ingress.dispatch(update)
+    ingress.drain()
+    elapsed = time.perf_counter() - start
+    ingress.close()
+
+    per_worker = [results.get() for _ in range(workers)]
+    return {"workers": workers,
+            "updates_per_second": round(len(updates) / elapsed, 1),
+            "seconds": round(elapsed, 3),
+            "handled_per_worker": sorted(handled for _, handled, _ in per_worker),
+            "ordering_violations": sum(violations for _, _, violations in per_worker)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=(1, 2, 4), help="worker counts to benchmark")
+    parser.add_argument("--updates", type=int, default=10_000, help="updates routed per run")
+    parser.add_argument("--chats", type=int, default=500, help="distinct chats the updates belong to")
+    parser.add_argument("--rows", type=int, default=10_000, help="books in the shared database")
+    parser.add_argument("--work-us", type=int, default=200, help="simulated CPU time per update, in microseconds")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    database_path = common.create_database(args.rows)
+    updates = synthetic_updates(args.updates, args.chats, args.rows)
+    results = {}
+    try:
+        for workers in args.workers:
+            results[f"sharding.workers[{workers}]"] = run(workers, updates, database_path, args.work_us)
+    finally:
+        os.remove(database_path)
+
+    single = results.get("sharding.workers[1]")
+    for name, measurement in results.items():
+        if single:
+            measurement["speedup"] = round(measurement["updates_per_second"] / single["updates_per_second"], 2)
+        print(f"{name:<24} {measurement['updates_per_second']:>10.1f} updates/s "
+              f"speed-up {measurement.get('speedup', float('nan')):>5.2f}x "
+              f"ordering violations {measurement['ordering_violations']}")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    return 1 if any(measurement["ordering_violations"] for measurement in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Startup-time and resident-memory benchmark.
+
+Each scenario runs in a fresh interpreter and reports how long it took and the process's peak resident set size.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --save-baseline
+    python benchmarks/bench_startup.py --threshold 0.2
+
+Scenarios:
+    import_chatbot     importing the chatbot module (this used to start the bot as a side effect)
+    build_chatbot      building the ChatBot through the Application container, as main.py does before polling
+    first_api_lookup   additionally touching BookBot.book_api, which loads the scraping stack
+
+Results are written to ``benchmarks/results/startup.json``. When ``benchmarks/baseline/startup.json`` exists the run
+is compared against it and the script exits with status 1 on a regression beyond the threshold.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "startup.json")
+BASELINE_PATH = os.path.join(common.BENCHMARKS_DIR, "baseline", "startup.json")
+
+SCENARIOS = {
+    "import_chatbot": "import chatbot",
+    "build_chatbot": "from application import Application\napp = Application()\napp.chatbot",
+    "first_api_lookup": "from application import Application\napp = Application()\napp.chatbot.book_bot.book_api",
+}
+
+PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {bot_dir!r})
+start = time.perf_counter()
+{scenario}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed,
+                  "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "bs4_loaded": "bs4" in sys.modules,
+                  "database_connections": sum(type(o).__name__ == "BookDatabase"
+                                              for o in __import__("gc").get_objects())}}))
+"""
+
+
+def run_scenario(name: str, runs: int, database: str) -> dict:
+    """
+    Runs one scenario ``runs`` times in fresh interpreters and summarises the measurements.
+    """
+    environment = dict(os.environ, MYSCRIBE_DATABASE=database,
+                       TELEGRAM_BOT_TOKEN=os.getenv("TELEGRAM_BOT_TOKEN", "0:bench"))
+    probe = PROBE.format(bot_dir=common.BOT_DIR, scenario=SCENARIOS[name])
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", probe], env=environment, check=True, capture_output=True,
+                                text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    seconds = sorted(sample["seconds"] * 1_000_000 for sample in samples)
+    return {"median_us": round(statistics.median(seconds), 1),
+            "min_us": round(seconds[0], 1),
+            "max_rss_kb": max(sample["max_rss_kb"] for sample in samples),
+            "bs4_loaded": samples[-1]["bs4_loaded"],
+            "database_connections": samples[-1]["database_connections"],
+            "runs": runs}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per scenario")
+    parser.add_argument("--threshold", type=float, default=0.20, help="allowed slowdown before failing (fraction)")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    database = common.create_database(100)
+    try:
+        results = {f"startup.{name}": run_scenario(name, args.runs, database) for name in SCENARIOS}
+    finally:
+        os.remove(database)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    for name, measurement in results.items():
+        print(f"{name:<28} median {measurement['median_us'] / 1000:>9.1f} ms   max RSS {measurement['max_rss_kb']:>8} kB"
+              f"   bs4 loaded: {measurement['bs4_loaded']}   BookDatabase instances: "
+              f"{measurement['database_connections']}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline found. Run with --save-baseline to create one.")
+        return 0
+
+    regressions = common.compare_with_baseline(results, args.baseline, args.threshold)
+    regressions += common.compare_with_baseline(results, args.baseline, args.threshold, metric="max_rss_kb")
+    for name, previous, current, change in regressions:
+        print(f"REGRESSION {name}: {previous} -> {current} (+{change:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
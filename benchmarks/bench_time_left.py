@@ -0,0 +1,140 @@
+"""
+Cost of recomputing every stored reading time left, e.g. after AVG_WORDS_PER_PAGE changed.
+
+A database with ``--rows`` reading rows (a reader has four books on average, from a catalogue of BOOKS) is recomputed
+in three ways:
+    row_by_row   update_reading_time_left per row, three lookups and a commit each; timed on a sample and
+                 extrapolated to all rows
+    set_based    BookDatabase.recompute_time_left: one UPDATE joining users and books per batch of rows
+    unchanged    the same pass again, with every value already up to date (nothing is rewritten)
+
+While each set-based pass runs, a second thread keeps updating single reading rows, as the bot does on progress
+messages, and records how long each write took; the batch size bounds how long those writes wait. The set-based pass
+is run with the default batch size and as one transaction for comparison.
+
+Usage:
+    python benchmarks/bench_time_left.py                 # 1M reading rows
+    python benchmarks/bench_time_left.py --rows 100000 --sample 2000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "time_left.json")
+BOOKS = 10_000
+BOOKS_PER_READER = 4
+
+
+def create_reading_database(rows: int) -> str:
+    """
+    Creates a database with the production schema, BOOKS books and ``rows`` reading rows without a time left.
+    """
+    handle, path = tempfile.mkstemp(prefix=f"myscribe-bench-time-left-{rows}-", suffix=".db")
+    os.close(handle)
+    conn = sqlite3.connect(path)
+    conn.executescript(common.SCHEMA)
+    conn.executemany("INSERT INTO books (id, title, author, total_pages) VALUES (?,?,?,?)",
+                     ((i, f"book {i}", f"author {i % 997}", 200 + i % 600) for i in range(1, BOOKS + 1)))
+    readers = max(1, rows // BOOKS_PER_READER)
+    conn.executemany("INSERT INTO users (id, first_name, reading_speed) VALUES (?,?,?)",
+                     ((i, f"user {i}", 150 + i % 300) for i in range(1, readers + 1)))
+    generator = random.Random(rows)
+    conn.executemany("INSERT INTO books_and_users (user_id, book_id, book_status, pages_read) VALUES (?,?,?,?)",
+                     ((1 + i % readers, generator.randint(1, BOOKS), 1, generator.randint(0, 199))
+                      for i in range(rows)))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def timed_pass(book_database, batch_size: int, rows: int) -> dict:
+    """
+    Runs one set-based recompute while another thread keeps writing single reading rows.
+    """
+    write_latencies = []
+    done = threading.Event()
+
+    def writer() -> None:
+        generator = random.Random(0)
+        while not done.is_set():
+            start = time.perf_counter()
+            book_database.execute_write("UPDATE books_and_users SET rating = ? WHERE rowid = ?",
+                                        (generator.randint(1, 5), generator.randint(1, rows)))
+            write_latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    start = time.perf_counter()
+    updated = book_database.recompute_time_left(batch_size)
+    duration = time.perf_counter() - start
+    done.set()
+    thread.join()
+    write_latencies.sort()
+    return {"seconds": round(duration, 3), "rows_updated": updated,
+            "rows_per_second": round(rows / duration), "batch_size": batch_size,
+            "concurrent_writes": len(write_latencies),
+            "write_p99_ms": round(write_latencies[int(len(write_latencies) * 0.99) - 1], 2)
+            if write_latencies else None,
+            "write_max_ms": round(write_latencies[-1], 2) if write_latencies else None}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="reading rows in the synthetic database")
+    parser.add_argument("--sample", type=int, default=5000, help="rows timed for the row-by-row extrapolation")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    path = create_reading_database(args.rows)
+    os.environ["MYSCRIBE_DATABASE"] = path
+    from book_database import TIME_LEFT_BATCH_SIZE, BookDatabase
+
+    results = {}
+    try:
+        book_database = BookDatabase(write_behind=False)
+        sample = book_database.cur.execute("SELECT books_and_users.user_id, books.title FROM books_and_users "
+                                           "JOIN books ON books.id = books_and_users.book_id "
+                                           "WHERE books_and_users.rowid <= ?", (args.sample,)).fetchall()
+        start = time.perf_counter()
+        for telegram_id, title in sample:
+            book_database.update_reading_time_left(telegram_id, title)
+        per_row = (time.perf_counter() - start) / len(sample)
+        results[f"time_left.row_by_row[{args.rows}]"] = {"seconds": round(per_row * args.rows, 3),
+                                                         "rows_per_second": round(1 / per_row),
+                                                         "extrapolated_from": len(sample)}
+
+        for name, batch_size in (("set_based", TIME_LEFT_BATCH_SIZE), ("set_based_one_transaction", args.rows)):
+            with book_database.lock:
+                book_database.conn.execute("UPDATE books_and_users SET time_left = NULL")
+                book_database.conn.commit()
+            results[f"time_left.{name}[{args.rows}]"] = timed_pass(book_database, batch_size, args.rows)
+        results[f"time_left.unchanged[{args.rows}]"] = timed_pass(book_database, TIME_LEFT_BATCH_SIZE, args.rows)
+        book_database.close()
+    finally:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    for name, measurement in results.items():
+        line = f"{name:<46} {measurement['seconds']:>9.2f} s   {measurement['rows_per_second']:>10} rows/s"
+        if "write_p99_ms" in measurement:
+            line += (f"   concurrent write p99 {measurement['write_p99_ms']} ms, "
+                     f"max {measurement['write_max_ms']} ms")
+        print(line)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Latency of the inline title autocomplete against catalogues of growing size.
+
+For each size an in-memory TitleIndex is filled with that many synthetic books made of common English words, then
+timed on the queries users type: a title prefix, a word from the middle of a title, an author prefix, a misspelled
+title (answered by the trigram fallback) and a one-letter prefix (the widest range). Every operation should stay well
+under the 10 ms answer budget; the script exits with status 1 if a p95 does not.
+
+Usage:
+    python benchmarks/bench_title_index.py                         # 1k, 10k and 100k books
+    python benchmarks/bench_title_index.py --sizes 1000 500000 --repeat 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "title_index.json")
+BUDGET_US = 10_000
+WORDS = ("the", "of", "and", "a", "night", "house", "river", "secret", "garden", "war", "peace", "dark", "light",
+         "king", "queen", "lost", "city", "winter", "summer", "shadow", "fire", "stone", "sea", "star", "road", "girl",
+         "boy", "time", "dream", "silent", "golden", "little", "last", "first", "wind", "mountain", "island", "book",
+         "song", "heart", "memory", "empire", "forest", "glass", "iron", "storm", "dune", "orchard", "lantern")
+NAMES = ("anna", "james", "maria", "john", "elena", "david", "sofia", "peter", "laura", "frank", "emily", "henry",
+         "olga", "victor", "nora", "hugo", "clara", "oscar", "ines", "tomas")
+
+
+def build_catalogue(books: int) -> list:
+    """
+    Synthetic ``(book_id, title, author, readers)`` rows with unique titles.
+    """
+    generator = random.Random(books)
+    rows, titles = [], set()
+    while len(rows) < books:
+        title = " ".join(generator.choice(WORDS) for _ in range(generator.randint(2, 6)))
+        if title in titles:
+            title = f"{title} {len(rows)}"
+        titles.add(title)
+        author = f"{generator.choice(NAMES)} {generator.choice(NAMES)}son"
+        rows.append((len(rows) + 1, title, author, int(generator.paretovariate(1.2)) - 1))
+    return rows
+
+
+def misspell(text: str, generator: random.Random) -> str:
+    position = generator.randrange(1, len(text) - 1)
+    return text[:position] + text[position + 1] + text[position] + text[position + 2:]
+
+
+def run(books: int, repeat: int) -> dict:
+    """
+    Measures autocomplete searches on an index of ``books`` books.
+    """
+    from title_index import TitleIndex
+
+    rows = build_catalogue(books)
+    index = TitleIndex()
+    start = time.perf_counter()
+    index.load(rows)
+    load_ms = (time.perf_counter() - start) * 1000
+    generator = random.Random(0)
+
+    def pick() -> tuple:
+        return rows[generator.randrange(len(rows))]
+
+    def title_prefix():
+        title = pick()[1]
+        index.search(title[:max(3, len(title) // 2)])
+
+    def middle_word():
+        words = pick()[1].split()
+        index.search(" ".join(words[1:]) if len(words) > 1 else words[0])
+
+    def author_prefix():
+        index.search(pick()[2][:6])
+
+    def misspelled_title():
+        index.search(misspell(pick()[1], generator))
+
+    def one_letter():
+        index.search(generator.choice("abcdefghilmnoprstw"))
+
+    def insert():
+        book_id = len(index) + 1
+        index.add(book_id, f"new book {book_id}", "new author")
+
+    results = {operation: common.measure(function, repeat=repeat)
+               for operation, function in (("title_prefix", title_prefix), ("middle_word", middle_word),
+                                           ("author_prefix", author_prefix), ("misspelled_title", misspelled_title),
+                                           ("one_letter", one_letter), ("insert", insert))}
+    results["load"] = {"duration_ms": round(load_ms, 1), "books": books}
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=(1_000, 10_000, 100_000), help="catalogue sizes")
+    parser.add_argument("--repeat", type=int, default=300, help="measured calls per operation")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    results, over_budget = {}, []
+    for books in args.sizes:
+        for operation, measurement in run(books, args.repeat).items():
+            name = f"title_index.{operation}[{books}]"
+            results[name] = measurement
+            if operation == "load":
+                print(f"{name:<40} {measurement['duration_ms']:>10.1f} ms")
+                continue
+            print(f"{name:<40} median {measurement['median_us']:>10.1f} us   p95 {measurement['p95_us']:>10.1f} us")
+            if operation != "insert" and measurement["p95_us"] > BUDGET_US:
+                over_budget.append(name)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    if over_budget:
+        print(f"Over the {BUDGET_US / 1000:.0f} ms budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Commit throughput of BookDatabase mutations with and without write-behind group commit.
+
+Several threads, one per simulated user, each issue a stream of progress mutations (update_user_reading_speed and
+insert_book_rating). The benchmark reports mutations per second, SQLite commits per second and mutations per
+commit for both modes.
+
+Usage:
+    python benchmarks/bench_write_behind.py --users 8 --operations 500
+    python benchmarks/bench_write_behind.py --save-baseline
+"""
+import argparse
+import os
+import shutil
+import sys
+import threading
+import time
+
+import common
+
+RESULTS_PATH = os.path.join(common.BENCHMARKS_DIR, "results", "write_behind.json")
+BASELINE_PATH = os.path.join(common.BENCHMARKS_DIR, "baseline", "write_behind.json")
+
+
+def run(write_behind: bool, users: int, operations: int) -> dict:
+    """
+    Runs the mutation workload against a fresh database and returns its throughput.
+    """
+    path = common.create_database(max(users, 100))
+    os.environ["MYSCRIBE_DATABASE"] = path
+    from book_database import BookDatabase
+    from metrics import DEPENDENCY_CALLS
+
+    book_database = BookDatabase(write_behind=write_behind)
+    commits_before = DEPENDENCY_CALLS.values.get(("sqlite", "COMMIT"), 0)
+
+    def user_session(telegram_id: int):
+        for operation in range(operations):
+            if operation % 2:
+                book_database.update_user_reading_speed(telegram_id, 200 + operation % 100)
+            else:
+                book_database.insert_book_rating(telegram_id, f"book {telegram_id}", 1 + operation % 5)
+
+    sessions = [threading.Thread(target=user_session, args=(user,)) for user in range(1, users + 1)]
+    start = time.perf_counter()
+    for session in sessions:
+        session.start()
+    for session in sessions:
+        session.join()
+    # Shutdown flush is part of the cost: nothing counts until it is durable
+    book_database.close()
+    elapsed = time.perf_counter() - start
+
+    commits = DEPENDENCY_CALLS.values.get(("sqlite", "COMMIT"), 0) - commits_before
+    os.remove(path)
+    mutations = users * operations
+    return {"mutations_per_second": round(mutations / elapsed, 1),
+            "commits_per_second": round(commits / elapsed, 1),
+            "mutations_per_commit": round(mutations / max(commits, 1), 2),
+            # Seconds per mutation in the format compare_with_baseline expects
+            "median_us": round(elapsed / mutations * 1_000_000, 3),
+            "seconds": round(elapsed, 3)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8, help="concurrent simulated users")
+    parser.add_argument("--operations", type=int, default=500, help="mutations per user")
+    parser.add_argument("--threshold", type=float, default=0.20, help="allowed slowdown before failing (fraction)")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+
+    common.use_bot_modules()
+    results = {"write_behind.off": run(False, args.users, args.operations),
+               "write_behind.on": run(True, args.users, args.operations)}
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    common.save_results(results, args.output)
+    for name, measurement in results.items():
+        print(f"{name:<18} {measurement['mutations_per_second']:>10.1f} mutations/s "
+              f"{measurement['commits_per_second']:>10.1f} commits/s "
+              f"{measurement['mutations_per_commit']:>8.2f} mutations/commit")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    regressions = common.compare_with_baseline(results, args.baseline, args.threshold)
+    for name, previous, current, change in regressions:
+        print(f"REGRESSION {name}: {previous:.1f} us/mutation -> {current:.1f} us/mutation (+{change:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Shared helpers for the MyScribe benchmark scripts.
+
+Every script in this folder imports the bot modules the same way ``main.py`` does (flat imports from ``bot/``), builds
+a throwaway SQLite database with the production schema and writes its measurements as JSON so runs can be compared
+against a stored baseline.
+"""
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "bot")
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+
+# Same layout as the tables in bot/myscribe.db
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS "users" (
+    "id" INTEGER,
+    "first_name" TEXT,
+    "reading_speed" INTEGER NOT NULL,
+    PRIMARY KEY("id")
+);
+CREATE TABLE IF NOT EXISTS "book_status" (
+    "id" INTEGER,
+    "status" TEXT NOT NULL,
+    PRIMARY KEY("id")
+);
+CREATE TABLE IF NOT EXISTS "books_and_users" (
+    "user_id" INTEGER NOT NULL,
+    "book_id" INTEGER NOT NULL,
+    "book_status" INTEGER NOT NULL,
+    "pages_read" INTEGER,
+    "time_left" INTEGER,
+    "rating" INTEGER
+);
+CREATE TABLE IF NOT EXISTS "books" (
+    "id" INTEGER,
+    "title" TEXT NOT NULL UNIQUE,
+    "author" TEXT NOT NULL,
+    "genre" NUMERIC,
+    "language" TEXT,
+    "total_pages" INTEGER NOT NULL,
+    "isbn13" INTEGER UNIQUE,
+    "description" TEXT,
+    "book_cover_url" TEXT,
+    PRIMARY KEY("id" AUTOINCREMENT)
+);
+"""
+
+DESCRIPTION = ("A synthetic description used to give benchmark rows a realistic width. " * 40).strip()
+
+
+def use_bot_modules() -> None:
+    """
+    Makes the flat ``bot/`` modules importable from a benchmark script.
+    """
+    if BOT_DIR not in sys.path:
+        sys.path.insert(0, BOT_DIR)
+
+
+def create_database(rows: int, path: str | None = None) -> str:
+    """
+    Creates a synthetic MyScribe database with the given number of books, users and reading rows.
+
+    Args:
+        rows (int): Number of rows to generate in each of ``books``, ``users`` and ``books_and_users``.
+        path (str | None): Where to create the database. A temporary file is used if not given.
+
+    Returns:
+        str: The path of the created database.
+    """
+    if path is None:
+        handle, path = tempfile.mkstemp(prefix=f"myscribe-bench-{rows}-", suffix=".db")
+        os.close(handle)
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO book_status (id, status) VALUES (?,?)",
+                     [(1, "currently reading"), (2, "completed"), (3, "wishlist")])
+    conn.executemany(
+        "INSERT INTO books (id, title, author, genre, language, total_pages, isbn13, description, book_cover_url) "
+        "VALUES (?,?,?,?,?,?,?,?,?)",
+        ((i, f"book {i}", f"author {i % 997}", "fiction", "english", 200 + i % 600, 9780000000000 + i,
+          DESCRIPTION, f"http://covers.example/{i}.jpg") for i in range(1, rows + 1)))
+    conn.executemany("INSERT INTO users (id, first_name, reading_speed) VALUES (?,?,?)",
+                     ((i, f"user {i}", 150 + i % 300) for i in range(1, rows + 1)))
+    conn.executemany(
+        "INSERT INTO books_and_users (user_id, book_id, book_status, pages_read, time_left) VALUES (?,?,?,?,?)",
+        ((i, i, 1 + i % 3, i % 150, None) for i in range(1, rows + 1)))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def measure(function, repeat: int = 200, warmup: int = 10) -> dict:
+    """
+    Times a zero-argument callable.
+
+    Args:
+        function: The callable to time.
+        repeat (int): Number of measured calls.
+        warmup (int): Number of unmeasured calls made first.
+
+    Returns:
+        dict: Median, p95, mean and min latency in microseconds plus the number of calls.
+    """
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1_000_000)
+    samples.sort()
+    return {"median_us": round(statistics.median(samples), 3),
+            "p95_us": round(samples[int(len(samples) * 0.95) - 1], 3),
+            "mean_us": round(statistics.fmean(samples), 3),
+            "min_us": round(samples[0], 3),
+            "calls": repeat}
+
+
+def environment() -> dict:
+    """
+    Describes the machine a benchmark ran on so results are only compared like for like.
+    """
+    return {"python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "machine": platform.machine()}
+
+
+def save_results(results: dict, path: str) -> None:
+    """
+    Writes benchmark results as JSON.
+    """
+    with open(path, "w") as results_file:
+        json.dump({"environment": environment(), "results": results}, results_file, indent=2, sort_keys=True)
+
+
+def compare_with_baseline(results: dict, baseline_path: str, threshold: float, metric: str = "median_us") -> list:
+    """
+    Compares results against a stored baseline.
+
+    Args:
+        results (dict): Mapping of benchmark name to its measurement dict.
+        baseline_path (str): Path of the baseline JSON written by ``save_results``.
+        threshold (float): Allowed slowdown as a fraction, e.g. 0.2 for 20 %.
+        metric (str): Which measurement to compare.
+
+    Returns:
+        list: One ``(name, baseline, current, change)`` tuple per benchmark that regressed beyond the threshold.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or metric not in previous or not previous[metric]:
+            continue
+        change = (current[metric] - previous[metric]) / previous[metric]
+        if change > threshold:
+            regressions.append((name, previous[metric], current[metric], change))
+    return regressions
@@ -0,0 +1,253 @@
+import collections
+import datetime
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import InstrumentedConnection, REGISTRY
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Daily request quotas of the Google API keys, per API
+DAILY_QUOTAS = {
+    "google_books": int(os.getenv("MYSCRIBE_GOOGLE_BOOKS_DAILY_QUOTA", 1000)),
+    "google_cse": int(os.getenv("MYSCRIBE_GOOGLE_CSE_DAILY_QUOTA", 100)),
+}
+# Share of each quota kept in reserve: past this point only cached responses are served
+QUOTA_RESERVE = float(os.getenv("MYSCRIBE_QUOTA_RESERVE", 0.05))
+API_CACHE_SIZE = int(os.getenv("MYSCRIBE_API_CACHE_SIZE", 1000))
+API_CACHE_TTL_SECONDS = int(os.getenv("MYSCRIBE_API_CACHE_TTL", 24 * 60 * 60))
+
+COALESCED_CALLS = REGISTRY.counter("myscribe_api_coalesced_total",
+                                   "Google API lookups that shared another caller's in-flight request.", ("api",))
+CACHE_HITS = REGISTRY.counter("myscribe_api_cache_hits_total",
+                              "Google API lookups answered from the response cache.", ("api",))
+QUOTA_USED = REGISTRY.counter("myscribe_api_quota_used_total",
+                              "Google API requests charged to the daily quota.", ("api",))
+QUOTA_REJECTED = REGISTRY.counter("myscribe_api_quota_rejected_total",
+                                  "Google API lookups refused because the daily quota is nearly exhausted.", ("api",))
+QUOTA_REMAINING = REGISTRY.gauge("myscribe_api_quota_remaining",
+                                 "Google API requests left today before the reserve.", ("api",))
+
+
+class QuotaExhausted(Exception):
+    """
+    Raised instead of calling an API whose daily quota is nearly used up.
+    """
+
+
+def _quota_day() -> str:
+    # Google resets API quotas at midnight Pacific time
+    now = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=8)
+    return now.date().isoformat()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the call, the others wait for and share its
+    result (or exception).
+    """
+
+    class _Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def do(self, key, function):
+        """
+        Runs ``function()`` unless a call with the same key is in flight, in which case its outcome is shared.
+
+        Returns:
+            tuple: The result, and whether it was shared from another caller.
+        """
+        with self.lock:
+            call = self.in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self.in_flight[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            call.done.set()
+        return call.result, False
+
+
+class QuotaBudget:
+    """
+    Daily request budget per Google API key, stored in the bot's database so every worker process and restart
+    draws from the same count.
+    """
+
+    def __init__(self, database_path: str | None = None, quotas: dict | None = None, reserve: float = QUOTA_RESERVE):
+        """
+        Args:
+            database_path (str | None): SQLite file, MYSCRIBE_DATABASE by default.
+            quotas (dict | None): Daily quota per API name, DAILY_QUOTAS by default.
+            reserve (float): Share of each quota that is never spent.
+        """
+        self.quotas = quotas or DAILY_QUOTAS
+        self.reserve = reserve
+        self.conn = sqlite3.connect(database_path or os.getenv("MYSCRIBE_DATABASE"), check_same_thread=False,
+                                    factory=InstrumentedConnection)
+        self.lock = threading.Lock()
+        self.current_day = None
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS api_quota ("
+                              "api TEXT NOT NULL, "
+                              "key_id TEXT NOT NULL, "
+                              "day TEXT NOT NULL, "
+                              "calls INTEGER NOT NULL, "
+                              "PRIMARY KEY (api, key_id, day))")
+            self.conn.commit()
+
+    def limit(self, api: str) -> int:
+        """
+        Requests per day that may be spent on the API, i.e. its quota minus the reserve.
+        """
+        return int(self.quotas.get(api, 0) * (1 - self.reserve))
+
+    def try_consume(self, api: str, api_key: str | None) -> bool:
+        """
+        Charges one request to the API key's budget for today.
+
+        Args:
+            api (str): The API name, a key of the quotas.
+            api_key (str | None): The API key the request is made with; only a hash of it is stored.
+
+        Returns:
+            bool: False if the budget is spent and the request must not be made.
+        """
+        limit = self.limit(api)
+        key_id = hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+        day = _quota_day()
+        with self.lock:
+            if day != self.current_day:
+                # Yesterday's counts are no longer needed
+                self.conn.execute("DELETE FROM api_quota WHERE day < ?", (day,))
+                self.current_day = day
+            row = self.conn.execute("INSERT INTO api_quota (api, key_id, day, calls) VALUES (?,?,?,1) "
+                                    "ON CONFLICT (api, key_id, day) DO UPDATE SET calls = calls + 1 "
+                                    "WHERE calls < ? RETURNING calls",
+                                    (api, key_id, day, limit)).fetchone()
+            self.conn.commit()
+        if row is None or row[0] > limit:
+            QUOTA_REJECTED.inc(api=api)
+            QUOTA_REMAINING.set(0, api=api)
+            return False
+        QUOTA_USED.inc(api=api)
+        QUOTA_REMAINING.set(limit - row[0], api=api)
+        return True
+
+
+class ApiBudget:
+    """
+    Front door for quota-limited Google API lookups.
+
+    Identical concurrent lookups share one in-flight request, recent responses are served from a bounded cache, and
+    new requests are only made while the key's daily budget lasts. Once it is nearly spent lookups degrade to
+    cache-only: cache misses raise QuotaExhausted and callers fall back to what the database knows.
+    """
+
+    def __init__(self, quota_budget: QuotaBudget | None = None, cache_size: int = API_CACHE_SIZE,
+                 cache_ttl_seconds: int = API_CACHE_TTL_SECONDS):
+        """
+        Args:
+            quota_budget (QuotaBudget | None): Persistent daily budget. By default one on MYSCRIBE_DATABASE is opened
+                when the first request has to be made.
+            cache_size (int): Responses kept in the cache.
+            cache_ttl_seconds (int): How long a cached response is served.
+        """
+        self._quota_budget = quota_budget
+        self.single_flight = SingleFlight()
+        self.cache_size = cache_size
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.cache = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    @property
+    def quota_budget(self) -> QuotaBudget:
+        if self._quota_budget is None:
+            with self.cache_lock:
+                if self._quota_budget is None:
+                    self._quota_budget = QuotaBudget()
+        return self._quota_budget
+
+    def _cached(self, key):
+        with self.cache_lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.cache[key]
+                return None
+            self.cache.move_to_end(key)
+            return entry
+
+    def _store(self, key, value) -> None:
+        with self.cache_lock:
+            self.cache[key] = (time.monotonic() + self.cache_ttl_seconds, value)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def call(self, api: str, api_key: str | None, request_key, fetch):
+        """
+        Returns the response for a lookup, fetching it at most once across concurrent callers.
+
+        Args:
+            api (str): The API name, a key of the quotas.
+            api_key (str | None): The API key ``fetch`` uses.
+            request_key: Hashable identity of the request, e.g. the normalised query.
+            fetch: Zero-argument callable making the request and returning the response.
+
+        Returns:
+            The response.
+
+        Raises:
+            QuotaExhausted: If the response is not cached and the daily budget is spent.
+        """
+        key = (api, request_key)
+        entry = self._cached(key)
+        if entry is not None:
+            CACHE_HITS.inc(api=api)
+            return entry[1]
+
+        def fetch_within_budget():
+            # Another caller may have stored the response while this one waited for the lock
+            cached = self._cached(key)
+            if cached is not None:
+                return cached[1]
+            if not self.quota_budget.try_consume(api, api_key):
+                log_event(logger, logging.WARNING, "api_quota_exhausted", api=api)
+                raise QuotaExhausted(api)
+            response = fetch()
+            self._store(key, response)
+            return response
+
+        response, shared = self.single_flight.do(key, fetch_within_budget)
+        if shared:
+            COALESCED_CALLS.inc(api=api)
+        return response
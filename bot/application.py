@@ -0,0 +1,117 @@
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Application:
+    """
+    Composition root of the bot.
+
+    Builds exactly one instance of every shared resource and hands the same instance to everything that needs it.
+    Nothing is built until first asked for, and the Google Books / web scraping stack (requests, bs4) is only imported
+    when a book actually has to be looked up outside the database.
+
+    Example:
+        Application().chatbot.chat()
+    """
+
+    def __init__(self):
+        self._instances = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, factory):
+        """
+        Returns the shared instance registered under ``name``, building it with ``factory`` on first use.
+        """
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._instances[name] = factory()
+        return instance
+
+    def is_built(self, name: str) -> bool:
+        """
+        Tells whether a subsystem has been built yet, e.g. ``app.is_built("book_webscraping")``.
+        """
+        return name in self._instances
+
+    @property
+    def book_database(self):
+        def build():
+            from backup import SnapshotReader
+            from book_database import BookDatabase
+            return BookDatabase(analytics=SnapshotReader(self.database_backup))
+        return self._get("book_database", build)
+
+    @property
+    def telegram_bot(self):
+        def build():
+            from telegram_bot import TelegramBot
+            return TelegramBot()
+        return self._get("telegram_bot", build)
+
+    @property
+    def api_budget(self):
+        def build():
+            from api_budget import ApiBudget
+            return ApiBudget()
+        return self._get("api_budget", build)
+
+    @property
+    def database_backup(self):
+        def build():
+            from backup import DatabaseBackup
+            return DatabaseBackup(job_queue=self.job_queue)
+        return self._get("database_backup", build)
+
+    @property
+    def job_queue(self):
+        def build():
+            from job_queue import JobQueue
+            return JobQueue()
+        return self._get("job_queue", build)
+
+    @property
+    def book_webscraping(self):
+        def build():
+            from book_webscraping import BookWebScraping
+            return BookWebScraping(api_budget=self.api_budget)
+        return self._get("book_webscraping", build)
+
+    @property
+    def book_api(self):
+        def build():
+            from book_api import BookApi
+            return BookApi(book_webscraping_provider=lambda: self.book_webscraping, api_budget=self.api_budget,
+                           job_queue=self.job_queue)
+        return self._get("book_api", build)
+
+    @property
+    def book_bot(self):
+        def build():
+            from book_bot import BookBot
+            return BookBot(book_database=self.book_database,
+                           book_api_provider=lambda: self.book_api,
+                           book_webscraping_provider=lambda: self.book_webscraping,
+                           job_queue=self.job_queue)
+        return self._get("book_bot", build)
+
+    @property
+    def conversation_store(self):
+        def build():
+            from conversation_store import ConversationStore
+            return ConversationStore()
+        return self._get("conversation_store", build)
+
+    @property
+    def chatbot(self):
+        def build():
+            from chatbot import ChatBot
+            return ChatBot(telegram_bot=self.telegram_bot, book_bot=self.book_bot, book_database=self.book_database,
+                           conversation_store=self.conversation_store, job_queue=self.job_queue,
+                           database_backup=self.database_backup)
+        return self._get("chatbot", build)
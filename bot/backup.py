@@ -0,0 +1,241 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Where backups are written, a "backups" folder next to MYSCRIBE_DATABASE by default
+BACKUP_DIR = os.getenv("MYSCRIBE_BACKUP_DIR")
+# Seconds between two scheduled backups; 0 disables them
+BACKUP_INTERVAL_SECONDS = float(os.getenv("MYSCRIBE_BACKUP_INTERVAL", 6 * 60 * 60))
+# Pages copied per backup step, and the pause between steps that leaves the database to the bot
+BACKUP_PAGES_PER_STEP = int(os.getenv("MYSCRIBE_BACKUP_PAGES", 256))
+BACKUP_STEP_PAUSE_SECONDS = float(os.getenv("MYSCRIBE_BACKUP_STEP_PAUSE", 0.005))
+# Rotation: backups beyond the newest BACKUP_KEEP, or older than BACKUP_MAX_AGE seconds (0: no limit), are deleted.
+# The newest backup is always kept
+BACKUP_KEEP = int(os.getenv("MYSCRIBE_BACKUP_KEEP", 8))
+BACKUP_MAX_AGE_SECONDS = float(os.getenv("MYSCRIBE_BACKUP_MAX_AGE", 7 * 24 * 60 * 60))
+
+BACKUP_JOB = "database_backup"
+BACKUP_PREFIX = "myscribe-"
+BACKUP_SUFFIX = ".db"
+
+BACKUPS = REGISTRY.counter("myscribe_backups_total", "Database backups by result.", ("result",))
+BACKUP_DURATION = REGISTRY.histogram("myscribe_backup_seconds", "Time one database backup took.",
+                                     buckets=(1, 5, 15, 30, 60, 120, 300, 600))
+BACKUP_SIZE = REGISTRY.gauge("myscribe_backup_bytes", "Size of the latest database backup.")
+LAST_BACKUP = REGISTRY.gauge("myscribe_backup_last_success_timestamp", "Unix time of the latest database backup.")
+
+
+def default_backup_dir(database_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(database_path)), "backups")
+
+
+class DatabaseBackup:
+    """
+    Online backups of the bot's database into rotated snapshot files, using SQLite's backup API.
+
+    A backup copies ``pages_per_step`` pages at a time and pauses in between, so the bot's own reads and writes are
+    only ever held up by one small step. The copy runs inside one read transaction of its own connection: in WAL mode
+    that fixes the snapshot being copied without blocking writers, and keeps writes made meanwhile from restarting it.
+    The file is written under a temporary name and renamed when complete, so every ``myscribe-*.db`` in the backup
+    folder is a consistent, finished snapshot.
+
+    Backups are scheduled as ``database_backup`` jobs on the job queue, one per ``interval`` slot. The dedup key makes
+    sure only one bot process takes each backup.
+    """
+
+    def __init__(self, database_path: str | None = None, backup_dir: str | None = BACKUP_DIR,
+                 interval: float = BACKUP_INTERVAL_SECONDS, pages_per_step: int = BACKUP_PAGES_PER_STEP,
+                 step_pause: float = BACKUP_STEP_PAUSE_SECONDS, keep: int = BACKUP_KEEP,
+                 max_age: float = BACKUP_MAX_AGE_SECONDS, job_queue=None):
+        """
+        Args:
+            database_path (str | None): SQLite file to back up, MYSCRIBE_DATABASE by default.
+            backup_dir (str | None): Folder of the snapshots, see ``default_backup_dir``.
+            interval (float): Seconds between scheduled backups; 0 disables scheduling.
+            pages_per_step (int): Pages copied per backup step; -1 copies the whole file in one step.
+            step_pause (float): Seconds slept between two steps.
+            keep (int): Snapshots kept by ``rotate``.
+            max_age (float): Seconds after which ``rotate`` deletes a snapshot; 0 for no limit.
+            job_queue (JobQueue | None): Queue the scheduled backups run on.
+        """
+        self.database_path = database_path or os.getenv("MYSCRIBE_DATABASE")
+        self.backup_dir = backup_dir or default_backup_dir(self.database_path)
+        self.interval = interval
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        self.keep = keep
+        self.max_age = max_age
+        self.job_queue = job_queue
+
+    def backup(self) -> str:
+        """
+        Copies the database into a new snapshot file.
+
+        Returns:
+            str: Path of the snapshot.
+
+        Raises:
+            sqlite3.Error: If the copy failed; no snapshot file is left behind then.
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        path = os.path.join(self.backup_dir, f"{BACKUP_PREFIX}{time.strftime('%Y%m%d-%H%M%S')}{BACKUP_SUFFIX}")
+        partial_path = path + ".partial"
+        started = time.perf_counter()
+        source = sqlite3.connect(self.database_path)
+        target = sqlite3.connect(partial_path)
+        try:
+            # One read transaction for the whole copy: a fixed snapshot that writes from other connections don't
+            # restart
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            # backup() itself only sleeps after a busy step, so the pause between steps is taken in the callback
+            source.backup(target, pages=self.pages_per_step, progress=self._pause)
+            source.rollback()
+            target.close()
+            os.replace(partial_path, path)
+        except sqlite3.Error as e:
+            target.close()
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            BACKUPS.inc(result="failed")
+            log_event(logger, logging.ERROR, "database_backup_failed", error=str(e))
+            raise
+        finally:
+            source.close()
+        duration = time.perf_counter() - started
+        size = os.path.getsize(path)
+        BACKUPS.inc(result="done")
+        BACKUP_DURATION.observe(duration)
+        BACKUP_SIZE.set(size)
+        LAST_BACKUP.set(time.time())
+        log_event(logger, logging.INFO, "database_backup_written", path=path, bytes=size,
+                  duration_ms=round(duration * 1000, 1))
+        return path
+
+    def _pause(self, status: int, remaining: int, total: int) -> None:
+        if remaining and self.step_pause:
+            time.sleep(self.step_pause)
+
+    def snapshots(self) -> list:
+        """
+        Paths of the finished snapshots, oldest first.
+        """
+        try:
+            names = os.listdir(self.backup_dir)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.backup_dir, name) for name in sorted(names)
+                if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)]
+
+    def latest_snapshot(self) -> str | None:
+        snapshots = self.snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def rotate(self) -> list:
+        """
+        Deletes the snapshots beyond the newest ``keep`` and those older than ``max_age``. The newest one is kept.
+
+        Returns:
+            list: Paths of the deleted snapshots.
+        """
+        snapshots = self.snapshots()
+        expired = snapshots[:-max(1, self.keep)]
+        if self.max_age:
+            oldest_kept = time.time() - self.max_age
+            expired += [path for path in snapshots[-max(1, self.keep):-1] if os.path.getmtime(path) < oldest_kept]
+        for path in expired:
+            os.remove(path)
+        if expired:
+            log_event(logger, logging.INFO, "database_backups_rotated", deleted=len(expired),
+                      kept=len(snapshots) - len(expired))
+        return expired
+
+    def schedule(self) -> int | None:
+        """
+        Enqueues the backup of the next ``interval`` slot, unless a process already did.
+
+        Returns:
+            int | None: The job id, or None if scheduled backups are disabled.
+        """
+        if self.job_queue is None or self.interval <= 0:
+            return None
+        now = time.time()
+        slot = int(now // self.interval) + 1
+        return self.job_queue.enqueue(BACKUP_JOB, {"slot": slot}, dedup_key=f"{BACKUP_JOB}:{slot}",
+                                      delay=slot * self.interval - now)
+
+    def run_job(self, payload: dict) -> dict:
+        """
+        ``database_backup`` job handler: backs up, rotates and schedules the next backup.
+        """
+        path = self.backup()
+        deleted = self.rotate()
+        self.schedule()
+        return {"path": path, "bytes": os.path.getsize(path), "deleted": len(deleted)}
+
+
+class SnapshotReader:
+    """
+    Read-only access to the latest backup snapshot, for heavy analytical queries (the local recommender, exports)
+    that should not compete with chat traffic on the live database.
+
+    The connection is opened with ``mode=ro&immutable=1``, since a finished snapshot never changes, so SQLite takes no
+    locks at all. When a newer snapshot has been written, the next query switches to it.
+    """
+
+    # Seconds between two looks for a newer snapshot
+    REFRESH_SECONDS = 60
+
+    def __init__(self, database_backup: DatabaseBackup):
+        """
+        Args:
+            database_backup (DatabaseBackup): Whose snapshots are read.
+        """
+        self.database_backup = database_backup
+        self.conn = None
+        self.path = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection | None:
+        if time.monotonic() - self.checked_at >= self.REFRESH_SECONDS:
+            self.checked_at = time.monotonic()
+            latest = self.database_backup.latest_snapshot()
+            if latest != self.path:
+                if self.conn is not None:
+                    self.conn.close()
+                self.conn = sqlite3.connect(f"file:{latest}?mode=ro&immutable=1", uri=True,
+                                            check_same_thread=False) if latest else None
+                self.path = latest
+        return self.conn
+
+    def query(self, sql: str, parameters: tuple = ()) -> list | None:
+        """
+        Runs a query on the latest snapshot.
+
+        Returns:
+            list | None: The rows, or None if there is no snapshot yet.
+
+        Raises:
+            sqlite3.Error: If the query failed.
+        """
+        with self.lock:
+            conn = self._connection()
+            if conn is None:
+                return None
+            return conn.execute(sql, parameters).fetchall()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = self.path = None
@@ -1,10 +1,17 @@
+import logging
 import os
 
 import requests
-from book_webscraping import BookWebScraping
 from dotenv import load_dotenv
+from api_budget import ApiBudget, QuotaExhausted
+from book_ranking import rank_search_result
+from book_record import BookRecord
+from circuit_breaker import UPSTREAM_TIMEOUT, circuit_breaker
+from metrics import track_dependency
+from structured_logging import log_event
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 class BookApi:
     """
@@ -14,32 +21,58 @@ class BookApi:
     API = os.getenv("GOOGLE_BOOKS_API")
     URL = os.getenv("GOOGLE_BOOKS_URL")
 
-    def __init__(self):
-        self.book_search_result = None
-        self.api_book_details = {'book_title': None,
-                                 'book_author': None,
-                                 'book_genre': None,
-                                 'book_total_page_count': None,
-                                 'book_isbn13': None,
-                                 'book_language': None,
-                                 'book_cover': None,
-                                 'book_description': None, }
-
-        self.books_ws = BookWebScraping()
-        self.api_search_result = None
-
-    def search_book_details(self, book_name: str, author_name: str = None) -> bool:
+    def __init__(self, book_webscraping_provider=None, api_budget: ApiBudget | None = None, job_queue=None):
         """
-        Searches for a specific book based on its title and author name using the Google Books API.
+        Args:
+            book_webscraping_provider: Optional zero-argument callable returning the shared BookWebScraping instance.
+                The scraping stack is only imported when the first book needs a genre and language lookup.
+            api_budget (ApiBudget | None): Coalesces, caches and budgets Google Books requests. Shared with
+                BookWebScraping when built by ``application.Application``.
+            job_queue (JobQueue | None): With a job queue, the Wikipedia genre and language lookup is left to the
+                ``enrich_book`` background job (see BookBot.enqueue_enrichment) instead of being made inline.
+        """
+        self.api_budget = api_budget or ApiBudget()
+        self.job_queue = job_queue
+
+        self._book_webscraping_provider = book_webscraping_provider
+        self._books_ws = None
+
+    @property
+    def books_ws(self):
+        """
+        The BookWebScraping instance used for genre and language lookups, created on first use.
+        """
+        if self._books_ws is None:
+            if self._book_webscraping_provider:
+                self._books_ws = self._book_webscraping_provider()
+            else:
+                from book_webscraping import BookWebScraping
+                self._books_ws = BookWebScraping(api_budget=self.api_budget)
+        return self._books_ws
+
+    @books_ws.setter
+    def books_ws(self, value) -> None:
+        self._books_ws = value
+
+    def search_book_details(self, book_name: str, author_name: str = None,
+                            preferred_author: str = None) -> dict | None:
+        """
+        Searches for a specific book based on its title and author name using the Google Books API. The results are
+        ordered best match first (see book_ranking.py).
+
+        One BookApi serves every chat, so the result is returned rather than kept; the caller keeps it per chat.
 
         Args:
             book_name: The title of the book.
             author_name: The author's name.
+            preferred_author: An author to rank results by without restricting the search to them.
 
         Returns:
-            dict: A dictionary containing the search results in JSON format.
+            dict | None: The ranked search result, or None if the search found no book.
+
+        Raises:
+            UpstreamUnavailable: If the Books API failed, timed out or its circuit is open.
         """
-        self.api_search_result = None
         # Construct the search query
         if author_name:
             query = f"intitle:{book_name}+inauthor{author_name}"
@@ -53,105 +86,78 @@ class BookApi:
             'key': self.API
         }
 
-        # Send a GET request to the Google Books API
-        response = requests.get(url=self.URL, params=book_search_parameters)
-
-        # Check for HTTP errors
-        response.raise_for_status()
+        def fetch_volumes() -> dict:
+            # Fails fast while the Books API is down instead of making every user wait out the timeout
+            with circuit_breaker("google_books").guard():
+                # Send a GET request to the Google Books API
+                with track_dependency("google_books", "volumes.list"):
+                    response = requests.get(url=self.URL, params=book_search_parameters, timeout=UPSTREAM_TIMEOUT)
+                # Check for HTTP errors
+                response.raise_for_status()
+                return response.json()
+
+        # Users asking for the same book at once share one request; near the daily quota only cached results are used
+        try:
+            search_result = self.api_budget.call("google_books", self.API, query.lower(), fetch_volumes)
+        except QuotaExhausted:
+            # Nothing new can be looked up today; the bot keeps working with the books already in the database
+            return None
+        # The best match is shown first instead of leaving the user to click "Next" through the API's order
+        search_result = rank_search_result(search_result, book_name, author_name or preferred_author,
+                                           inline_enrichment=self.job_queue is None)
 
         # Return the search result
-        self.api_search_result = response.json()
-        # print(self.api_search_result)
-        return self.api_search_result['totalItems'] != 0
+        return search_result if search_result.get('totalItems', 0) != 0 else None
 
-    def extract_book_details_from_api_result(self, search_result_count) -> dict | None:
+    def extract_book_details_from_api_result(self, search_result: dict | None,
+                                             search_result_count: int) -> BookRecord | None:
         """
         Get book details from the API response.
 
+        Every call parses into a new record, so nothing carries over from the previously shown result.
+
+        Args:
+            search_result (dict | None): A result of ``search_book_details``.
+            search_result_count (int): Index of the result to extract.
+
         Returns:
-        - dict: Dictionary containing book details.
+            BookRecord | None: The book's details, or None if there is no such result or it has no title.
         """
         try:
             # Attempt to retrieve volume information from the API response
-            current_result = self.api_search_result['items'][search_result_count]['volumeInfo']
-        except KeyError:
+            current_result = search_result['items'][search_result_count]['volumeInfo']
+        except (KeyError, IndexError, TypeError):
             # Handle the case where the expected keys are not present in the API response
             return None
 
         # GET Title
-        print(current_result)
-        try:
-            # Attempt to get the book title from the volume information
-            title = current_result['title']
-        except Exception as e:
-            # Handle any exception that may occur during title extraction
+        # The whole volumeInfo is only passed along when debug logging is enabled
+        log_event(logger, logging.DEBUG, "volume_info", result_index=search_result_count, volume_info=current_result)
+        title = current_result.get('title')
+        if not title:
             return None
-        else:
-            # Set the book title in the book_details dictionary
-            self.api_book_details['book_title'] = title
 
         # GET AUTHOR
-        try:
-            # Attempt to get the first author from the authors list
-            author = current_result['authors'][0]
-        except Exception as e:
-            # Handle any exception that may occur during author extraction
-            self.api_book_details['book_author'] = None
-        else:
-            # Set the book author in the book_details dictionary
-            self.api_book_details['book_author'] = author
-
-        # GET PAGE COUNT
-        try:
-            # Attempt to get the total page count from the volume information
-            total_page_count = current_result['pageCount']
-        except Exception as e:
-            # Handle any exception that may occur during page count extraction
-            self.api_book_details['book_total_page_count'] = None
-        else:
-            # Set the total page count in the book_details dictionary
-            self.api_book_details['book_total_page_count'] = total_page_count
-
-        # GET Description
-        try:
-            # Attempt to get the book description from the volume information
-            desc = current_result['description']
-        except Exception as e:
-            # Handle any exception that may occur during description extraction
-            self.api_book_details['book_description'] = None
-        else:
-            # Set the book description in the book_details dictionary
-            self.api_book_details['book_description'] = desc
+        # The first author of the authors list
+        authors = current_result.get('authors') or [None]
 
         # GET ISBN
-        try:
-            # Attempt to get the list of ISBNs from the volume information
-            isbn_list = current_result['industryIdentifiers']
-        except Exception as e:
-            # Handle any exception that may occur during ISBN extraction
-            self.api_book_details['book_isbn13'] = None
-        else:
-            # Iterate through the ISBN list and set the ISBN-13 in the book_details dictionary
-            for isbn in isbn_list:
-                if isbn['type'] == "ISBN_13":
-                    self.api_book_details['book_isbn13'] = isbn['identifier']
+        # The ISBN-13 among the industry identifiers, if there is one
+        isbn13 = next((isbn.get('identifier') for isbn in current_result.get('industryIdentifiers') or ()
+                       if isbn.get('type') == "ISBN_13"), None)
 
-        # GET BOOK COVER
-        try:
-            # Attempt to get the book cover URL from the volume information
-            book_cover = current_result['imageLinks']['thumbnail']
-        except Exception as e:
-            # Handle any exception that may occur during book cover URL extraction
-            self.api_book_details['book_cover'] = None
-        else:
-            # Set the book cover URL in the book_details dictionary
-            self.api_book_details['book_cover'] = book_cover
+        book = BookRecord(title=title,
+                          author=authors[0],
+                          total_pages=current_result.get('pageCount'),
+                          isbn13=isbn13,
+                          description=current_result.get('description'),
+                          cover_url=(current_result.get('imageLinks') or {}).get('thumbnail'))
 
         # GET BOOK GENRE AND LANGUAGE
-        if self.api_book_details['book_title'] and self.api_book_details['book_author']:
-            self.api_book_details['book_genre'], self.api_book_details[
-                'book_language'] = self.books_ws.get_book_genre_language_wikipedia(
-                self.api_book_details['book_title'], self.api_book_details['book_author'])
-
-        return self.api_book_details
+        # With a job queue they are filled in by a background job once the book is saved, so the user is not kept
+        # waiting on Wikipedia
+        if self.job_queue is None and book.author:
+            genre, language = self.books_ws.get_book_genre_language_wikipedia(book.title, book.author)
+            book = book.replace(genre=genre, language=language)
 
+        return book
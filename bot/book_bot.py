@@ -1,33 +1,89 @@
+import logging
 import re
-from book_api import BookApi
 from book_database import BookDatabase
-from book_webscraping import BookWebScraping
+from chat_context import ChatAttribute
+from circuit_breaker import UpstreamUnavailable
+from job_queue import JobQueue, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+# Separators between the entries of a progress log. "and" and commas also occur inside titles ("Pride and Prejudice"),
+# so they only separate entries when a page count sits right before or after them.
+PROGRESS_SEPARATOR = re.compile(r"\s*[;\n]\s*"
+                                r"|(?:(?<=\d)|(?<=pages)|(?<=page))\s*(?:,|&|\band\b)\s*"
+                                r"|\s*(?:,|&|\band\b)\s*(?=\d)", re.IGNORECASE)
+# "20 pages of Dune", "20 of Dune", "20 pp in Dune"
+PAGES_THEN_TITLE = re.compile(r"^(?:i\s+)?(?:have\s+)?(?:read\s+)?(?P<pages>\d+)\s*(?:pages?|pp?\.?|pgs?)?"
+                              r"\s+(?:of|from|in)\s+(?P<title>.+)$", re.IGNORECASE)
+# "Dune 20", "Dune: 20 pages", "Dune - 20"
+TITLE_THEN_PAGES = re.compile(r"^(?P<title>.+?)\s*[:\-\u2013]?\s*(?P<pages>\d+)\s*(?:pages?|pp?\.?|pgs?)?$",
+                              re.IGNORECASE)
 
 
 class BookBot:
     """
     Encapsulates book-related information and functionalities for a Telegram bot.
+
+    One BookBot serves every chat. The book being shown and the Books API search it came from are kept in the
+    ChatContext of the chat being handled (see chat_context.py), so chats handled at the same time do not see each
+    other's results.
     """
 
-    def __init__(self):
+    # The book currently shown to the user, from the API or the database
+    book = ChatAttribute("book")
+    # The chat's last Books API search, and how many of its results were shown
+    api_search_result = ChatAttribute("api_search_result")
+    api_search_result_count = ChatAttribute("api_search_result_count")
+    # Set when the last API lookup failed because the Books API is unavailable
+    api_unavailable = ChatAttribute("api_unavailable")
+
+    def __init__(self, book_database: BookDatabase | None = None, book_api_provider=None,
+                 book_webscraping_provider=None, job_queue: JobQueue | None = None):
         """
         Initializes book attributes and essential objects for interactions.
+
+        Args:
+            book_database (BookDatabase | None): The shared database. A new connection is opened if not given.
+            book_api_provider: Optional zero-argument callable returning the shared BookApi instance.
+            book_webscraping_provider: Optional zero-argument callable returning the shared BookWebScraping instance.
+            job_queue (JobQueue | None): Background queue for recommendations and enrichment. Without it that work
+                runs inline.
         """
-        self.book_caption = None
-        self.book_title = None
-        self.book_author = None
-        self.book_genre = None
-        self.book_total_page_count = None
-        self.book_language = None
-        self.book_isbn13 = None
-        self.book_description = None
-        self.book_cover = None
+        self.book_database = book_database or BookDatabase()
+        # The API and scraping stacks are only built when a book has to be looked up outside the database
+        self._book_api_provider = book_api_provider
+        self._book_webscraping_provider = book_webscraping_provider
+        self._book_api = None
+        self._book_webscraping = None
+        self.job_queue = job_queue
 
-        self.api_search_result_count = 0
+    @property
+    def book_api(self):
+        """
+        The BookApi instance, created on first use.
+        """
+        if self._book_api is None:
+            if self._book_api_provider:
+                self._book_api = self._book_api_provider()
+            else:
+                from book_api import BookApi
+                self._book_api = BookApi(book_webscraping_provider=lambda: self.book_webscraping,
+                                         job_queue=self.job_queue)
+        return self._book_api
 
-        self.book_api = BookApi()
-        self.book_database = BookDatabase()
-        self.book_webscraping = BookWebScraping()
+    @property
+    def book_webscraping(self):
+        """
+        The BookWebScraping instance, created on first use.
+        """
+        if self._book_webscraping is None:
+            if self._book_webscraping_provider:
+                self._book_webscraping = self._book_webscraping_provider()
+            else:
+                from book_webscraping import BookWebScraping
+                self._book_webscraping = BookWebScraping()
+        return self._book_webscraping
 
     books_chat_patterns = {
         # "reading_pages": r"(read)?\s?(?P<number_of_pages>\d+)\s?page(s)?\s?(of|from)\s?(?<book_name>.+?)(
@@ -38,8 +94,64 @@ class BookBot:
         "reading_speed": r"(reading speed|speed test|)",
         "greetings": r"(?i)^(hi|hello|hiya|hola|sup|hey)",
         "negative_response": r"^(no|nope|nah|naw)",
+        # "read 20 pages of Dune and 35 of Emma"
+        "reading_progress": r"(?i)^\s*(i\s+)?(have\s+)?read\s+\d+\s*(pages?|pp?\.?|pgs?)?\s+(of|from|in)\s",
     }
 
+    def parse_progress_log(self, text: str) -> tuple:
+        """
+        Parses a progress log naming any number of books, e.g. "read 20 pages of Dune and 35 of Emma" or the
+        arguments of ``/log Dune 20, Emma 35`` (one entry per line works too), in a single pass.
+
+        Args:
+            text (str): The message text, with or without the /log command.
+
+        Returns:
+            tuple: A list of ``(title, pages)`` entries with lower-cased titles, and a list of the parts that could
+            not be understood.
+        """
+        text = re.sub(r"^\s*/log(@\w+)?", "", text, flags=re.IGNORECASE).strip()
+        entries, unparsed = [], []
+        for part in PROGRESS_SEPARATOR.split(text):
+            part = part.strip(" .!\"'")
+            if not part:
+                continue
+            match = PAGES_THEN_TITLE.match(part) or TITLE_THEN_PAGES.match(part)
+            title = match and match.group("title").strip(" .!\"'")
+            if not title or int(match.group("pages")) <= 0:
+                unparsed.append(part)
+                continue
+            entries.append((title.lower(), int(match.group("pages"))))
+        return entries, unparsed
+
+    @staticmethod
+    def match_user_books(entries: list, user_books: list) -> tuple:
+        """
+        Matches the titles of progress log entries to the user's books: an exact title first, otherwise the only
+        book whose title starts with the given one ("dune" for "dune messiah" if the user has no "dune").
+
+        Args:
+            entries (list): ``(title, pages)`` entries from ``parse_progress_log``.
+            user_books (list): The user's books from ``BookDatabase.retrieve_user_books``.
+
+        Returns:
+            tuple: A dict of book id to ``(book, pages)`` with the pages of repeated books added up, and the list of
+            titles that matched none of the user's books.
+        """
+        by_title = {book["title"]: book for book in user_books}
+        progress, unmatched = {}, []
+        for title, pages in entries:
+            book = by_title.get(title)
+            if book is None:
+                candidates = [book for book in user_books if book["title"].startswith(title)]
+                book = candidates[0] if len(candidates) == 1 else None
+            if book is None:
+                unmatched.append(title)
+                continue
+            previous = progress.get(book["book_id"])
+            progress[book["book_id"]] = (book, pages + (previous[1] if previous else 0))
+        return progress, unmatched
+
     def extract_book_title_from_sentence(self, regex_type: str, sentence: str) -> str | None:
         """Extracts Book title from a sentence using specific regex.
 
@@ -53,50 +165,79 @@ class BookBot:
             Sentence to extract book title from
         """
         try:
-            self.book_title = re.search(self.books_chat_patterns[regex_type], sentence).group("book_name")
-            return self.book_title
+            return re.search(self.books_chat_patterns[regex_type], sentence).group("book_name")
         except AttributeError:
             return None
 
-    def get_book_details_from_api(self, book_title: str, book_author: str) -> bool:
+    def get_book_details_from_api(self, book_title: str, book_author: str, result_index: int | None = None) -> bool:
         """
-        Fetches book details from the Google Books API and populates the object's attributes.
+        Fetches book details from the Google Books API and makes the result the current book.
 
         Args:
             book_title: The title of the book.
             book_author: The author's name.
+            result_index: Index of the search result to show. Inline buttons pass the index they were created for;
+                without it the next result after the last one shown is used.
+
+        Returns:
+            bool: True if a result was found. False with ``api_unavailable`` set if the Books API could not be reached.
         """
 
+        self.api_unavailable = False
+        if result_index is not None:
+            # Use the button's own position rather than whatever was shown last
+            self.api_search_result_count = result_index if result_index < 4 else 0
+            # Results may be missing if another process showed the previous result
+            if self.api_search_result is None:
+                self.search_book_in_api(book_title, book_author)
         # If there are no previous search results, try searching for the book
-        if self.api_search_result_count == 0:
-            if not self.book_api.search_book_details(book_title, book_author):
-                # Attempt to search for the book with both title and author information
-                # If unsuccessful, search again with only the title for wider coverage
-                self.book_api.search_book_details(book_title)
+        elif self.api_search_result_count == 0:
+            self.search_book_in_api(book_title, book_author)
         # Reset API search result counter if it's at the maximum
         elif self.api_search_result_count == 4:
             self.api_search_result_count = 0
 
         # Extract book details from the current API search result
-        book_details = self.book_api.extract_book_details_from_api_result(self.api_search_result_count)
-
-        # Update object attributes if details were found
-        if book_details:
-            for key, value in book_details.items():
-                setattr(self, key, value)
-
-            # Generate a concise caption summarizing the book details
-            self.book_caption = f"Title : {self.book_title}\nAuthor : {self.book_author}"
+        self.book = self.book_api.extract_book_details_from_api_result(self.api_search_result,
+                                                                      self.api_search_result_count)
+        if self.book is not None:
             self.api_search_result_count += 1
             return True
-        else:
-            # Clear book title if no details were found
-            self.book_title = None
-            return False
+        return False
+
+    def search_book_in_api(self, book_title: str, book_author: str) -> bool:
+        """
+        Searches the Google Books API by title and author, falling back to the title alone, and keeps the result as
+        the chat's search.
+
+        Returns:
+            bool: True if any result was found.
+        """
+        # Attempt to search for the book with both title and author information
+        # If unsuccessful, search again with only the title for wider coverage
+        try:
+            self.api_search_result = self.book_api.search_book_details(book_title, book_author) or \
+                self.book_api.search_book_details(book_title, preferred_author=book_author)
+        except UpstreamUnavailable as e:
+            log_event(logger, logging.WARNING, "book_api_unavailable", book_title=book_title, error=str(e))
+            self.api_search_result = None
+            self.api_unavailable = True
+        return self.api_search_result is not None
+
+    def get_book_details_from_db_fallback(self, book_title: str, book_author: str | None) -> bool:
+        """
+        Looks for a stored book loosely matching the title (and author) while the Books API is unavailable.
+
+        Returns:
+            bool: True if a book was found and its details populated.
+        """
+        stored_title = self.book_database.find_book_title(book_title, book_author) or \
+            self.book_database.find_book_title(book_title)
+        return stored_title is not None and self.get_book_details_from_db(stored_title)
 
     def get_book_details_from_db(self, current_book_title: str) -> bool:
         """
-        Retrieves book details from the database and populates the object's attributes.
+        Retrieves book details from the database and makes it the current book.
 
         Args:
             current_book_title (str): The title of the book to search for in the database.
@@ -105,16 +246,11 @@ class BookBot:
             bool: True if book details were found and populated, False otherwise.
         """
         # Retrieve book details from the database using the provided title
-        book_details = self.book_database.fetch_book_details_from_db(current_book_title)
-
-        # If book details were found:
-        if book_details:
-            # Populate the object's attributes with the retrieved details
-            for key, value in book_details.items():
-                setattr(self, key, value)
-            return True  # Indicate successful retrieval
-        else:
-            return False  # Indicate unsuccessful retrieval
+        book = self.book_database.fetch_book_details_from_db(current_book_title)
+        if book is None:
+            return False
+        self.book = book
+        return True
 
     def validate_pages_read(self, pages_read_today: str) -> int | None:
         """
@@ -139,6 +275,9 @@ class BookBot:
         """
         Retrieves book recommendations from Goodreads based on a given book title.
 
+        If Goodreads has nothing or cannot be reached (and nothing is cached), books from the database sharing the
+        title's genre or author are recommended instead.
+
         Args:
             book_title (str): The title of the book for which to find recommendations.
 
@@ -147,22 +286,69 @@ class BookBot:
         """
 
         # Fetch recommendations using web scraping
-        recommended_books_and_authors = self.book_webscraping.scrap_book_recommendations(book_title)
+        try:
+            recommended_books_and_authors = self.book_webscraping.scrap_book_recommendations(book_title)
+        except UpstreamUnavailable as e:
+            log_event(logger, logging.WARNING, "recommendations_unavailable", book_title=book_title, error=str(e))
+            recommended_books_and_authors = {}
+        if not recommended_books_and_authors:
+            recommended_books_and_authors = self.book_database.recommend_similar_books(book_title)
 
         # Construct a formatted message for presenting the recommendations
         recommended_books_message = ""
-        print(recommended_books_and_authors)
+        log_event(logger, logging.DEBUG, "recommendations_scraped", book_title=book_title,
+                  recommendations=len(recommended_books_and_authors))
         for book_title, author_name in recommended_books_and_authors.items():
             recommended_books_message += f"{book_title} by {author_name}\n\n"
         return recommended_books_message  # Return the formatted recommendation message
 
-    @property
-    def complete_book_details(self):
-        return f"Title : {self.book_title}\n" \
-               f"Author : {self.book_author}\n" \
-               f"Genre : {self.book_genre}\n" \
-               f"Language : {self.book_language}\n" \
-               f"Total Pages : {self.book_total_page_count}\n" \
-               f"ISBN13 : {self.book_isbn13}\n\n"
+    def enqueue_recommendations(self, chat_id: int, book_title: str) -> int | None:
+        """
+        Queues a ``recommendations`` job whose result is sent to the chat when ready.
 
+        Returns:
+            int | None: The job id, or None without a job queue, in which case the caller looks them up inline.
+        """
+        if self.job_queue is None:
+            return None
+        book_title = book_title.strip().lower()
+        # Asking again while the first request is pending does not scrape twice
+        return self.job_queue.enqueue("recommendations", {"book_title": book_title}, chat_id=chat_id,
+                                      priority=PRIORITY_INTERACTIVE,
+                                      dedup_key=f"recommendations:{chat_id}:{book_title}")
+
+    def run_recommendations_job(self, payload: dict) -> str:
+        """
+        Job handler of ``recommendations``: the formatted recommendation message, empty if none were found.
+        """
+        return self.get_book_recommendations(payload["book_title"])
+
+    def enqueue_enrichment(self, chat_id: int | None = None) -> int | None:
+        """
+        Queues an ``enrich_book`` job looking up the saved current book's missing genre and language on Wikipedia.
+
+        Returns:
+            int | None: The job id, or None if nothing is missing or there is no job queue.
+        """
+        if self.job_queue is None or self.book is None or (self.book.genre and self.book.language):
+            return None
+        book_title = self.book.title.lower()
+        return self.job_queue.enqueue("enrich_book", {"book_title": book_title, "book_author": self.book.author},
+                                      chat_id=chat_id, priority=PRIORITY_BACKGROUND,
+                                      dedup_key=f"enrich_book:{book_title}")
+
+    def run_enrichment_job(self, payload: dict) -> dict:
+        """
+        Job handler of ``enrich_book``: fills in the book's unknown genre and language.
+
+        Returns:
+            dict: The book title and the genre and language found; both None if nothing new was stored.
 
+        Raises:
+            UpstreamUnavailable: If Google CSE or Wikipedia could not be reached, so the job is retried.
+        """
+        genre, language = self.book_webscraping.get_book_genre_language_wikipedia(
+            payload["book_title"], payload["book_author"], fallback=False)
+        if not self.book_database.fill_missing_genre_language(payload["book_title"], genre, language):
+            genre = language = None
+        return {"book_title": payload["book_title"], "book_genre": genre, "book_language": language}
@@ -1,22 +1,261 @@
+import atexit
+import logging
 import os
 import sqlite3
+import threading
+import time
+import zlib
 from typing import Optional
 from dotenv import  load_dotenv
+from backup import SnapshotReader
+from book_record import BookRecord
+from metrics import InstrumentedConnection
+from reminders import CURRENTLY_READING, ReadingReminders
+from row_cache import MISSING, RowCache
+from structured_logging import log_event
+from title_index import TitleIndex, normalize
+from update_ledger import UpdateLedger, claim_update, current_update
+from write_behind import PendingWrite, WriteBehindBuffer
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 AVG_READING_SPEED = 300  # WPM (Words Per Minute)
 AVG_WORDS_PER_PAGE = 300
+# The book_status id of "completed"
+COMPLETED = 2
+# Reading rows whose time_left recompute_time_left updates per transaction; writers wait at most one batch
+TIME_LEFT_BATCH_SIZE = int(os.getenv("MYSCRIBE_TIME_LEFT_BATCH_SIZE", 5000))
+# time_left of every reading row, from its book's page count and its reader's speed, as calculate_reading_time_left.
+# Parameters: words per page (a float, so SQLite divides without truncating) and the default reading speed
+TIME_LEFT_EXPRESSION = ("(books.total_pages - COALESCE(books_and_users.pages_read, 0)) * ? "
+                        "/ COALESCE(users.reading_speed, ?)")
+RECOMPUTE_TIME_LEFT_SQL = (f"UPDATE books_and_users SET time_left = {TIME_LEFT_EXPRESSION} FROM books, users "
+                           "WHERE books.id = books_and_users.book_id AND users.id = books_and_users.user_id "
+                           f"AND books_and_users.time_left IS NOT {TIME_LEFT_EXPRESSION}")
+
+# Explicit column list of the BookRecord fields in the books table
+BOOK_COLUMNS = ", ".join(BookRecord.COLUMNS)
+# Keep new descriptions zlib-compressed in the book_descriptions side table instead of books.description
+COMPRESS_DESCRIPTIONS = os.getenv("MYSCRIBE_COMPRESS_DESCRIPTIONS", "0") == "1"
+
+# Opt-in group commit of user mutations, see WriteBehindBuffer
+WRITE_BEHIND = os.getenv("MYSCRIBE_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("MYSCRIBE_WRITE_BEHIND_FLUSH_MS", 50))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("MYSCRIBE_WRITE_BEHIND_MAX_BATCH", 200))
 
 
 class BookDatabase:
     """
     Facilitates interactions with the MyScribe's database.
     """
-    def __init__(self):
+    def __init__(self, write_behind: bool = WRITE_BEHIND, compress_descriptions: bool = COMPRESS_DESCRIPTIONS,
+                 analytics: SnapshotReader | None = None):
+        """
+        Args:
+            write_behind (bool): Queue user mutations and commit them in groups instead of one commit each.
+                Defaults to the MYSCRIBE_WRITE_BEHIND environment variable.
+            compress_descriptions (bool): Store new descriptions compressed in the ``book_descriptions`` side table.
+                Defaults to the MYSCRIBE_COMPRESS_DESCRIPTIONS environment variable.
+            analytics (SnapshotReader | None): Read-only backup snapshot the local recommender's aggregate queries run
+                on instead of the live database.
+        """
         self.current_book_id = None
-        self.conn = sqlite3.connect(os.getenv("MYSCRIBE_DATABASE"), check_same_thread=False)
-        self.cur = self.conn.cursor()
+        self.conn = sqlite3.connect(os.getenv("MYSCRIBE_DATABASE"), check_same_thread=False,
+                                    factory=InstrumentedConnection)
+        # WAL lets readers in other processes (sharding workers) run while one of them writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # One cursor per thread: telebot and the write-behind flusher use the connection concurrently
+        self._local = threading.local()
+        # Guards writes and commits on the shared connection
+        self.lock = threading.RLock()
+        self.write_buffer = None
+        if write_behind:
+            self.write_buffer = WriteBehindBuffer(self.conn, self.lock, WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_MAX_BATCH)
+            atexit.register(self.close)
+        # Processed update ids, claimed in the same transaction as an update's first write
+        self.update_ledger = UpdateLedger(self.conn, self.lock, self.write_buffer)
+        # Due times of reading reminders, rescheduled by status changes and progress logs
+        self.reminders = ReadingReminders(self.conn, self.lock, self.execute_writes)
+        # Inline-query autocomplete over stored titles, filled by load_title_index
+        self.title_index = TitleIndex()
+        self.create_book_aliases()
+        # Write-through caches of rows read on nearly every progress message: users' reading speeds, book ids by
+        # alias key and book details (DETAIL_FIELDS) by id
+        self.user_cache = RowCache("users")
+        self.book_id_cache = RowCache("book_ids")
+        self.book_cache = RowCache("books")
+        self.compress_descriptions = compress_descriptions
+        self.analytics = analytics
+        with self.lock:
+            # Compressed descriptions, kept out of the books rows so reading a book never pages through them
+            self.conn.execute("CREATE TABLE IF NOT EXISTS book_descriptions ("
+                              "book_id INTEGER PRIMARY KEY, "
+                              "description BLOB NOT NULL)")
+            # Lets a reading speed change recompute only that user's rows
+            self.conn.execute("CREATE INDEX IF NOT EXISTS books_and_users_user_id ON books_and_users (user_id)")
+            # Named values kept by maintenance tasks, e.g. the constants the stored time_left values were computed with
+            self.conn.execute("CREATE TABLE IF NOT EXISTS maintenance_state ("
+                              "name TEXT PRIMARY KEY, "
+                              "value TEXT NOT NULL) WITHOUT ROWID")
+            self.conn.commit()
+
+    @property
+    def cur(self) -> sqlite3.Cursor:
+        """
+        The calling thread's cursor on the shared connection.
+        """
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._local.cursor = self.conn.cursor()
+        return cursor
+
+    def execute_write(self, sql: str, parameters: tuple, telegram_id: int | None = None) -> None:
+        """
+        Executes a mutation. It is committed immediately, or queued for the next group commit in write-behind mode.
+
+        Inside a handler processing a Telegram update, the update's first mutation also records the update id in the
+        ledger, in the same transaction. If the ledger already holds it (a redelivery), the mutation is skipped.
+
+        Args:
+            sql (str): The INSERT/UPDATE statement.
+            parameters (tuple): Its parameters.
+            telegram_id (int | None): The user the mutation belongs to.
+
+        Returns:
+            PendingWrite | None: The queued write in write-behind mode, see ``execute_writes``.
+
+        Raises:
+            sqlite3.Error: If an immediate write fails.
+        """
+        return self.execute_writes([(sql, parameters)], telegram_id)
+
+    def execute_writes(self, statements: list, telegram_id: int | None = None) -> Optional[PendingWrite]:
+        """
+        Executes several mutations in one transaction, like ``execute_write`` does for one.
+
+        In write-behind mode the statements are queued as one group, committed together or not at all. A group that
+        fails is reported by its ``PendingWrite.wait`` or, if nobody waited for it, by the next
+        ``flush_pending_writes`` for the user.
+
+        Args:
+            statements (list): ``(sql, parameters)`` pairs, applied in order.
+            telegram_id (int | None): The user the mutations belong to.
+
+        Returns:
+            PendingWrite | None: The queued write in write-behind mode, None when the write was made immediately.
+
+        Raises:
+            sqlite3.Error: If an immediate write fails; none of the statements is applied then.
+        """
+        if not statements:
+            return None
+        claim = current_update.get()
+        if claim is not None and claim.duplicate:
+            return None
+        if self.write_buffer:
+            if claim is None:
+                return self.write_buffer.submit_many(statements, telegram_id)
+            pending_write = self.write_buffer.submit_many(statements, telegram_id, claim.update_id, not claim.claimed)
+            if not claim.claimed:
+                claim.claimed = True
+                self.update_ledger.count_recorded()
+            return pending_write
+        with self.lock:
+            if claim is not None and not claim.claimed and not claim_update(self.cur, claim.update_id):
+                claim.duplicate = True
+                self.conn.rollback()
+                log_event(logger, logging.INFO, "duplicate_update_write_skipped", update_id=claim.update_id,
+                          telegram_id=telegram_id)
+                return None
+            try:
+                for sql, parameters in statements:
+                    self.cur.execute(sql, parameters)
+                self.conn.commit()
+            except sqlite3.Error:
+                # Also undoes the ledger row, so the update can still be processed on redelivery
+                self.conn.rollback()
+                raise
+        if claim is not None and not claim.claimed:
+            claim.claimed = True
+            self.update_ledger.count_recorded()
+        return None
+
+    def commit_writes(self, statements: list, telegram_id: int | None = None) -> None:
+        """
+        Executes several mutations in one transaction like ``execute_writes``, but returns only once they are
+        committed, also in write-behind mode, for callers that tell the user whether the change was saved.
+
+        Raises:
+            sqlite3.Error: If the mutations could not be committed; none of them is applied then.
+        """
+        pending_write = self.execute_writes(statements, telegram_id)
+        if pending_write is not None:
+            pending_write.wait()
+
+    def flush_pending_writes(self, telegram_id: int | None = None) -> None:
+        """
+        Commits queued write-behind mutations, only if the given user has any when a user is given.
+
+        Raises:
+            WriteBehindFailed: If queued mutations of the user (of anyone without a user) could not be committed.
+        """
+        if not self.write_buffer:
+            return
+        if telegram_id is None:
+            self.write_buffer.flush()
+        else:
+            self.write_buffer.flush_for_user(telegram_id)
+
+    def close(self) -> None:
+        """
+        Durably flushes queued mutations and closes the connection.
+
+        Raises:
+            WriteBehindFailed: If queued mutations could not be committed; the connection is closed regardless.
+        """
+        write_buffer, self.write_buffer = self.write_buffer, None
+        try:
+            if write_buffer:
+                write_buffer.close()
+        finally:
+            with self.lock:
+                self.conn.close()
+
+    @staticmethod
+    def alias_keys(book_title: str | None = None, isbn13=None, aliases: tuple = ()) -> list:
+        """
+        The ``book_aliases`` keys of a book: its ISBN-13 first, then its title and other phrasings, normalized.
+        """
+        keys = []
+        isbn_digits = "".join(character for character in str(isbn13 or "") if character.isdigit())
+        if len(isbn_digits) == 13:
+            keys.append(f"isbn:{isbn_digits}")
+        for alias in (book_title, *aliases):
+            alias = normalize(alias)
+            if alias and alias not in keys:
+                keys.append(alias)
+        return keys
+
+    def create_book_aliases(self) -> None:
+        """
+        Creates the ``book_aliases`` table mapping ISBN-13s, normalized titles and user-typed phrasings to a book id.
+        On first creation it is filled from the existing books.
+        """
+        with self.lock:
+            exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_aliases'"
+                                       ).fetchone()
+            self.conn.execute("CREATE TABLE IF NOT EXISTS book_aliases ("
+                              "alias TEXT PRIMARY KEY, "
+                              "book_id INTEGER NOT NULL) WITHOUT ROWID")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS book_aliases_book_id ON book_aliases (book_id)")
+            if not exists:
+                books = self.conn.execute("SELECT id, title, isbn13 FROM books").fetchall()
+                self.conn.executemany("INSERT OR IGNORE INTO book_aliases (alias, book_id) VALUES (?,?)",
+                                      ((alias, book_id) for book_id, title, isbn13 in books
+                                       for alias in self.alias_keys(title, isbn13)))
+                log_event(logger, logging.INFO, "book_aliases_created", books=len(books))
+            self.conn.commit()
 
     def insert_username_and_id(self, telegram_id: int, username: str, reading_speed: int = AVG_READING_SPEED) -> bool:
         """
@@ -32,61 +271,158 @@ class BookDatabase:
         """
         # Insert user if they don't exist
         try:
-            self.cur.execute("INSERT INTO users (id, first_name, reading_speed) VALUES (?,?,?)",
-                             (telegram_id, username, reading_speed))
-            self.conn.commit()
+            with self.lock:
+                self.cur.execute("INSERT INTO users (id, first_name, reading_speed) VALUES (?,?,?)",
+                                 (telegram_id, username, reading_speed))
+                self.conn.commit()
+            self.user_cache.put(telegram_id, reading_speed)
             return True
         except Exception as e:
-            print(e)
+            log_event(logger, logging.INFO, "user_insert_failed", telegram_id=telegram_id, error=str(e))
             return False
 
-    def insert_book_details(self, book_details):
+    def insert_book_details(self, book: BookRecord, aliases: tuple = ()) -> bool:
         """
-        Inserts the provided book details into the "books" table in the database.
+        Stores a book unless it is already known, and records every phrasing of it as an alias.
+
+        A book is the same as a stored one if its ISBN-13 or its normalized title is already an alias, so saving an
+        edition or spelling of a known book, or saving it twice, only adds the missing aliases.
 
         Args:
-            book_details: An object containing the book's title, author, genre, language, total pages, ISBN-13, description, and cover URL.
+            book (BookRecord): The book's details.
+            aliases (tuple): Other phrasings that should find this book, such as the title the user typed.
 
         Returns:
-            True if the insertion was successful, False otherwise.
+            True if the book is stored (now or before), False otherwise.
         """
+        keys = self.alias_keys(book.title, book.isbn13, aliases)
         try:
-            # Execute SQL query to insert book details
-            self.cur.execute(
-                "INSERT INTO books (title, author, genre, language, total_pages, isbn13, description, book_cover_url)"
-                "VALUES (lower(?),lower(?),lower(?),lower(?),?,?,?,?)",
-                (book_details.book_title, book_details.book_author,
-                 book_details.book_genre, book_details.book_language,
-                 book_details.book_total_page_count, book_details.book_isbn13,
-                 book_details.book_description, book_details.book_cover))
-
-            # Commit changes to the database
-            self.conn.commit()
+            with self.lock:
+                book_id = self.resolve_alias(keys)
+                inserted = book_id is None
+                if inserted:
+                    stored = book.replace(description=None) if self.compress_descriptions else book
+                    # Execute SQL query to insert book details; a title or ISBN stored without an alias conflicts
+                    row = self.cur.execute(
+                        f"INSERT INTO books ({BOOK_COLUMNS}) VALUES (lower(?),lower(?),lower(?),lower(?),?,?,?,?) "
+                        f"ON CONFLICT DO NOTHING RETURNING id, {BookRecord.columns(BookRecord.DETAIL_FIELDS)}",
+                        stored.values()).fetchone()
+                    if row is not None:
+                        # The details as stored, for the cache
+                        stored = BookRecord.from_row(row[1:], BookRecord.DETAIL_FIELDS)
+                    if row is not None and book.description and self.compress_descriptions:
+                        self.cur.execute("INSERT INTO book_descriptions (book_id, description) VALUES (?,?)",
+                                         (row[0], zlib.compress(book.description.encode())))
+                    if row is None:
+                        inserted = False
+                        row = self.cur.execute("SELECT id FROM books WHERE isbn13 = ? OR title = lower(?) "
+                                               "ORDER BY isbn13 = ? DESC LIMIT 1",
+                                               (book.isbn13, book.title, book.isbn13)).fetchone()
+                    book_id = row[0]
+                self.cur.executemany("INSERT OR IGNORE INTO book_aliases (alias, book_id) VALUES (?,?)",
+                                     ((key, book_id) for key in keys))
 
-            return True
+                # Commit changes to the database
+                self.conn.commit()
         except sqlite3.Error as e:
             # Handle any database errors
-            print(f"Error inserting book details: {e}")
+            self.conn.rollback()
+            log_event(logger, logging.ERROR, "book_insert_failed", book_title=book.title, error=str(e))
+            return False
+        for key in keys:
+            self.book_id_cache.put(key, book_id)
+        if inserted:
+            self.book_cache.put(book_id, stored)
+            self.title_index.add(book_id, book.title.lower(), (book.author or "").lower())
+        else:
+            log_event(logger, logging.DEBUG, "book_already_stored", book_title=book.title, book_id=book_id)
+        return True
+
+    def resolve_alias(self, keys: list) -> int | None:
+        """
+        The book id of the first of the alias keys that is known, with one indexed lookup per key.
+        """
+        for key in keys:
+            row = self.cur.execute("SELECT book_id FROM book_aliases WHERE alias = ?", (key,)).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    def load_title_index(self, background: bool = False) -> None:
+        """
+        Fills the title autocomplete index with every stored book and the number of users tracking it.
+
+        Args:
+            background (bool): Load on a daemon thread and return at once; searches see fewer books until it is done.
+        """
+        if background:
+            threading.Thread(target=self.load_title_index, name="title-index-loader", daemon=True).start()
+            return
+        try:
+            rows = self.cur.execute("SELECT books.id, books.title, books.author, "
+                                    "COUNT(DISTINCT books_and_users.user_id) FROM books "
+                                    "LEFT JOIN books_and_users ON books_and_users.book_id = books.id "
+                                    "GROUP BY books.id").fetchall()
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "title_index_load_failed", error=str(e))
+            return
+        self.title_index.load(rows)
+
+    def fill_missing_genre_language(self, book_title: str, genre: str | None, language: str | None) -> bool:
+        """
+        Sets a stored book's genre and language where they are still unknown, keeping anything the user entered.
+
+        Args:
+            book_title (str): The title of the book.
+            genre (str | None): The genre found, if any.
+            language (str | None): The language found, if any.
+
+        Returns:
+            bool: True if the book was found and something was filled in.
+        """
+        try:
+            book_id = self.retrieve_book_id(book_title)
+            with self.lock:
+                updated = self.cur.execute("UPDATE books SET genre = COALESCE(genre, lower(?)), "
+                                           "language = COALESCE(language, lower(?)) WHERE id = ? "
+                                           "AND ((genre IS NULL AND ? IS NOT NULL) "
+                                           "OR (language IS NULL AND ? IS NOT NULL))",
+                                           (genre, language, book_id, genre, language)).rowcount
+                self.conn.commit()
+            if updated:
+                self.book_cache.invalidate(book_id)
+            return updated > 0
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "book_enrichment_failed", book_title=book_title, error=str(e))
             return False
 
     def insert_book_status(self, telegram_id: int, book_title: str, current_book_status: int) -> bool:
         book_id = self.retrieve_book_id(book_title)
+        if current_book_status == CURRENTLY_READING:
+            reminder_statement = self.reminders.start_reading_statement(telegram_id, book_id)
+        else:
+            reminder_statement = self.reminders.cancel_statement(telegram_id, book_id)
+        # The status and the book's reminder commit together, in the transaction that claims the update
+        statements = [("INSERT INTO books_and_users (user_id, book_id, book_status) VALUES (?,?,?)",
+                       (telegram_id, book_id, current_book_status)),
+                      reminder_statement]
         try:
-            self.cur.execute("INSERT INTO books_and_users (user_id, book_id, book_status) VALUES (?,?,?)",
-                             (telegram_id, book_id, current_book_status))
-            self.conn.commit()
-            return True
+            self.commit_writes(statements, telegram_id)
         except sqlite3.Error as e:
-            print(e)
+            log_event(logger, logging.ERROR, "book_status_insert_failed", telegram_id=telegram_id, book_id=book_id,
+                      error=str(e))
             return False
+        self.title_index.add_reader(book_id)
+        return True
 
     def insert_book_rating(self, telegram_id: int, book_title: str, book_rating):
         book_id = self.retrieve_book_id(book_title)
         try:
-            self.cur.execute("UPDATE books_and_users SET rating  = ? WHERE user_id = ? AND book_id = ?", (book_rating, telegram_id, book_id))
-            self.conn.commit()
+            self.commit_writes([("UPDATE books_and_users SET rating  = ? WHERE user_id = ? AND book_id = ?",
+                                 (book_rating, telegram_id, book_id))], telegram_id)
         except sqlite3.Error as e:
-            print(e)
+            log_event(logger, logging.ERROR, "book_rating_insert_failed", telegram_id=telegram_id, book_id=book_id,
+                      error=str(e))
             return False
         else:
             return True
@@ -101,12 +437,7 @@ class BookDatabase:
         Returns:
             bool: True if the user exists, False otherwise.
         """
-        self.cur = self.conn.cursor()
-        self.cur.execute("SELECT * FROM users WHERE id = ?", (telegram_id,))
-        return self.cur.rowcount != 0
-        #     return True
-        # else:
-        #     return False
+        return self.cur.execute("SELECT 1 FROM users WHERE id = ?", (telegram_id,)).fetchone() is not None
 
     def check_if_book_exist(self, book_title: str) -> bool:
         """
@@ -118,41 +449,177 @@ class BookDatabase:
         Returns:
             bool: True if the book exists, False otherwise.
         """
-        self.cur.execute("SELECT * FROM books WHERE title = ?", (book_title,))
-        return self.cur.rowcount != 0
+        return self.retrieve_book_id(book_title) is not None
 
-    def fetch_book_details_from_db(self, book_title: str) -> dict | None:
+    def fetch_book_details_from_db(self, book_title: str,
+                                   fields: tuple = BookRecord.DETAIL_FIELDS) -> BookRecord | None:
         """
         Fetches book details from the database based on the provided book title.
 
+        Only the given fields are read. The description is left out by default, see retrieve_book_description.
+
         Args:
             book_title: The title of the book to fetch details for.
+            fields (tuple): The BookRecord fields to read; the others are None.
 
         Returns:
-            A dictionary containing book details if the book is found, or False otherwise.
+            BookRecord | None: The book's details if the book is found, or None otherwise.
         """
+        book_id = self.retrieve_book_id(book_title)
+        if book_id is None:
+            return None
         try:
-            self.cur.execute("SELECT * FROM books WHERE title = ?", (book_title,))
-            db_book_details = self.cur.fetchone()
+            if fields == BookRecord.DETAIL_FIELDS:
+                book = self.book_details(book_id)
+            else:
+                book = self.select_book(book_id, fields)
         except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "book_details_fetch_failed", book_title=book_title, error=str(e))
             return None
-        else:
-            if db_book_details:
-                self.current_book_id = db_book_details[0]
-                return {'book_title': db_book_details[1],
-                        'book_author': db_book_details[2],
-                        'book_genre': db_book_details[3],
-                        'book_language': db_book_details[4],
-                        'book_total_page_count': db_book_details[5],
-                        'book_isbn13': db_book_details[6],
-                        'book_description': db_book_details[7],
-                        'book_cover': db_book_details[8], }
-            else:
-                return None
+        if book is None:
+            return None
+        self.current_book_id = book_id
+        return book
+
+    def select_book(self, book_id: int, fields: tuple) -> BookRecord | None:
+        """
+        Reads the given fields of a book from the database.
+
+        Raises:
+            sqlite3.Error: If the query fails.
+        """
+        row = self.cur.execute(f"SELECT {BookRecord.columns(fields)} FROM books WHERE id = ?", (book_id,)).fetchone()
+        return BookRecord.from_row(row, fields) if row else None
+
+    def book_details(self, book_id: int) -> BookRecord | None:
+        """
+        The book's DETAIL_FIELDS, from the book cache when possible.
+
+        Raises:
+            sqlite3.Error: If the book is not cached and the query fails.
+        """
+        return self.book_cache.get_or_load(book_id, lambda: self.select_book(book_id, BookRecord.DETAIL_FIELDS))
+
+    def cache_stats(self) -> dict:
+        """
+        Hit rate and size of each row cache, by cache name.
+        """
+        return {cache.name: cache.stats() for cache in (self.user_cache, self.book_id_cache, self.book_cache)}
+
+    def retrieve_book_description(self, book_title: str) -> str | None:
+        """
+        Loads a book's description, which fetch_book_details_from_db leaves out.
+
+        Args:
+            book_title (str): The title of the book, or any known phrasing of it.
+
+        Returns:
+            str | None: The description, decompressed if it is kept in ``book_descriptions``, or None.
+        """
+        try:
+            row = self.cur.execute("SELECT books.description, book_descriptions.description FROM books "
+                                   "LEFT JOIN book_descriptions ON book_descriptions.book_id = books.id "
+                                   "WHERE books.id = ?", (self.retrieve_book_id(book_title),)).fetchone()
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "book_description_fetch_failed", book_title=book_title, error=str(e))
+            return None
+        if row is None:
+            return None
+        description, compressed = row
+        return zlib.decompress(compressed).decode() if compressed is not None else description
+
+    def move_descriptions_to_side_table(self, batch_size: int = 500) -> int:
+        """
+        Compresses the descriptions still held in ``books`` into ``book_descriptions``, one transaction per batch so
+        the bot keeps writing in between. The freed pages are reused by new rows; VACUUM returns them to the disk.
+
+        Args:
+            batch_size (int): Books moved per transaction.
+
+        Returns:
+            int: The number of descriptions moved.
+        """
+        moved = 0
+        while True:
+            with self.lock:
+                rows = self.cur.execute("SELECT id, description FROM books WHERE description IS NOT NULL LIMIT ?",
+                                        (batch_size,)).fetchall()
+                if not rows:
+                    break
+                self.cur.executemany("INSERT OR REPLACE INTO book_descriptions (book_id, description) VALUES (?,?)",
+                                     ((book_id, zlib.compress(str(description).encode()))
+                                      for book_id, description in rows))
+                self.cur.executemany("UPDATE books SET description = NULL WHERE id = ?",
+                                     ((book_id,) for book_id, _ in rows))
+                self.conn.commit()
+            moved += len(rows)
+        log_event(logger, logging.INFO, "book_descriptions_moved", books=moved)
+        return moved
+
+    def find_book_title(self, book_title: str, book_author: str | None = None) -> str | None:
+        """
+        Finds a stored book whose title contains the given text, optionally by a matching author. Used instead of the
+        Books API while it is unavailable.
+
+        Args:
+            book_title (str): The title, or part of it, as entered by the user.
+            book_author (str | None): The author, or part of the name.
+
+        Returns:
+            str | None: The stored title of the closest (shortest) match, or None.
+        """
+        def contains(text: str) -> str:
+            escaped = text.strip().lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            return f"%{escaped}%"
+
+        try:
+            row = self.cur.execute("SELECT title FROM books WHERE title LIKE ? ESCAPE '\\' "
+                                   "AND (? IS NULL OR author LIKE ? ESCAPE '\\') ORDER BY length(title) LIMIT 1",
+                                   (contains(book_title), book_author, contains(book_author or ""))).fetchone()
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "book_title_search_failed", book_title=book_title, error=str(e))
+            return None
+        return row[0] if row else None
+
+    def recommend_similar_books(self, book_title: str, limit: int = 5) -> dict:
+        """
+        Local recommender: the books most tracked by users that share the given book's genre or author.
+
+        The counts are taken from the analytics snapshot when there is one, as they need not be up to the minute;
+        books added since the snapshot was taken are looked up in the live database.
+
+        Args:
+            book_title (str): The book to find similar ones for.
+            limit (int): Maximum number of recommendations.
+
+        Returns:
+            dict: Recommended books and their authors, in the format {book_title: author_name}. Empty if the book is
+                not in the database.
+        """
+        sql = ("SELECT b.title, b.author FROM books AS b "
+               "JOIN books AS seed ON seed.id = ? AND b.id != seed.id "
+               "AND (b.genre = seed.genre OR b.author = seed.author) "
+               "LEFT JOIN books_and_users AS bu ON bu.book_id = b.id "
+               "GROUP BY b.id ORDER BY COUNT(bu.user_id) DESC, b.id LIMIT ?")
+        parameters = (self.retrieve_book_id(book_title.strip()), limit)
+        rows = None
+        if self.analytics:
+            try:
+                rows = self.analytics.query(sql, parameters)
+            except sqlite3.Error as e:
+                log_event(logger, logging.WARNING, "analytics_query_failed", query="recommend_similar_books",
+                          error=str(e))
+        try:
+            if not rows:
+                rows = self.cur.execute(sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "local_recommendations_failed", book_title=book_title, error=str(e))
+            return {}
+        return {title: author for title, author in rows}
 
     def retrieve_book_id(self, book_title: str) -> int | None:
         """
-        Retrieves the unique ID of a book from the database, given its title.
+        Retrieves the unique ID of a book from the database, given its title or any phrasing of it seen before.
 
         Args:
             book_title (str): The title of the book to search for.
@@ -160,13 +627,22 @@ class BookDatabase:
         Returns:
             int | None: The ID of the book if found, otherwise None.
         """
-        self.cur.execute("SELECT id FROM books WHERE title = ?", (book_title,))
-        book_id = self.cur.fetchone()
-        if book_id:
-            print(book_id)
-            return book_id[0]
-        else:
+        keys = self.alias_keys(book_title)
+        if not keys:
             return None
+        book_id = self.book_id_cache.get(keys[0])
+        if book_id is MISSING:
+            book_id = self.resolve_alias(keys)
+            if book_id is None:
+                # Books stored by a process that predates the alias table
+                row = self.cur.execute("SELECT id FROM books WHERE title = ?", (book_title,)).fetchone()
+                book_id = row[0] if row else None
+            # Unknown titles are not cached: another process may store the book any moment
+            if book_id is not None:
+                self.book_id_cache.put(keys[0], book_id)
+        if book_id is not None:
+            log_event(logger, logging.DEBUG, "book_id_retrieved", book_title=book_title, book_id=book_id)
+        return book_id
 
     def retrieve_total_pages(self, book_title: str) -> int | None:
         """
@@ -179,16 +655,14 @@ class BookDatabase:
             int | None: The total number of pages if found, otherwise None.
         """
         try:
-            self.cur.execute("SELECT total_pages FROM books WHERE title = ?", (book_title,))
-            total_pages = self.cur.fetchone()
-            print(total_pages)
+            book_id = self.retrieve_book_id(book_title)
+            book = self.book_details(book_id) if book_id is not None else None
+            log_event(logger, logging.DEBUG, "total_pages_retrieved", book_title=book_title,
+                      total_pages=book and book.total_pages)
         except sqlite3.Error as e:
-            print(e)
+            log_event(logger, logging.ERROR, "total_pages_retrieval_failed", book_title=book_title, error=str(e))
         else:
-            if total_pages:
-                return total_pages[0]
-            else:
-                return None
+            return book.total_pages if book else None
 
     def check_if_book_status_exists(self, telegram_id: int, book_title: str) -> int | None:
         """
@@ -202,11 +676,12 @@ class BookDatabase:
             The book's status as an integer (1 - Currently Reading, 2 - Completed, 3 - Wishlist) if found, or None if not found.
         """
         book_id = self.retrieve_book_id(book_title)
-        print(book_id)
+        self.flush_pending_writes(telegram_id)
         self.cur.execute("SELECT book_status FROM books_and_users WHERE user_id = ? AND book_id = ? ",
                          (telegram_id, book_id))
         retrieved_book_status = self.cur.fetchone()
-        print(retrieved_book_status)
+        log_event(logger, logging.DEBUG, "book_status_checked", telegram_id=telegram_id, book_id=book_id,
+                  book_status=retrieved_book_status)
         if retrieved_book_status:
             return True
         else:
@@ -224,6 +699,7 @@ class BookDatabase:
             int : The number of pages read if found, otherwise 0 to indicate no progress.
         """
         book_id = self.retrieve_book_id(book_title)
+        self.flush_pending_writes(telegram_id)
         self.cur.execute("SELECT pages_read FROM books_and_users WHERE user_id = ? AND book_id = ?",
                          (telegram_id, book_id))
         pages_read = self.cur.fetchone()[0]
@@ -242,13 +718,19 @@ class BookDatabase:
         Returns:
             int | None: The user's reading speed if found, otherwise None.
         """
+        # Written through by insert_username_and_id and update_user_reading_speed, queued writes included
+        reading_speed = self.user_cache.get(telegram_id)
+        if reading_speed is not MISSING:
+            return reading_speed
+        self.flush_pending_writes(telegram_id)
         try:
             self.cur.execute("SELECT reading_speed FROM users WHERE id = ?", (telegram_id,))
             reading_speed = self.cur.fetchone()
         except sqlite3.Error as e:
-            print(e)
+            log_event(logger, logging.ERROR, "reading_speed_retrieval_failed", telegram_id=telegram_id, error=str(e))
         else:
             if reading_speed:
+                self.user_cache.put(telegram_id, reading_speed[0])
                 return reading_speed[0]
             else:
                 return None
@@ -267,21 +749,22 @@ class BookDatabase:
         """
 
         book_id = self.retrieve_book_id(book_title)
+        self.flush_pending_writes(telegram_id)
         try:
             self.cur.execute("SELECT time_left FROM books_and_users WHERE user_id = ? AND book_id = ?",
                              (telegram_id, book_id))
             reading_time_left = self.cur.fetchone()[0]
-            print(f"first : {reading_time_left}")
         except sqlite3.Error as e:
-            print(e)
+            log_event(logger, logging.ERROR, "reading_time_left_retrieval_failed", telegram_id=telegram_id,
+                      book_id=book_id, error=str(e))
         else:
+            log_event(logger, logging.DEBUG, "reading_time_left_retrieved", telegram_id=telegram_id, book_id=book_id,
+                      time_left=reading_time_left)
             if reading_time_left:
-                print(reading_time_left)
                 return reading_time_left
             else:
-                print("NOT NONE")
                 self.update_reading_time_left(telegram_id, book_title)
-                self.retrieve_reading_time_left(telegram_id, book_title)
+                return self.retrieve_reading_time_left(telegram_id, book_title)
 
     def update_user_reading_speed(self, telegram_id: int, reading_speed: int) -> bool:
         """
@@ -295,11 +778,13 @@ class BookDatabase:
                bool: True if the update was successful, False otherwise.
            """
         try:
-            self.cur.execute("UPDATE users SET reading_speed = ? WHERE id = ?", (reading_speed, telegram_id))
-            self.conn.commit()
+            # The user's stored estimates are recomputed with the new speed in the same transaction
+            self.commit_writes([("UPDATE users SET reading_speed = ? WHERE id = ?", (reading_speed, telegram_id)),
+                                self.time_left_statement(telegram_id)], telegram_id)
+            self.user_cache.put(telegram_id, reading_speed)
             return True
         except Exception as e:
-            print(e)
+            log_event(logger, logging.ERROR, "reading_speed_update_failed", telegram_id=telegram_id, error=str(e))
             return False
 
     def update_reading_time_left(self, telegram_id: int, book_title: str) -> bool:
@@ -315,17 +800,100 @@ class BookDatabase:
         """
         book_id = self.retrieve_book_id(book_title)
         reading_time_left = self.calculate_reading_time_left(telegram_id, book_title)
-        print(reading_time_left)
         try:
-            self.cur.execute("UPDATE books_and_users SET time_left = ? WHERE user_id = ? AND book_id = ?",
-                             (reading_time_left, telegram_id, book_id))
-            self.conn.commit()
+            self.commit_writes([("UPDATE books_and_users SET time_left = ? WHERE user_id = ? AND book_id = ?",
+                                 (reading_time_left, telegram_id, book_id))], telegram_id)
         except sqlite3.Error as e:
-
+            log_event(logger, logging.ERROR, "reading_time_left_update_failed", telegram_id=telegram_id,
+                      book_id=book_id, error=str(e))
             return False
         else:
             return True
 
+    @staticmethod
+    def time_left_statement(telegram_id: int | None = None, first_rowid: int | None = None,
+                            last_rowid: int | None = None, book_id: int | None = None) -> tuple:
+        """
+        The set-based UPDATE recomputing ``time_left`` of the reading rows whose value is out of date.
+
+        Args:
+            telegram_id (int | None): Only this user's rows.
+            first_rowid (int | None): Only rows from this ``books_and_users`` rowid on.
+            last_rowid (int | None): Only rows up to this rowid.
+            book_id (int | None): Only rows of this book.
+
+        Returns:
+            tuple: ``(sql, parameters)``, as ``execute_writes`` takes them.
+        """
+        sql = RECOMPUTE_TIME_LEFT_SQL
+        parameters = (float(AVG_WORDS_PER_PAGE), AVG_READING_SPEED) * 2
+        if telegram_id is not None:
+            sql += " AND books_and_users.user_id = ?"
+            parameters += (telegram_id,)
+        if book_id is not None:
+            sql += " AND books_and_users.book_id = ?"
+            parameters += (book_id,)
+        if first_rowid is not None:
+            sql += " AND books_and_users.rowid BETWEEN ? AND ?"
+            parameters += (first_rowid, last_rowid)
+        return sql, parameters
+
+    def recompute_time_left(self, batch_size: int = TIME_LEFT_BATCH_SIZE) -> int:
+        """
+        Recomputes ``time_left`` of every reading row with set-based UPDATEs over consecutive rowid ranges, one
+        transaction per ``batch_size`` rows, so the bot's own writes only ever wait for one batch. Rows already up to
+        date are not rewritten.
+
+        Returns:
+            int: Number of rows whose ``time_left`` changed.
+        """
+        self.flush_pending_writes()
+        started = time.perf_counter()
+        last_rowid = self.cur.execute("SELECT MAX(rowid) FROM books_and_users").fetchone()[0] or 0
+        updated = 0
+        for first_rowid in range(1, last_rowid + 1, batch_size):
+            sql, parameters = self.time_left_statement(first_rowid=first_rowid,
+                                                       last_rowid=first_rowid + batch_size - 1)
+            with self.lock:
+                try:
+                    updated += self.cur.execute(sql, parameters).rowcount
+                    self.conn.commit()
+                except sqlite3.Error:
+                    self.conn.rollback()
+                    raise
+        with self.lock:
+            self.conn.execute("INSERT INTO maintenance_state (name, value) VALUES ('time_left_constants', ?) "
+                              "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                              (self.time_left_constants(),))
+            self.conn.commit()
+        log_event(logger, logging.INFO, "time_left_recomputed", rows=updated, batch_size=batch_size,
+                  duration_ms=round((time.perf_counter() - started) * 1000, 1))
+        return updated
+
+    @staticmethod
+    def time_left_constants() -> str:
+        return f"{AVG_WORDS_PER_PAGE}/{AVG_READING_SPEED}"
+
+    def recompute_time_left_if_stale(self, background: bool = False) -> None:
+        """
+        Recomputes every ``time_left`` if AVG_WORDS_PER_PAGE or AVG_READING_SPEED changed since they were last
+        computed, e.g. at startup after a release changed them.
+
+        Args:
+            background (bool): Recompute on a daemon thread and return at once.
+        """
+        if background:
+            threading.Thread(target=self.recompute_time_left_if_stale, name="time-left-recompute",
+                             daemon=True).start()
+            return
+        row = self.cur.execute("SELECT value FROM maintenance_state WHERE name = 'time_left_constants'").fetchone()
+        if row and row[0] == self.time_left_constants():
+            return
+        try:
+            self.recompute_time_left()
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "time_left_recompute_failed", error=str(e))
+
     def update_pages_read(self, telegram_id: int, book_title: str, pages_read: int) -> bool:
         """
         Updates the number of pages read by a user for a specific book in the database.
@@ -345,19 +913,98 @@ class BookDatabase:
                 total_pages = pages_read + int(pages_read_yet)
             else:
                 total_pages = pages_read
-            print(pages_read, pages_read_yet, total_pages)
-            print(telegram_id, book_title)
+            log_event(logger, logging.DEBUG, "pages_read_updated", telegram_id=telegram_id, book_id=book_id,
+                      pages_read=pages_read, pages_read_yet=pages_read_yet, total_pages_read=total_pages)
         else:
             total_pages = None
+        # The pages, the next reminder and the time left commit together, in the transaction that claims the update
+        statements = [("UPDATE books_and_users SET pages_read = ? WHERE user_id = ? AND book_id = ?",
+                       (total_pages, telegram_id, book_id)),
+                      *self.reminders.progress_statements(telegram_id, [book_id]),
+                      self.time_left_statement(telegram_id, book_id=book_id)]
         try:
-            self.cur.execute("UPDATE books_and_users SET pages_read = ? WHERE user_id = ? AND book_id = ?",
-                             (total_pages, telegram_id, book_id))
-            self.conn.commit()
+            self.commit_writes(statements, telegram_id)
         except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "pages_read_update_failed", telegram_id=telegram_id, book_id=book_id,
+                      error=str(e))
             return False
-        else:
-            self.update_reading_time_left(telegram_id, book_title)
-            return True
+        return True
+
+    def retrieve_user_books(self, telegram_id: int) -> list:
+        """
+        Retrieves every book the user tracks, with their progress, in one query.
+
+        Args:
+            telegram_id (int): The unique identifier of the user in Telegram.
+
+        Returns:
+            list: One dict per book with ``book_id``, ``title``, ``total_pages``, ``pages_read`` and ``book_status``,
+            taken from the user's latest status row of the book.
+        """
+        self.flush_pending_writes(telegram_id)
+        rows = self.cur.execute("SELECT b.id, b.title, b.total_pages, bu.pages_read, bu.book_status "
+                                "FROM books_and_users AS bu JOIN books AS b ON b.id = bu.book_id "
+                                "WHERE bu.user_id = ? ORDER BY bu.rowid", (telegram_id,)).fetchall()
+        books = {}
+        for book_id, title, total_pages, pages_read, book_status in rows:
+            books[book_id] = {"book_id": book_id, "title": title, "total_pages": total_pages,
+                              "pages_read": pages_read or 0, "book_status": book_status}
+        return list(books.values())
+
+    def apply_reading_progress(self, telegram_id: int, progress: dict) -> list:
+        """
+        Adds pages read to several of the user's books and recomputes their reading time left in one transaction,
+        together with the books' reading reminders. A book whose last page is reached is marked completed.
+
+        Args:
+            telegram_id (int): The unique identifier of the user in Telegram.
+            progress (dict): Book id to ``(book, pages)``, with ``book`` a dict from ``retrieve_user_books``.
+
+        Returns:
+            list: One dict per book with ``title``, ``pages_read``, ``total_pages``, ``time_left`` (minutes) and
+            ``finished``. Empty if the transaction failed.
+        """
+        reading_speed = self.retrieve_reading_speed(telegram_id) or AVG_READING_SPEED
+        statements, results, progressing, finished = [], [], [], []
+        for book_id, (book, pages) in progress.items():
+            pages_read = min(book["pages_read"] + pages, book["total_pages"])
+            time_left = (book["total_pages"] - pages_read) * AVG_WORDS_PER_PAGE / reading_speed
+            done = pages_read >= book["total_pages"]
+            statements.append(("UPDATE books_and_users SET pages_read = ?, time_left = ?, book_status = ? "
+                               "WHERE user_id = ? AND book_id = ?",
+                               (pages_read, time_left, COMPLETED if done else book["book_status"], telegram_id,
+                                book_id)))
+            if done:
+                finished.append(book_id)
+            elif book["book_status"] == CURRENTLY_READING:
+                progressing.append(book_id)
+            results.append({"title": book["title"], "pages_read": pages_read, "total_pages": book["total_pages"],
+                            "time_left": time_left, "finished": done})
+        statements += self.reminders.progress_statements(telegram_id, progressing)
+        statements += [self.reminders.cancel_statement(telegram_id, book_id) for book_id in finished]
+        try:
+            self.commit_writes(statements, telegram_id)
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "reading_progress_update_failed", telegram_id=telegram_id,
+                      books=len(progress), error=str(e))
+            return []
+        log_event(logger, logging.DEBUG, "reading_progress_updated", telegram_id=telegram_id, books=len(progress),
+                  finished=len(finished))
+        return results
+
+    def stop_reading_reminders(self, telegram_id: int, book_title: str | None = None) -> None:
+        """
+        Stops reading reminders for a book the user finished, or for all their books.
+        """
+        book_id = None
+        if book_title:
+            book_id = self.retrieve_book_id(book_title)
+            if book_id is None:
+                return
+        try:
+            self.reminders.cancel(telegram_id, book_id)
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, "reminder_cancel_failed", telegram_id=telegram_id, error=str(e))
 
     def calculate_reading_time_left(self, telegram_id: int, book_title: str) -> int:
         """
@@ -373,12 +1020,13 @@ class BookDatabase:
         user_reading_speed = self.retrieve_reading_speed(telegram_id)
         total_pages = self.retrieve_total_pages(book_title)
         pages_read = self.retrieve_pages_read(telegram_id, book_title)
-        print(f"Pages read {pages_read}")
         if not pages_read:
             pages_read = 0
         total_pages = total_pages - pages_read
         total_words = total_pages * AVG_WORDS_PER_PAGE
         time_left_in_mins = total_words / user_reading_speed
+        log_event(logger, logging.DEBUG, "reading_time_left_calculated", telegram_id=telegram_id,
+                  book_title=book_title, pages_left=total_pages, time_left=time_left_in_mins)
         return time_left_in_mins
 
 
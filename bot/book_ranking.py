@@ -0,0 +1,112 @@
+import logging
+import os
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from structured_logging import log_event
+from title_index import normalize
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Language code (as in Google Books' volumeInfo.language) whose editions are shown first
+PREFERRED_LANGUAGE = os.getenv("MYSCRIBE_PREFERRED_LANGUAGE", "en")
+
+# Score weights. Title similarity dominates; the rest separates editions of the same title
+TITLE_WEIGHT = 0.5
+EXACT_TITLE_BONUS = 0.2
+EXACT_AUTHOR_BONUS = 0.3
+AUTHOR_WEIGHT = 0.15
+# A result without them makes the user type the page count, or loses the canonical ISBN identity
+PAGE_COUNT_BONUS = 0.1
+ISBN13_BONUS = 0.1
+LANGUAGE_BONUS = 0.1
+
+RESULTS_REORDERED = REGISTRY.counter("myscribe_book_results_reordered_total",
+                                     "Book searches whose best match was not the API's first result.")
+NEXT_CLICKS_SAVED = REGISTRY.counter("myscribe_book_ranking_next_clicks_saved_total",
+                                     "\"Next\" clicks the ranking saved: the API position of the best match.")
+UPSTREAM_CALLS_SAVED = REGISTRY.counter("myscribe_book_ranking_upstream_calls_saved_total",
+                                        "Inline Wikipedia lookups of skipped results the ranking saved.")
+NEXT_CLICKS = REGISTRY.counter("myscribe_book_result_next_clicks_total",
+                               "\"Next\" clicks on shown book search results.")
+ACCEPTED_RESULTS = REGISTRY.counter("myscribe_book_result_accepted_total",
+                                    "Book search results confirmed by the user, by position shown.", ("position",))
+
+
+def token_similarity(first: str, second: str) -> float:
+    """
+    Dice coefficient of the word sets of two normalized texts, from 0 (nothing shared) to 1 (same words).
+    """
+    first_tokens, second_tokens = set(first.split()), set(second.split())
+    if not first_tokens or not second_tokens:
+        return 0.0
+    return 2 * len(first_tokens & second_tokens) / (len(first_tokens) + len(second_tokens))
+
+
+def score_volume(volume_info: dict, book_title: str, book_author: str | None = None,
+                 language: str = PREFERRED_LANGUAGE) -> float:
+    """
+    Scores how well a Google Books volume matches the title and author the user asked for.
+
+    Args:
+        volume_info (dict): The ``volumeInfo`` of a search result.
+        book_title (str): The requested title.
+        book_author (str | None): The requested author, if any.
+        language (str): Preferred language code.
+
+    Returns:
+        float: Higher is better; 1.5 for an exact title and author match with every detail present.
+    """
+    wanted_title = normalize(book_title)
+    title = normalize(volume_info.get("title"))
+    full_title = normalize(f"{volume_info.get('title', '')} {volume_info.get('subtitle', '')}")
+    score = TITLE_WEIGHT * max(token_similarity(wanted_title, title), token_similarity(wanted_title, full_title))
+    if wanted_title and title == wanted_title:
+        score += EXACT_TITLE_BONUS
+
+    wanted_author = normalize(book_author)
+    authors = [normalize(author) for author in volume_info.get("authors") or ()]
+    if wanted_author and authors:
+        if wanted_author in authors:
+            score += EXACT_AUTHOR_BONUS
+        else:
+            score += AUTHOR_WEIGHT * max(token_similarity(wanted_author, author) for author in authors)
+
+    if volume_info.get("pageCount"):
+        score += PAGE_COUNT_BONUS
+    if any(identifier.get("type") == "ISBN_13" for identifier in volume_info.get("industryIdentifiers") or ()):
+        score += ISBN13_BONUS
+    if language and volume_info.get("language") == language:
+        score += LANGUAGE_BONUS
+    return score
+
+
+def rank_search_result(search_result: dict, book_title: str, book_author: str | None = None,
+                       inline_enrichment: bool = False) -> dict:
+    """
+    Orders the items of a Google Books search result best match first. Ties keep the API's order.
+
+    Args:
+        search_result (dict): The ``volumes.list`` response. It may be a shared cached object and is not modified.
+        book_title (str): The requested title.
+        book_author (str | None): The requested author, if any.
+        inline_enrichment (bool): Whether showing a result also makes a Wikipedia lookup, for the saved-calls metric.
+
+    Returns:
+        dict: A copy of the response with its items reordered.
+    """
+    items = search_result.get("items") or []
+    if len(items) < 2:
+        return search_result
+    scores = [score_volume(item.get("volumeInfo") or {}, book_title, book_author) for item in items]
+    order = sorted(range(len(items)), key=lambda index: -scores[index])
+    best = order[0]
+    if best != 0:
+        RESULTS_REORDERED.inc()
+        NEXT_CLICKS_SAVED.inc(best)
+        if inline_enrichment:
+            UPSTREAM_CALLS_SAVED.inc(best)
+        log_event(logger, logging.DEBUG, "book_results_reordered", book_title=book_title, api_position=best,
+                  scores=[round(scores[index], 3) for index in order])
+    return {**search_result, "items": [items[index] for index in order]}
@@ -0,0 +1,88 @@
+class BookRecord:
+    """
+    Immutable details of one book, as parsed from the Books API, stored in the ``books`` table and shown in the chat.
+
+    Instances hold their fields in slots rather than a ``__dict__``, so the many books kept in memory (search results,
+    the title index, caches) stay small, and they cannot be modified: ``replace`` returns an edited copy, so a record
+    handed to one conversation or cache is never changed under another.
+    """
+
+    __slots__ = ("title", "author", "genre", "language", "total_pages", "isbn13", "description", "cover_url")
+
+    # The ``books`` columns holding each field, in slot order, for explicit INSERT and SELECT column lists
+    COLUMNS = ("title", "author", "genre", "language", "total_pages", "isbn13", "description", "book_cover_url")
+    # Fields shown in the chat. The description can be several KB and is only loaded on request
+    DETAIL_FIELDS = ("title", "author", "genre", "language", "total_pages", "isbn13", "cover_url")
+
+    def __init__(self, title: str, author: str | None = None, genre: str | None = None, language: str | None = None,
+                 total_pages: int | None = None, isbn13: str | int | None = None, description: str | None = None,
+                 cover_url: str | None = None):
+        # Slots are written through object.__setattr__, as this class refuses assignments
+        set_field = object.__setattr__
+        set_field(self, "title", title)
+        set_field(self, "author", author)
+        set_field(self, "genre", genre)
+        set_field(self, "language", language)
+        set_field(self, "total_pages", total_pages)
+        set_field(self, "isbn13", isbn13)
+        set_field(self, "description", description)
+        set_field(self, "cover_url", cover_url)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"BookRecord is immutable; use replace({name}=...)")
+
+    def __delattr__(self, name):
+        raise AttributeError("BookRecord is immutable")
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, BookRecord):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __hash__(self) -> int:
+        return hash(self.values())
+
+    def __repr__(self) -> str:
+        return f"BookRecord(title={self.title!r}, author={self.author!r}, isbn13={self.isbn13!r})"
+
+    def __reduce__(self):
+        return BookRecord, self.values()
+
+    def values(self) -> tuple:
+        """
+        The fields in slot order, which is also the order of ``COLUMNS``.
+        """
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def replace(self, **changes) -> "BookRecord":
+        """
+        A copy of the record with the given fields changed.
+        """
+        return BookRecord(**{field: changes.pop(field, getattr(self, field)) for field in self.__slots__}, **changes)
+
+    @classmethod
+    def columns(cls, fields: tuple) -> str:
+        """
+        The ``books`` column list selecting the given fields, in order.
+        """
+        return ", ".join(cls.COLUMNS[cls.__slots__.index(field)] for field in fields)
+
+    @classmethod
+    def from_row(cls, row, fields: tuple | None = None) -> "BookRecord":
+        """
+        Builds a record from a row selected with ``COLUMNS``, or with ``columns(fields)`` for a projection; the
+        fields not selected are None.
+        """
+        if fields is None:
+            return cls(*row)
+        return cls(**dict(zip(fields, row)))
+
+    def as_dict(self) -> dict:
+        """
+        The fields as a JSON-serialisable dict, e.g. to keep the book in a stored conversation.
+        """
+        return dict(zip(self.__slots__, self.values()))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BookRecord":
+        return cls(**{field: data.get(field) for field in cls.__slots__})
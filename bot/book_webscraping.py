@@ -3,15 +3,30 @@ import os
 import requests
 import bs4
 from dotenv import  load_dotenv
+from api_budget import ApiBudget, QuotaExhausted
+from circuit_breaker import UPSTREAM_TIMEOUT, UpstreamUnavailable, circuit_breaker
+from metrics import track_dependency
+from row_cache import MISSING, RowCache
 
 load_dotenv()
 # Google Custom Search Engine (CSE) credentials
 GOOGLE_SE_ID = os.getenv("GOOGLE_SEARCH_ID")
 GOOGLE_SE_API = os.getenv("GOOGLE_SEARCH_API")
 GOOGLE_SE_URL = os.getenv("GOOGLE_BOOKS_URL")
+RECOMMENDATION_CACHE_SIZE = 256
 
 
 class BookWebScraping:
+    def __init__(self, api_budget: ApiBudget | None = None):
+        """
+        Args:
+            api_budget (ApiBudget | None): Coalesces, caches and budgets Google CSE requests.
+        """
+        self.api_budget = api_budget or ApiBudget()
+        # Last scraped recommendations per title, served while scraping is unavailable
+        # Thread-safe: job workers scrape concurrently. Entries never expire, they are the fallback for outages
+        self.recommendation_cache = RowCache("recommendations", RECOMMENDATION_CACHE_SIZE, ttl_seconds=None)
+
     def extract_genre(self, genre_tag: bs4.element.Tag) -> str:
         """
         Extract genre information from the HTML genre tag.
@@ -43,22 +58,52 @@ class BookWebScraping:
 
         return genre
 
-    def get_book_genre_language_wikipedia(self, book_name: str, author_name: str) -> tuple:
+    def get_book_genre_language_wikipedia(self, book_name: str, author_name: str, fallback: bool = True) -> tuple:
         """
         Get book genre and language information from Wikipedia.
 
         Parameters:
         - book_name (str): Name of the book.
         - author_name (str): Name of the author (optional).
+        - fallback (bool): Return (None, None) when the lookup is unavailable. Background jobs pass False so the
+          failure is retried instead.
 
         Returns:
         - tuple: A tuple containing genre and language information.
+
+        Raises:
+        - UpstreamUnavailable: Without ``fallback``, if Google CSE or Wikipedia could not be reached.
         """
         if author_name:
             query = f"{book_name} by {author_name} wikipedia"
         else:
             query = f"{book_name} wikipedia"
 
+        # Concurrent lookups of the same book share one search; near the CSE daily quota only cached answers are used
+        try:
+            return self.api_budget.call("google_cse", GOOGLE_SE_API, query.lower(),
+                                        lambda: self.search_genre_language_wikipedia(query))
+        except QuotaExhausted:
+            # Genre and language stay unknown; the user can still enter them while confirming the book
+            return None, None
+        except UpstreamUnavailable:
+            if not fallback:
+                raise
+            return None, None
+
+    def search_genre_language_wikipedia(self, query: str) -> tuple:
+        """
+        Finds the book's Wikipedia page with Google CSE and reads genre and language from its infobox.
+
+        Parameters:
+        - query (str): The search query.
+
+        Returns:
+        - tuple: A tuple containing genre and language information.
+
+        Raises:
+        - UpstreamUnavailable: If Google CSE or Wikipedia failed, timed out or has its circuit open.
+        """
         # Set parameters for Google Custom Search Engine (CSE) API request
         param = {
             "key": GOOGLE_SE_API,
@@ -67,14 +112,24 @@ class BookWebScraping:
         }
 
         # Perform Google CSE API request
-        response = requests.get(GOOGLE_SE_URL, params=param)
-        result = response.json()
+        with circuit_breaker("google_cse").guard():
+            with track_dependency("google_cse", "search"):
+                response = requests.get(GOOGLE_SE_URL, params=param, timeout=UPSTREAM_TIMEOUT)
+            response.raise_for_status()
+            result = response.json()
 
         # Extract Wikipedia page URL from the API response
-        url = result['items'][0]['link']
+        items = result.get('items')
+        if not items:
+            # The search found no page for this book
+            return None, None
+        url = items[0]['link']
 
         # Fetch the HTML content of the Wikipedia page
-        response2 = requests.get(url)
+        with circuit_breaker("wikipedia").guard():
+            with track_dependency("wikipedia", "page"):
+                response2 = requests.get(url, timeout=UPSTREAM_TIMEOUT)
+            response2.raise_for_status()
         soup = bs4.BeautifulSoup(response2.text, "html.parser")
 
         # Extract genre and language tags from the Wikipedia page HTML
@@ -96,11 +151,41 @@ class BookWebScraping:
         """
         Scrapes book recommendations from Goodreads for a given book title, prioritizing ethical scraping practices.
 
+        While Google search or Goodreads is unavailable, the last recommendations scraped for the title are returned.
+
         Args:
             book_title (str): The title of the book to get recommendations for.
 
         Returns:
             dict: A dictionary of recommended books and their authors, in the format {book_title: author_name}.
+
+        Raises:
+            UpstreamUnavailable: If scraping failed and no earlier recommendations for the title are cached.
+        """
+        cache_key = book_title.strip().lower()
+        try:
+            recommended_books_and_authors = self.scrape_goodreads_recommendations(book_title)
+        except UpstreamUnavailable:
+            cached = self.recommendation_cache.get(cache_key)
+            if cached is MISSING:
+                raise
+            return cached
+        if recommended_books_and_authors:
+            self.recommendation_cache.put(cache_key, recommended_books_and_authors)
+        return recommended_books_and_authors
+
+    def scrape_goodreads_recommendations(self, book_title):
+        """
+        Finds the Goodreads similar-books page of a title through Google search and scrapes it.
+
+        Args:
+            book_title (str): The title of the book to get recommendations for.
+
+        Returns:
+            dict: Recommended books and their authors, empty if no similar-books page was found.
+
+        Raises:
+            UpstreamUnavailable: If Google search or Goodreads failed, timed out or has its circuit open.
         """
         book_title.replace(" ", "+")
         query = f"books+similar+to+{book_title}+goodreads"
@@ -109,12 +194,16 @@ class BookWebScraping:
 
         # Fetch the URL data using requests.get(url),
         # store it in a variable, request_result.
-        response = requests.get(url)
+        with circuit_breaker("google_search").guard():
+            with track_dependency("google_search", "search"):
+                response = requests.get(url, timeout=UPSTREAM_TIMEOUT)
+            response.raise_for_status()
 
         soup = bs4.BeautifulSoup(response.text, "html.parser")
         links = soup.findAll('div', class_='kCrYT')
 
         # print(links)
+        url_link = None
         for link in links:
             try:
                 url_link = link.a['href'][7:]
@@ -123,8 +212,15 @@ class BookWebScraping:
             else:
                 break
 
+        if url_link is None:
+            # No Goodreads result in the search page
+            return {}
+
         # print(url_link)
-        request_result = requests.get(url_link)
+        with circuit_breaker("goodreads").guard():
+            with track_dependency("goodreads", "similar_books"):
+                request_result = requests.get(url_link, timeout=UPSTREAM_TIMEOUT)
+            request_result.raise_for_status()
         soup = bs4.BeautifulSoup(request_result.text,
                                  "html.parser")
 
@@ -0,0 +1,180 @@
+from typing import NamedTuple
+
+# Bump when the payload layout changes; buttons from older versions are then ignored instead of misread.
+CALLBACK_VERSION = 3
+# Telegram rejects callback_data longer than 64 bytes.
+MAX_CALLBACK_BYTES = 64
+SEPARATOR = ":"
+
+# Action name -> two-letter code sent to Telegram
+ACTION_CODES = {
+    "confirm_book_details": "cb",
+    "get_next_book_details": "nb",
+    "change_genre": "cg",
+    "change_language": "cl",
+    "no_change_req": "ok",
+    "reading_done": "rd",
+    "recommendation_wishlist": "rw",
+    "recommendation_next_book": "rn",
+}
+CODE_ACTIONS = {code: action for action, code in ACTION_CODES.items()}
+
+# The payload fields each action's buttons carry, in order. The buttons of the Books API search flow carry the shown
+# result's index and the id of the chat's stored search instead of the search itself: the title, author and
+# user-edited record a click acts on do not fit in 64 bytes, so they are kept server side (ConversationStore) and
+# looked up by that id.
+_SEARCH_FIELDS = ("cursor", "search_id")
+ACTION_FIELDS = {
+    "confirm_book_details": _SEARCH_FIELDS,
+    "get_next_book_details": _SEARCH_FIELDS,
+    "change_genre": _SEARCH_FIELDS,
+    "change_language": _SEARCH_FIELDS,
+    "no_change_req": _SEARCH_FIELDS,
+    "reading_done": ("cursor",),
+    "recommendation_wishlist": ("book_id", "cursor"),
+    "recommendation_next_book": ("book_id", "cursor"),
+}
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+class CallbackPayload(NamedTuple):
+    """
+    Decoded callback data of an inline keyboard button. Fields the action does not carry (ACTION_FIELDS) are None.
+
+    Attributes:
+        action (str): What the button does, a key of ACTION_CODES.
+        book_id (int | None): The book the button refers to, when it is in the database.
+        cursor (int | None): Action specific position, e.g. the index of the shown API result or a start timestamp.
+        search_id (int | None): The chat's stored Books API search the button was created for
+            (ConversationStore.save_search).
+        version (int): The payload layout version.
+    """
+    action: str
+    book_id: int | None = None
+    cursor: int | None = None
+    search_id: int | None = None
+    version: int = CALLBACK_VERSION
+
+
+def _to_base36(number: int | None) -> str:
+    if number is None:
+        return ""
+    if number < 0:
+        raise ValueError("Callback numbers must not be negative")
+    encoded = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        encoded = _DIGITS[remainder] + encoded
+        if not number:
+            return encoded
+
+
+def _from_base36(encoded: str) -> int | None:
+    return int(encoded, 36) if encoded else None
+
+
+def encode_callback(action: str, book_id: int | None = None, cursor: int | None = None,
+                    search_id: int | None = None) -> str:
+    """
+    Encodes a button's action and the context its action carries (ACTION_FIELDS) into compact callback data, e.g.
+    ``3:nb:2:1k``.
+
+    Args:
+        action (str): A key of ACTION_CODES.
+        book_id (int | None): The book the button refers to.
+        cursor (int | None): Action specific position.
+        search_id (int | None): The stored search the button was created for.
+
+    Returns:
+        str: The callback data.
+
+    Raises:
+        ValueError: If the action is unknown, is given a field it does not carry, or the result would not fit
+            Telegram's 64-byte limit.
+    """
+    if action not in ACTION_CODES:
+        raise ValueError(f"Unknown callback action: {action}")
+    values = {"book_id": book_id, "cursor": cursor, "search_id": search_id}
+    fields = ACTION_FIELDS[action]
+    if any(value is not None for field, value in values.items() if field not in fields):
+        raise ValueError(f"Callback action {action} only carries {', '.join(fields)}")
+    data = SEPARATOR.join((_to_base36(CALLBACK_VERSION), ACTION_CODES[action],
+                           *(_to_base36(values[field]) for field in fields)))
+    if len(data.encode()) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"Callback data for {action} exceeds {MAX_CALLBACK_BYTES} bytes")
+    return data
+
+
+def decode_callback(data: str | None) -> CallbackPayload | None:
+    """
+    Decodes callback data written by encode_callback.
+
+    Returns:
+        CallbackPayload | None: The payload, or None for foreign, malformed or other-version data.
+    """
+    if not data:
+        return None
+    parts = data.split(SEPARATOR)
+    if len(parts) < 2 or parts[1] not in CODE_ACTIONS:
+        return None
+    action = CODE_ACTIONS[parts[1]]
+    fields = ACTION_FIELDS[action]
+    if len(parts) != 2 + len(fields):
+        return None
+    try:
+        version = _from_base36(parts[0])
+        values = {field: _from_base36(part) for field, part in zip(fields, parts[2:])}
+    except ValueError:
+        return None
+    if version != CALLBACK_VERSION:
+        return None
+    return CallbackPayload(action, version=version, **values)
+
+
+class CallbackRouter:
+    """
+    Routes callback queries to handlers by the action encoded in their data.
+
+    Example:
+        router = CallbackRouter()
+        router.add("reading_done", handle_reading_done)    # handle_reading_done(query, payload)
+        router.route("change_genre", "change_language")(handle_change)
+        bot.callback_query_handler(func=router.matches)(router.dispatch)
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def add(self, action: str, handler) -> None:
+        """
+        Registers the handler for an action. It is called with the callback query and its CallbackPayload.
+        """
+        if action not in ACTION_CODES:
+            raise ValueError(f"Unknown callback action: {action}")
+        self.routes[action] = handler
+
+    def route(self, *actions: str):
+        """
+        Decorator form of ``add`` registering one handler for several actions.
+        """
+        def decorator(handler):
+            for action in actions:
+                self.add(action, handler)
+            return handler
+        return decorator
+
+    def matches(self, query) -> bool:
+        """
+        Tells whether the query carries a payload this router has a handler for.
+        """
+        payload = decode_callback(query.data)
+        return payload is not None and payload.action in self.routes
+
+    def dispatch(self, query) -> None:
+        """
+        Calls the handler registered for the query's action.
+        """
+        payload = decode_callback(query.data)
+        if payload is not None and payload.action in self.routes:
+            self.routes[payload.action](query, payload)
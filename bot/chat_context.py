@@ -0,0 +1,234 @@
+import collections
+import contextlib
+import contextvars
+import os
+import threading
+
+from dotenv import load_dotenv
+from book_record import BookRecord
+
+load_dotenv()
+
+# Chats whose context is kept in memory; the least recently active idle ones are dropped beyond it
+MAX_CHAT_CONTEXTS = int(os.getenv("MYSCRIBE_MAX_CHAT_CONTEXTS", 10_000))
+
+# The context of the chat whose update the current handler is processing, see ChatContexts.activate
+current_chat = contextvars.ContextVar("current_chat", default=None)
+
+
+class ChatContext:
+    """
+    Flow state of one chat: who is talking, which book the flow is about and what is being done with it.
+
+    Attributes:
+        chat_id (int | None): The Telegram chat.
+        user_id (int | None): The user the flow is for.
+        book_title (str | None): The book being looked up or updated, lower-cased.
+        book_author (str | None): The author the user gave for the book.
+        book_status (int | None): What the user is doing with the book (reading, completed, wishlist).
+        book_id (int | None): The book's id once it was found in the database.
+        process_book_info_directly (bool): Look the book up as soon as its title is entered.
+        reading_started_at (float | None): Start of the reading speed test.
+        reading_ended_at (float | None): End of the reading speed test.
+        book (BookRecord | None): The book shown to the user, from the Books API or the database.
+        api_search_result (dict | None): The chat's last Books API search, ranked best match first.
+        api_search_result_count (int): How many results of that search were shown; the next one is shown next.
+        api_unavailable (bool): Whether the chat's last Books API lookup failed because the API is unavailable.
+        search_id (int | None): The id the search is stored under once its results were shown with buttons
+            (ConversationStore.save_search); a new search gets a new one.
+        next_step (str | None): The conversation step saved while handling the current update, if any.
+        lock (threading.RLock): Held while one of the chat's updates is handled.
+    """
+
+    __slots__ = ("chat_id", "user_id", "_book_title", "book_author", "book_status", "book_id",
+                 "process_book_info_directly", "reading_started_at", "reading_ended_at", "book", "_api_search_result",
+                 "api_search_result_count", "api_unavailable", "search_id", "next_step", "lock")
+
+    def __init__(self, chat_id: int | None = None):
+        self.chat_id = chat_id
+        self.user_id = None
+        self._book_title = None
+        self.book_author = None
+        self.book_status = None
+        self.book_id = None
+        self.process_book_info_directly = False
+        self.reading_started_at = None
+        self.reading_ended_at = None
+        self.book = None
+        self._api_search_result = None
+        self.api_search_result_count = 0
+        self.api_unavailable = False
+        self.search_id = None
+        self.next_step = None
+        self.lock = threading.RLock()
+
+    @property
+    def book_title(self) -> str | None:
+        return self._book_title
+
+    @book_title.setter
+    def book_title(self, value: str | None) -> None:
+        # Titles are compared lower-cased everywhere
+        self._book_title = value.lower() if value else None
+
+    @property
+    def api_search_result(self) -> dict | None:
+        return self._api_search_result
+
+    @api_search_result.setter
+    def api_search_result(self, value: dict | None) -> None:
+        # Buttons of the previous search must not resolve to this one
+        self._api_search_result = value
+        self.search_id = None
+
+    def as_dict(self) -> dict:
+        """
+        The flow state as the JSON-serialisable data a conversation step is saved with. The search result itself is
+        left out: it is stored once under ``search_id``.
+        """
+        return {"current_user_id": self.user_id,
+                "current_book_title": self.book_title,
+                "current_book_author": self.book_author,
+                "current_book_status": self.book_status,
+                "process_book_info_directly": self.process_book_info_directly,
+                "book": self.book.as_dict() if self.book else None,
+                "api_search_result_count": self.api_search_result_count,
+                "search_id": self.search_id}
+
+    @classmethod
+    def from_dict(cls, chat_id: int | None, data: dict) -> "ChatContext":
+        """
+        A context holding the flow state saved by ``as_dict``, and the search result if ``data`` holds one (see
+        ChatBot.remember_search).
+        """
+        context = cls(chat_id)
+        context.user_id = data["current_user_id"]
+        context.book_title = data["current_book_title"]
+        context.book_author = data["current_book_author"]
+        context.book_status = data["current_book_status"]
+        context.process_book_info_directly = data["process_book_info_directly"]
+        context.book = BookRecord.from_dict(data["book"]) if data["book"] else None
+        # Steps saved before the count was part of the flow state start over at the first result
+        context.api_search_result_count = data.get("api_search_result_count", 0)
+        context.api_search_result = data.get("api_search_result")
+        context.search_id = data.get("search_id")
+        return context
+
+
+class ChatContexts:
+    """
+    The ChatContext of every active chat, and the serialisation of each chat's handlers.
+
+    The scheduler runs handlers of different chats on different workers at the same time, and a chat's updates one at
+    a time in the order they arrived (Scheduler.submit). ``activate`` makes a handler work on its own chat's context
+    and holds that chat's lock meanwhile, so a handler run outside the scheduler cannot interleave with the chat's
+    scheduled one either.
+    """
+
+    def __init__(self, max_contexts: int = MAX_CHAT_CONTEXTS):
+        """
+        Args:
+            max_contexts (int): Contexts kept; idle ones beyond it are dropped, least recently active first.
+        """
+        self.max_contexts = max_contexts
+        self.contexts = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, chat_id: int | None) -> ChatContext:
+        """
+        The chat's context, created on first use.
+        """
+        with self.lock:
+            context = self.contexts.get(chat_id)
+            if context is None:
+                if len(self.contexts) >= self.max_contexts:
+                    self._drop_idle()
+                context = self.contexts[chat_id] = ChatContext(chat_id)
+            else:
+                self.contexts.move_to_end(chat_id)
+            return context
+
+    def restore(self, context: ChatContext) -> None:
+        """
+        Replaces the context of the chat being handled, e.g. with one rebuilt from its stored conversation step, so
+        nothing of an earlier flow is left in it. Only called inside ``activate`` for the same chat, whose lock the
+        new context takes over.
+        """
+        active = active_chat()
+        context.lock = active.lock
+        context.next_step = active.next_step
+        with self.lock:
+            self.contexts[context.chat_id] = context
+        # activate resets the variable when the block ends, whatever it was set to meanwhile
+        current_chat.set(context)
+
+    def _drop_idle(self) -> None:
+        for chat_id, context in list(self.contexts.items()):
+            if len(self.contexts) < self.max_contexts:
+                return
+            # A context whose chat is being handled stays, or a second one could be handed out for the same chat
+            if context is not current_chat.get() and context.lock.acquire(blocking=False):
+                del self.contexts[chat_id]
+                context.lock.release()
+
+    @contextlib.contextmanager
+    def activate(self, chat_id: int | None):
+        """
+        Makes the chat's context the current one, holding the chat's lock until the block ends.
+
+        Yields:
+            ChatContext: The chat's context.
+        """
+        while True:
+            context = self.get(chat_id)
+            context.lock.acquire()
+            with self.lock:
+                if self.contexts.get(chat_id) is context:
+                    break
+            # Dropped as idle between get() and acquire(); the chat's next context is the one to use
+            context.lock.release()
+        context.next_step = None
+        token = current_chat.set(context)
+        try:
+            yield context
+        finally:
+            current_chat.reset(token)
+            context.lock.release()
+
+
+class ChatAttribute:
+    """
+    Descriptor of an attribute kept in the context of the chat being handled rather than on the object itself.
+
+    Example:
+        class ChatBot:
+            current_user_id = ChatAttribute("user_id")
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name (str): The ChatContext attribute.
+        """
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(active_chat(), self.name)
+
+    def __set__(self, instance, value) -> None:
+        setattr(active_chat(), self.name, value)
+
+
+def active_chat() -> ChatContext:
+    """
+    The context of the chat whose update is being handled.
+
+    Raises:
+        RuntimeError: Outside ChatContexts.activate, where no chat is being handled.
+    """
+    context = current_chat.get()
+    if context is None:
+        raise RuntimeError("No chat update is being handled")
+    return context
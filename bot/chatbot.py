@@ -1,71 +1,109 @@
+import functools
+import logging
+import os
+import sqlite3
+import threading
 import time
 import telebot.types
 from telegram_bot import TelegramBot
+from backup import BACKUP_JOB, DatabaseBackup
 from book_database import BookDatabase
+from db_maintenance import DatabaseMaintenance
 from book_bot import BookBot
+from book_record import BookRecord
+from book_ranking import ACCEPTED_RESULTS, NEXT_CLICKS
+from callback_data import CallbackPayload, CallbackRouter
+from chat_context import ChatAttribute, ChatContext, ChatContexts, active_chat
+from scheduler import RATE_LIMITED, Scheduler, update_chat_id
+from conversation_store import ConversationStore
+from job_queue import JobQueue
+from reminders import REMINDERS_PER_SECOND, ReminderScheduler
 from large_texts import LargeTexts
+from metrics import start_metrics_server, track_handler
+from profiling import PROFILER
+from structured_logging import configure_logging, log_event, with_correlation_id
+
+logger = logging.getLogger(__name__)
+
+# Telegram IDs allowed to use admin commands such as /profile
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("MYSCRIBE_ADMIN_IDS", "").split(",") if admin_id.strip()}
 
 # BOOK STATUS
 CURRENTLY_READING = 1
 COMPLETED = 2
 WISHLIST = 3
 
+# How long Telegram may reuse an inline autocomplete answer for the same query
+INLINE_CACHE_SECONDS = int(os.getenv("MYSCRIBE_INLINE_CACHE_SECONDS", 300))
+# Time given to read the reading speed test instructions before its paragraph is sent
+READING_SPEED_INSTRUCTIONS_SECONDS = 5
+
 
 class ChatBot:
     """
     Manages interactions with users, handles incoming messages, and interacts with other classes to provide book-related
     functionalities.
+
+    The flow state (the current user, book and what is being done with it) is kept per chat: the ``current_*``
+    attributes read and write the ChatContext of the chat whose update is being handled (see chat_context.py).
     """
 
-    def __init__(self):
+    current_user_id = ChatAttribute("user_id")
+    current_book_title = ChatAttribute("book_title")
+    current_book_author = ChatAttribute("book_author")
+    current_book_status = ChatAttribute("book_status")
+    current_book_id = ChatAttribute("book_id")
+    process_book_info_directly = ChatAttribute("process_book_info_directly")
+    calc_reading_speed_start_time = ChatAttribute("reading_started_at")
+    calc_reading_speed_end_time = ChatAttribute("reading_ended_at")
+
+    def __init__(self, telegram_bot: TelegramBot | None = None, book_bot: BookBot | None = None,
+                 book_database: BookDatabase | None = None, conversation_store: ConversationStore | None = None,
+                 scheduler: Scheduler | None = None, job_queue: JobQueue | None = None,
+                 database_backup: DatabaseBackup | None = None):
         """
         Initializes instances of TelegramBot, BookBot, BookDatabase, and LargeTexts classes for communication, data
         retrieval, and database interactions.
-        """
-        self.current_user_id = None
-        self._current_book_title = None
-        self.current_book_author = None
-        self.current_book_status = None
-        self.retrieved_book_status = None
-        self.calc_reading_speed_start_time = None
-        self.calc_reading_speed_end_time = None
-        self.process_book_info_directly = False
+
+        The instances are normally built once by ``application.Application`` and passed in. Anything not passed in
+        is created here, with BookBot sharing this ChatBot's database connection.
+
+        Args:
+            telegram_bot (TelegramBot | None): The Telegram bot wrapper.
+            book_bot (BookBot | None): The book lookup helper.
+            book_database (BookDatabase | None): The database connection.
+            conversation_store (ConversationStore | None): Where multi-step flows wait for the user's next message.
+            scheduler (Scheduler | None): Runs handlers by priority and sheds expensive work under load.
+            job_queue (JobQueue | None): Durable queue running slow lookups in the background. Shared with BookBot.
+            database_backup (DatabaseBackup | None): Takes the scheduled online backups of the database.
+        """
+        # Flow state of every chat; the scheduler runs handlers of different chats at the same time
+        self.chat_contexts = ChatContexts()
         # Instance of TelegramBot class.
-        self.telegram_bot = TelegramBot()
+        self.telegram_bot = telegram_bot or TelegramBot()
         self.bot = self.telegram_bot.bot
 
-        # Instance of BookBot class.
-        self.book_bot = BookBot()
-        self.books_chat_patterns = self.book_bot.books_chat_patterns
-
         # Instance of BookDatabase class.
-        self.book_database = BookDatabase()
+        self.book_database = book_database or BookDatabase()
 
-        # Instance of LargeText class.
-        self.large_texts = LargeTexts()
+        # Recommendations and enrichment run as background jobs whose results are sent to the chat when ready
+        self.job_queue = job_queue or JobQueue()
 
-    @property
-    def current_book_title(self) -> str:
-        """
-        Retrieves the current book title being tracked for the user.
+        # Scheduled online backups; analytics queries read the snapshots they leave
+        self.database_backup = database_backup or DatabaseBackup(job_queue=self.job_queue)
 
-        Returns:
-            str | None: The current book title (lower-cased) or None if no title is set.
-        """
-        return self._current_book_title
+        # Instance of BookBot class.
+        self.book_bot = book_bot or BookBot(book_database=self.book_database, job_queue=self.job_queue)
+        self.books_chat_patterns = self.book_bot.books_chat_patterns
 
-    @current_book_title.setter
-    def current_book_title(self, value: str) -> None:
-        """
-        Sets the current book title for the user, ensuring consistent formatting.
+        # Persistent next-step state, shared by every bot process
+        self.conversation_store = conversation_store or ConversationStore()
 
-        Args:
-            value (str | None): The new book title to set. If None, clears the current title.
-        """
-        if value:
-            self._current_book_title = value.lower()
-        else:
-            self._current_book_title = None
+        # Cheap interactions run before expensive lookups, which are rate limited per chat
+        self.scheduler = scheduler or Scheduler(on_shed=self.reply_busy)
+
+        # Instance of LargeText class.
+        self.large_texts = LargeTexts()
 
     # MISCELLANEOUS FUNCTIONS
     def send_greeting_message(self, message: telebot.types.Message) -> None:
@@ -114,6 +152,160 @@ class ChatBot:
             self.bot.send_message(message.chat.id, "There is an error saving your information. Please Try Again.")
 
     # CHATBOT FUNCTIONS
+    def instrument_handler(self, handler_name: str, schedule: bool = True, track_update: bool = True):
+        """
+        Decorator wrapping a handler with metrics, on-demand profiling, a per-update correlation id for logging and
+        the processed-update ledger, running it on its chat's context and through the scheduler.
+
+        Args:
+            handler_name (str): Name the handler is reported under; also decides its scheduler lane.
+            schedule (bool): Submit calls to the scheduler. False when the caller already runs on it.
+            track_update (bool): Record the update in the ledger. False for read-only updates that are harmless to
+                answer twice, such as inline queries sent on every keystroke.
+        """
+        def decorator(handler):
+            if track_update:
+                handler = self.book_database.update_ledger.track(handler)
+            handler = with_correlation_id(track_handler(handler_name)(PROFILER.track_handler(handler_name)(handler)))
+            handler = self.in_chat_context(handler)
+            return self.scheduler.schedule(handler_name)(handler) if schedule else handler
+        return decorator
+
+    def in_chat_context(self, handler):
+        """
+        Wraps a handler so it runs on the context of its update's chat, after the chat's previous update is done.
+        """
+        @functools.wraps(handler)
+        def wrapper(update, *args, **kwargs):
+            with self.chat_contexts.activate(update_chat_id(update)):
+                return handler(update, *args, **kwargs)
+        return wrapper
+
+    def reply_busy(self, update: telebot.types.Message | telebot.types.CallbackQuery, reason: str) -> None:
+        """
+        Tells the user an expensive request was not run because the bot is busy or they are asking too often.
+
+        Args:
+            update (telebot.types.Message | telebot.types.CallbackQuery): The refused update.
+            reason (str): Why the scheduler refused it.
+        """
+        if reason == RATE_LIMITED:
+            text = "You are going a bit fast! Please wait a minute before asking again."
+        else:
+            text = "I am quite busy right now. Please try again in a minute."
+        if isinstance(update, telebot.types.CallbackQuery):
+            # The keyboard stays in place, so the user can simply press the button again
+            self.bot.answer_callback_query(update.id, text)
+        else:
+            self.bot.send_message(update.chat.id, text)
+
+    def register_next_step(self, message: telebot.types.Message, callback) -> None:
+        """
+        Makes a ChatBot method handle the user's next message in this chat.
+
+        The step and the flow state it needs are saved in the conversation store rather than in telebot's in-memory
+        next-step table, so the flow survives restarts and can be resumed by any bot process.
+
+        Args:
+            message (telebot.types.Message): The message the user is replying to.
+            callback: The ChatBot method that should receive the user's next message.
+        """
+        self.conversation_store.save(message.chat.id, callback.__name__, self.snapshot_conversation())
+        active_chat().next_step = callback.__name__
+
+    def snapshot_conversation(self) -> dict:
+        """
+        Captures the flow state a next step needs as a JSON-serialisable dict.
+        """
+        return active_chat().as_dict()
+
+    def restore_conversation(self, message: telebot.types.Message, data: dict) -> None:
+        """
+        Makes the flow state captured by snapshot_conversation the state of the message's chat.
+        """
+        self.chat_contexts.restore(ChatContext.from_dict(message.chat.id, data))
+
+    def continue_conversation(self, message: telebot.types.Message) -> None:
+        """
+        Resumes the chat's pending flow with the user's message.
+
+        Args:
+            message (telebot.types.Message): The user's reply.
+        """
+        conversation = self.conversation_store.get(message.chat.id)
+        if not conversation:
+            # It expired in between
+            return
+        step = self.instrument_handler(conversation.step, schedule=False)(self.run_conversation_step)
+        # A refused step stays stored, so the user's next message continues the flow
+        self.scheduler.submit(conversation.step, message, lambda: step(message))
+
+    def run_conversation_step(self, message: telebot.types.Message) -> None:
+        """
+        Runs the step the chat is waiting in, on the flow state stored with it. Called with the chat's lock held.
+
+        The stored step is only deleted once it has run, and only if it did not save a successor: a step that fails
+        leaves the chat waiting in it, so the user's next message tries it again.
+
+        Args:
+            message (telebot.types.Message): The user's reply.
+        """
+        # Read again under the chat's lock: an earlier message of the chat may have moved the flow on meanwhile
+        conversation = self.conversation_store.get(message.chat.id)
+        if not conversation:
+            return
+        self.restore_conversation(message, conversation.data)
+        getattr(self, conversation.step)(message)
+        if active_chat().next_step is None:
+            self.conversation_store.finish(conversation)
+
+    def start_profiling(self, message: telebot.types.Message) -> None:
+        """
+        Starts an on-demand profiling session for admins. Accepts ``/profile``, ``/profile 60`` (seconds) and
+        ``/profile 100 updates``.
+
+        Args:
+            message (telebot.types.Message): The /profile command message.
+        """
+        if message.from_user.id not in ADMIN_IDS:
+            return
+        arguments = message.text.split()[1:]
+        if arguments and not arguments[0].isdigit():
+            self.bot.send_message(message.chat.id, "Usage: /profile [seconds] or /profile <count> updates")
+            return
+        if len(arguments) > 1 and arguments[1].startswith("update"):
+            session_dir = PROFILER.start(updates=int(arguments[0]))
+        else:
+            session_dir = PROFILER.start(seconds=int(arguments[0]) if arguments else None)
+
+        if session_dir:
+            self.bot.send_message(message.chat.id, f"Profiling started. Results will be written to {session_dir}")
+        else:
+            self.bot.send_message(message.chat.id, "A profiling session is already running.")
+
+    def recompute_reading_estimates(self, message: telebot.types.Message) -> None:
+        """
+        Recomputes every stored reading time left for admins, on a background thread, and reports how many changed.
+
+        Args:
+            message (telebot.types.Message): The /recompute_time_left command message.
+        """
+        if message.from_user.id not in ADMIN_IDS:
+            return
+
+        def recompute() -> None:
+            try:
+                updated = self.book_database.recompute_time_left()
+            except sqlite3.Error as e:
+                log_event(logger, logging.ERROR, "time_left_recompute_failed", error=str(e))
+                self.bot.send_message(message.chat.id, "Recomputing reading time left failed, see the logs.")
+            else:
+                self.bot.send_message(message.chat.id, f"Reading time left recomputed, {updated} rows changed.")
+
+        # A full pass takes seconds on a large database, longer than a handler should hold a scheduler worker
+        threading.Thread(target=recompute, name="time-left-recompute", daemon=True).start()
+        self.bot.send_message(message.chat.id, "Recomputing reading time left for all readers...")
+
     def get_telegram_id(self, message: telebot.types.Message | telebot.types.CallbackQuery) -> int:
         """
         Extracts the Telegram ID of the user from a telebot message or callback query.
@@ -146,7 +338,7 @@ class ChatBot:
         try:
             username = message.from_user.first_name
         except Exception as e:
-            print(e)
+            log_event(logger, logging.WARNING, "username_missing", error=str(e))
             username = None
 
         return username
@@ -179,15 +371,15 @@ class ChatBot:
         # Attempt to extract title using regex
         if regex:
             self.current_book_title = self.book_bot.extract_book_title_from_sentence(regex, sentence)
-            print(self.current_book_title)
+            log_event(logger, logging.DEBUG, "book_title_extracted", regex=regex, book_title=self.current_book_title)
             # Title not found using regex, prompt user for input
             if not self.current_book_title:
                 self.bot.send_message(message.chat.id, "Please Enter Name of The Book")
-                self.bot.register_next_step_handler(message, self.get_book_title_from_message)
+                self.register_next_step(message, self.get_book_title_from_message)
         # No regex provided, prompt user for input
         else:
             self.bot.send_message(message.chat.id, "Please Enter Name of The Book")
-            self.bot.register_next_step_handler(message, self.get_book_title_from_message)
+            self.register_next_step(message, self.get_book_title_from_message)
 
     def get_book_title_from_message(self, message: telebot.types.Message) -> None:
         """
@@ -200,7 +392,7 @@ class ChatBot:
             message: The Telegram message object.
         """
         self.current_book_title = message.text
-        print(self.current_book_title)
+        log_event(logger, logging.DEBUG, "book_title_entered", book_title=self.current_book_title)
         if self.process_book_info_directly:
             self.process_book_title_and_fetch_details(message)
 
@@ -220,7 +412,7 @@ class ChatBot:
         else:
             # If book not found in database, request author name for API search
             self.bot.send_message(message.chat.id, "Please Enter Author Name : ")
-            self.bot.register_next_step_handler(message, self.get_author_name)
+            self.register_next_step(message, self.get_author_name)
 
     def get_author_name(self, message: telebot.types.Message) -> None:
         """
@@ -235,7 +427,8 @@ class ChatBot:
         # Initiate book details retrieval from GOOGLE BOOKS API with both title and author
         self.retrieve_book_data_using_api(message, self.current_book_title, self.current_book_author)
 
-    def retrieve_book_data_using_api(self, message: telebot.types.Message, book_title: str, book_author: str) -> None:
+    def retrieve_book_data_using_api(self, message: telebot.types.Message, book_title: str, book_author: str,
+                                     result_index: int | None = None) -> None:
         """
         Retrieves book details from the API based on user input and shares them in the Telegram chat.
 
@@ -243,15 +436,114 @@ class ChatBot:
             message: The Telegram message object.
             book_title: The title of the book to search for.
             book_author: The author of the book to search for.
+            result_index: Index of the search result to show, the next one if not given.
         """
         # Attempt to fetch book details from the API
-        if self.book_bot.get_book_details_from_api(book_title, book_author):
+        if self.book_bot.get_book_details_from_api(book_title, book_author, result_index):
             self.share_book_details_from_api_in_chat(message)
+        elif self.book_bot.api_unavailable:
+            # Fall back to the books already in the database instead of waiting for the Books API
+            if self.book_bot.get_book_details_from_db_fallback(book_title, book_author):
+                self.current_book_title = self.book_bot.book.title
+                self.current_book_id = self.book_database.current_book_id
+                self.share_book_details_from_database_(message)
+            else:
+                self.bot.send_message(message.chat.id, "Sorry !! I cannot look up new books right now. "
+                                                       "Please try again in a few minutes.")
         else:
             # Inform user if book details not found
             self.bot.send_message(message.chat.id,
                                   "Sorry !! I could not found the book you were searching for. Please check the details again.")
 
+    @property
+    def shown_api_result_index(self) -> int:
+        """
+        Index of the API search result BookBot currently holds.
+        """
+        return max(self.book_bot.api_search_result_count - 1, 0)
+
+    def remember_search(self, chat_id: int) -> int | None:
+        """
+        Stores the chat's Books API search with the flow state and the record being shown, so buttons created for it
+        can be resolved from its id alone.
+
+        Args:
+            chat_id (int): The chat being handled.
+
+        Returns:
+            int | None: The search id, or None if the chat has no search.
+        """
+        context = active_chat()
+        data = context.as_dict()
+        if context.api_search_result is not None:
+            data["api_search_result"] = context.api_search_result
+        else:
+            # Resumed conversation steps only carry the id of their search
+            stored = context.search_id is not None and self.conversation_store.get_search(chat_id, context.search_id)
+            if not stored:
+                return None
+            data["api_search_result"] = stored["api_search_result"]
+        context.search_id = self.conversation_store.save_search(chat_id, data, context.search_id)
+        return context.search_id
+
+    def restore_search_for_button(self, chat_id: int, payload: CallbackPayload) -> bool:
+        """
+        Makes the search a clicked button was created for, with the flow state it was made in, the chat's state.
+
+        Args:
+            chat_id (int): The chat the button was clicked in.
+            payload (CallbackPayload): The decoded callback data of the click.
+
+        Returns:
+            bool: False if the search is unknown or expired.
+        """
+        data = payload.search_id is not None and self.conversation_store.get_search(chat_id, payload.search_id)
+        if not data:
+            return False
+        context = ChatContext.from_dict(chat_id, data)
+        context.search_id = payload.search_id
+        self.chat_contexts.restore(context)
+        return True
+
+    def load_api_result_for_button(self, chat_id: int, payload: CallbackPayload) -> bool:
+        """
+        Makes BookBot hold the API result the clicked button was created for, resolved from the button's search id
+        and cursor only, so the click can be handled whatever the chat did in between and by any process.
+
+        Args:
+            chat_id (int): The chat the button was clicked in.
+            payload (CallbackPayload): The decoded callback data of the click.
+
+        Returns:
+            bool: True if the result is available.
+        """
+        if not self.restore_search_for_button(chat_id, payload):
+            return False
+        # The stored record may have been edited (pages, genre, language) after it was shown; keep it then
+        if payload.cursor is None or (self.book_bot.book and self.shown_api_result_index == payload.cursor):
+            return self.book_bot.book is not None
+        return self.book_bot.get_book_details_from_api(self.current_book_title, self.current_book_author,
+                                                       payload.cursor)
+
+    @staticmethod
+    def format_book_caption(book: BookRecord) -> str:
+        """
+        The short caption of a search result: title and author.
+        """
+        return f"Title : {book.title}\nAuthor : {book.author}"
+
+    @staticmethod
+    def format_book_details(book: BookRecord) -> str:
+        """
+        The full details of a book, shown for confirmation and when it is found in the database.
+        """
+        return f"Title : {book.title}\n" \
+               f"Author : {book.author}\n" \
+               f"Genre : {book.genre or 'Unknown'}\n" \
+               f"Language : {book.language or 'Unknown'}\n" \
+               f"Total Pages : {book.total_pages}\n" \
+               f"ISBN13 : {book.isbn13}\n\n"
+
     def share_book_details_from_api_in_chat(self, message: telebot.types.Message):
         """
         Shares the fetched book from API details to the Telegram chat. Reply Markup gives the user option to confirm the
@@ -260,14 +552,15 @@ class ChatBot:
         Args:
             message: The Telegram message object.
         """
+        book = self.book_bot.book
+        markup = self.telegram_bot.new_book_markup(self.shown_api_result_index, self.remember_search(message.chat.id))
         # Check if book cover is available
-        if self.book_bot.book_cover:
-            self.bot.send_photo(message.chat.id, self.book_bot.book_cover, caption=self.book_bot.book_caption,
-                                reply_markup=self.telegram_bot.new_book_markup)
+        if book.cover_url:
+            self.bot.send_photo(message.chat.id, book.cover_url, caption=self.format_book_caption(book),
+                                reply_markup=markup)
         else:
             # Send message without cover image if not available
-            self.bot.send_message(message.chat.id, self.book_bot.book_caption,
-                                  reply_markup=self.telegram_bot.new_book_markup)
+            self.bot.send_message(message.chat.id, self.format_book_caption(book), reply_markup=markup)
 
     def share_book_details_from_database_(self, message: telebot.types.Message):
         """
@@ -276,10 +569,11 @@ class ChatBot:
         Args:
             message: The Telegram message object.
         """
-        if self.book_bot.book_cover:
-            self.bot.send_photo(message.chat.id, self.book_bot.book_cover, caption=self.book_bot.complete_book_details)
+        book = self.book_bot.book
+        if book.cover_url:
+            self.bot.send_photo(message.chat.id, book.cover_url, caption=self.format_book_details(book))
         else:
-            self.bot.send_message(message.chat.id, self.book_bot.complete_book_details)
+            self.bot.send_message(message.chat.id, self.format_book_details(book))
         self.insert_book_status(message)
 
     def share_book_info_for_approval_and_edit(self, message: telebot.types.Message):
@@ -289,8 +583,15 @@ class ChatBot:
         Args:
             message: The Telegram message object.
         """
-        self.bot.send_photo(message.chat.id, self.book_bot.book_cover, caption=self.book_bot.complete_book_details,
-                            reply_markup=self.telegram_bot.confirm_book_markup)
+        # Stored with the search, so the buttons find the record with the user's changes
+        search_id = self.remember_search(message.chat.id)
+        book = self.book_bot.book
+        caption = self.format_book_details(book)
+        if self.book_bot.book_api.job_queue is not None and not (book.genre and book.language):
+            # Looked up on Wikipedia by the enrich_book job once the book is saved, see BookApi
+            caption += "I will look up the unknown genre or language after you save the book, or you can set them now."
+        self.bot.send_photo(message.chat.id, book.cover_url, caption=caption,
+                            reply_markup=self.telegram_bot.confirm_book_markup(self.shown_api_result_index, search_id))
 
     def check_total_pages_count(self, message: telebot.types.Message):
         """
@@ -300,7 +601,7 @@ class ChatBot:
             message: The Telegram message object.
         """
         self.bot.send_message(message.chat.id, "I couldn't get total number of pages. Can you please enter that.")
-        self.bot.register_next_step_handler(message, self.enter_total_pages_if_empty)
+        self.register_next_step(message, self.enter_total_pages_if_empty)
 
     def enter_total_pages_if_empty(self, message: telebot.types.Message):
         """
@@ -310,7 +611,7 @@ class ChatBot:
             message: The Telegram message object containing the user-provided page count.
         """
         if message.text.isdigit() and int(message.text) > 0:
-            self.book_bot.book_total_page_count = message.text
+            self.book_bot.book = self.book_bot.book.replace(total_pages=int(message.text))
             self.share_book_info_for_approval_and_edit(message)
         else:
             self.check_total_pages_count(message)
@@ -323,7 +624,7 @@ class ChatBot:
             message: The Telegram message object containing the new genre.
         """
         new_genre = message.text
-        setattr(self.book_bot, "book_genre", new_genre)
+        self.book_bot.book = self.book_bot.book.replace(genre=new_genre)
         self.share_book_info_for_approval_and_edit(message)
 
     def change_book_language(self, message: telebot.types.Message) -> None:
@@ -335,7 +636,7 @@ class ChatBot:
         """
 
         new_language = message.text
-        setattr(self.book_bot, "book_language", new_language)
+        self.book_bot.book = self.book_bot.book.replace(language=new_language)
         self.share_book_info_for_approval_and_edit(message)
 
     # DATABASE RELATED FUNCTIONS
@@ -451,7 +752,7 @@ class ChatBot:
         else:
             self.bot.send_message(message.chat.id, f"How Many pages have you read?")
         # - Registers a handler to capture the user's response and update the number of pages read accordingly.
-        self.bot.register_next_step_handler(message, self.update_pages_read)
+        self.register_next_step(message, self.update_pages_read)
 
     def update_pages_read(self, message: telebot.types.Message) -> None:
         """
@@ -477,6 +778,8 @@ class ChatBot:
             # - Determines if the user has finished reading the book based on the updated page count.
             if total_pages_read + pages_read_today >= total_pages:
                 self.current_book_status = COMPLETED
+                # A finished book needs no more nudges
+                self.book_database.stop_reading_reminders(self.current_user_id, self.current_book_title)
                 self.insert_book_status(message)
             else:
                 # **Update Pages Read in Database:**
@@ -498,7 +801,7 @@ class ChatBot:
             # **Request Valid Input:**
             # - Prompts the user to enter a valid number of pages if the initial input was invalid.
             self.bot.send_message(message.chat.id, "Please enter number of pages read:")
-            self.bot.register_next_step_handler(message, self.update_pages_read)
+            self.register_next_step(message, self.update_pages_read)
 
     def process_completed_books(self, message: telebot.types.Message) -> None:
         """
@@ -521,7 +824,7 @@ class ChatBot:
                               f"Congratulations on finishing {self.current_book_title}. Please give it a rating "
                               f"from 1-5 (5 being the highest)")
         # - Registers a handler to capture the user's rating and store it in the database.
-        self.bot.register_next_step_handler(message, self.insert_book_rating)
+        self.register_next_step(message, self.insert_book_rating)
 
     def insert_book_rating(self, message: telebot.types.Message) -> None:
         """
@@ -549,11 +852,11 @@ class ChatBot:
             else:
                 # **Request Valid Rating:**
                 self.bot.send_message(message.chat.id, "Please give a rating between 1-5")
-                self.bot.register_next_step_handler(message, self.insert_book_rating)
+                self.register_next_step(message, self.insert_book_rating)
         else:
             # **Request Valid Input:**
             self.bot.send_message(message.chat.id, "Please give a rating between 1-5")
-            self.bot.register_next_step_handler(message, self.insert_book_rating)
+            self.register_next_step(message, self.insert_book_rating)
 
     def process_wishlisted_books(self, message: telebot.types.Message) -> None:
         """
@@ -584,10 +887,73 @@ class ChatBot:
         """
         total_minutes_left = self.book_database.retrieve_reading_time_left(self.current_user_id,
                                                                            self.current_book_title)
-        hours = int(total_minutes_left / 60)
-        minutes = int(total_minutes_left % 60)
+        return self.format_reading_time(total_minutes_left)
+
+    @staticmethod
+    def format_reading_time(total_minutes: float) -> str:
+        """
+        Formats a reading time in minutes as hours and minutes.
+        """
+        hours = int(total_minutes / 60)
+        minutes = int(total_minutes % 60)
         return f"{hours} hours and {minutes} minutes"
 
+    def log_reading_progress(self, message: telebot.types.Message) -> None:
+        """
+        Applies a progress log naming one or more books, e.g. "read 20 pages of Dune and 35 of Emma" or
+        "/log Dune 20, Emma 35", and answers with the progress of every book in a single message.
+
+        All titles are matched against the user's books with one query, and every page count, reading time left
+        and reminder is updated in one transaction.
+
+        Args:
+            message (telebot.types.Message): The message holding the progress log.
+        """
+        self.current_user_id = message.from_user.id
+        entries, unparsed = self.book_bot.parse_progress_log(message.text or "")
+        if not entries:
+            self.bot.send_message(message.chat.id, "Please tell me the pages you read per book, e.g.\n"
+                                                   "Dune 20, Emma 35")
+            self.register_next_step(message, self.log_reading_progress)
+            return
+
+        user_books = self.book_database.retrieve_user_books(self.current_user_id)
+        progress, unmatched = self.book_bot.match_user_books(entries, user_books)
+        lines = []
+        if progress:
+            results = self.book_database.apply_reading_progress(self.current_user_id, progress)
+            if not results:
+                self.bot.send_message(message.chat.id, "Sorry There was an error. Please Try Again")
+                return
+            for result in results:
+                if result["finished"]:
+                    lines.append(f"{result['title'].title()}: finished! Congratulations!")
+                else:
+                    lines.append(f"{result['title'].title()}: {result['pages_read']} of {result['total_pages']} "
+                                 f"pages, {self.format_reading_time(result['time_left'])} left")
+        if unmatched:
+            lines.append(f"I could not find {', '.join(title.title() for title in unmatched)} among your books. "
+                         f"Add it with /readingabook first.")
+        if unparsed:
+            lines.append(f"I did not understand: {'; '.join(unparsed)}")
+        self.bot.send_message(message.chat.id, "\n".join(lines))
+
+    def answer_title_search(self, query: telebot.types.InlineQuery) -> None:
+        """
+        Answers an inline query (``@bot dun``) with stored books whose title or author matches what was typed.
+        Choosing a suggestion sends its exact title, so it can answer "Please Enter Name of The Book".
+
+        Args:
+            query (telebot.types.InlineQuery): The inline query.
+        """
+        results = [telebot.types.InlineQueryResultArticle(
+            id=str(book["book_id"]),
+            title=book["title"].title(),
+            description=f"{book['author'].title()} · {book['readers']} reader{'s' if book['readers'] != 1 else ''}",
+            input_message_content=telebot.types.InputTextMessageContent(book["title"].title()))
+            for book in self.book_database.title_index.search(query.query)]
+        self.bot.answer_inline_query(query.id, results, cache_time=INLINE_CACHE_SECONDS)
+
     def find_recommendation(self, message: telebot.types.Message) -> None:
         """
         Retrieves book recommendations based on the user's input, handles potential errors, and provides feedback.
@@ -604,19 +970,83 @@ class ChatBot:
 
         # **Capture Book Title and Retrieve Recommendations:**
         self.current_book_title = message.text
-        recommended_books_list = self.book_bot.get_book_recommendations(self.current_book_title)
+        # Scraped by a background job, which sends them with deliver_recommendations
+        if self.book_bot.enqueue_recommendations(message.chat.id, self.current_book_title) is None:
+            self.deliver_recommendations(message.chat.id,
+                                         self.book_bot.get_book_recommendations(self.current_book_title))
+
+        # **Reset Book Information for Subsequent Interactions:**
+        self.reset_book_name_and_search_count()
+
+    def deliver_recommendations(self, chat_id: int, recommended_books_list: str | None) -> None:
+        """
+        Sends the result of a recommendations lookup to the chat.
 
+        Args:
+            chat_id (int): The chat that asked.
+            recommended_books_list (str | None): The formatted recommendations; empty or None if the lookup failed.
+        """
         # **Handle Successful Recommendation Retrieval:**
         if recommended_books_list:
             # Present the recommendations to the user
-            self.bot.send_message(message.chat.id, recommended_books_list)
+            self.bot.send_message(chat_id, recommended_books_list)
         else:
             # Handle error gracefully and prompt for retry
+            self.bot.send_message(chat_id, "There was an error. Please try again")
 
-            self.bot.send_message(message.chat.id, "There was an error. Please try again")
+    def deliver_enrichment(self, chat_id: int, result: dict | None) -> None:
+        """
+        Tells the chat which genre and language were found for a book it saved without them.
 
-        # **Reset Book Information for Subsequent Interactions:**
-        self.reset_book_name_and_search_count()
+        Args:
+            chat_id (int): The chat that saved the book.
+            result (dict | None): The ``enrich_book`` job result; nothing is sent if nothing was found.
+        """
+        if not result or not (result["book_genre"] or result["book_language"]):
+            return
+        details = [f"{label} : {result[key]}" for label, key in (("Genre", "book_genre"), ("Language", "book_language"))
+                   if result[key]]
+        self.bot.send_message(chat_id, f"I found more details for {result['book_title'].title()}:\n"
+                                       + "\n".join(details))
+
+    def send_reading_reminder(self, telegram_id: int, book_title: str) -> None:
+        """
+        Nudges a user who has not logged progress on a book they are reading for longer than usual.
+
+        Args:
+            telegram_id (int): The user, whose private chat has the same id.
+            book_title (str): The book they are reading.
+        """
+        try:
+            self.bot.send_message(telegram_id, f"How is {book_title.title()} going? "
+                                               f"Send /readingabook to log the pages you have read.")
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 403:
+                # The user blocked the bot; stop reminding them about anything
+                self.book_database.stop_reading_reminders(telegram_id)
+            raise
+
+    def start_reminders(self, per_second: float = REMINDERS_PER_SECOND) -> ReminderScheduler:
+        """
+        Starts sending reading reminders in the background.
+
+        Args:
+            per_second (float): This process's share of the reminder rate limit.
+        """
+        scheduler = ReminderScheduler(self.book_database.reminders, self.send_reading_reminder, per_second=per_second)
+        scheduler.start()
+        return scheduler
+
+    def register_jobs(self) -> None:
+        """
+        Registers the background job kinds this bot enqueues, so its job workers can run them.
+        """
+        self.job_queue.register("recommendations", self.book_bot.run_recommendations_job,
+                                deliver=self.deliver_recommendations)
+        self.job_queue.register("enrich_book", self.book_bot.run_enrichment_job, deliver=self.deliver_enrichment)
+        self.job_queue.register(BACKUP_JOB, self.database_backup.run_job)
+        # Every process asks for the next backup; the job's dedup key leaves one of them to take it
+        self.database_backup.schedule()
 
     def chat(self):
         """
@@ -629,8 +1059,46 @@ class ChatBot:
             None
         """
 
+        # Queue-based JSON logging, see MYSCRIBE_LOG_LEVEL and MYSCRIBE_LOG_SAMPLING
+        configure_logging()
+        self.register_handlers()
+        self.book_database.load_title_index(background=True)
+        # Stored reading estimates are refreshed if a release changed the constants they are computed with
+        self.book_database.recompute_time_left_if_stale(background=True)
+        # Handlers are run by the scheduler's workers; telebot's own thread pool would bypass its lanes
+        self.bot.threaded = False
+        self.scheduler.start()
+        self.register_jobs()
+        self.job_queue.start()
+        self.start_reminders()
+        # Incremental vacuum, ANALYZE and WAL checkpoints while the database is quiet
+        DatabaseMaintenance().start()
+
+        # Serve handler and dependency metrics locally if MYSCRIBE_METRICS_PORT is set
+        start_metrics_server()
+        # SIGUSR1 starts a profiling session without going through Telegram
+        PROFILER.install_signal_handler()
+        self.bot.infinity_polling()
+
+    def register_handlers(self) -> None:
+        """
+        Registers all message and callback handlers on the bot without starting to poll, so updates can also be fed
+        in by a sharding worker (see sharding.py).
+        """
+        # Redelivered updates are dropped before any handler sees them
+        self.bot.process_new_updates = self.book_database.update_ledger.filter_updates(self.bot.process_new_updates)
+
+        # Must be registered first: a chat waiting in a flow gets its next message routed back into that flow
+        @self.bot.message_handler(func=lambda message: self.conversation_store.has_pending(message.chat.id))
+        def pending_conversation_step(message: telebot.types.Message) -> None:
+            """
+            Hands the message to the step its chat is waiting in.
+            """
+            self.continue_conversation(message)
+
         @self.bot.message_handler(commands=["start"])
         @self.bot.message_handler(regexp=self.books_chat_patterns["greetings"])
+        @self.instrument_handler("command_start")
         def command_start(message: telebot.types.Message) -> None:
             """
             Handles the `/start` command and related greeting messages.
@@ -644,7 +1112,21 @@ class ChatBot:
             self.save_username_and_id_db(message)
             self.send_greeting_message(message)
 
+        @self.bot.message_handler(commands=["log"])
+        # Before the book status patterns: "read 20 pages of Dune" would also look like a finished book
+        @self.bot.message_handler(regexp=self.books_chat_patterns["reading_progress"])
+        @self.instrument_handler("log_reading_progress")
+        def command_log(message: telebot.types.Message) -> None:
+            """
+            Handles the "/log" command and progress sentences naming one or more books.
+
+            Args:
+                message (telebot.types.Message): Incoming Telegram message object.
+            """
+            self.log_reading_progress(message)
+
         @self.bot.message_handler(commands=["calculate_reading_speed"])
+        @self.instrument_handler("command_calc_reading_speed")
         def command_calc_reading_speed(message: telebot.types.Message) -> None:
             """
             Initiates the reading speed calculation process.
@@ -663,16 +1145,28 @@ class ChatBot:
             self.bot.send_message(message.chat.id,
                                   "Please read the following paragraph and click on Done when you have finished reading.")
 
-            # Wait for 5 seconds to allow user to read instructions
-            time.sleep(5)
-
-            self.calc_reading_speed_start_time = time.time()
-            # Send reading speed paragraph and attach Done Reading button
-            self.bot.send_message(message.chat.id, self.large_texts.reading_speed_paragraph,
-                                  reply_markup=self.telegram_bot.done_reading_button)
-
-        @self.bot.callback_query_handler(lambda query: query.data in ["reading_done"])
-        def callback_calc_reading_speed(query: telebot.types.CallbackQuery) -> None:
+            def send_paragraph() -> None:
+                # The start time travels with the Done button, so the click can be handled anywhere
+                reading_started_at = int(time.time())
+                try:
+                    # Send reading speed paragraph and attach Done Reading button
+                    self.bot.send_message(message.chat.id, self.large_texts.reading_speed_paragraph,
+                                          reply_markup=self.telegram_bot.done_reading_button(reading_started_at))
+                except telebot.apihelper.ApiTelegramException as e:
+                    log_event(logger, logging.ERROR, "reading_speed_paragraph_failed", chat_id=message.chat.id,
+                              error=str(e))
+
+            # Give the user 5 seconds to read the instructions, without holding a scheduler worker meanwhile
+            timer = threading.Timer(READING_SPEED_INSTRUCTIONS_SECONDS, send_paragraph)
+            timer.daemon = True
+            timer.start()
+
+        # Inline keyboard clicks are routed by the action encoded in their callback data
+        callback_router = CallbackRouter()
+
+        @callback_router.route("reading_done")
+        @self.instrument_handler("callback_calc_reading_speed")
+        def callback_calc_reading_speed(query: telebot.types.CallbackQuery, payload: CallbackPayload) -> None:
             """
             Calculates and updates the user's reading speed based on the "Done Reading" button click.
 
@@ -682,12 +1176,14 @@ class ChatBot:
 
             Args:
                 query (telebot.types.CallbackQuery): Incoming Telegram callback query object.
+                payload (CallbackPayload): Decoded callback data carrying the test's start time.
 
             Returns:
                 None
             """
             self.current_user_id = query.from_user.id
-            # Record the end time of the reading speed test
+            # Record the start and end time of the reading speed test
+            self.calc_reading_speed_start_time = payload.cursor
             self.calc_reading_speed_end_time = time.time()
 
             # Get the user's Telegram ID from the callback query
@@ -707,6 +1203,7 @@ class ChatBot:
                                       "Sorry! Your reading speed could not be updated. Please Try Again")
 
         @self.bot.message_handler(regexp=self.books_chat_patterns["reading_a_book"])
+        @self.instrument_handler("regex_reading_a_book")
         def regex_reading_a_book(message: telebot.types.Message) -> None:
             """
             Handles messages that indicate the user is reading a book.
@@ -730,6 +1227,7 @@ class ChatBot:
 
         #
         @self.bot.message_handler(regexp=self.books_chat_patterns["book_finished"])
+        @self.instrument_handler("regex_finished_a_book")
         def regex_finished_a_book(message: telebot.types.Message) -> None:
             self.current_book_status = COMPLETED
             # Extract book title from message text
@@ -742,6 +1240,7 @@ class ChatBot:
         #     self.current_book_status = WISHLIST
 
         @self.bot.message_handler(regexp=self.books_chat_patterns["book_wishlist"])
+        @self.instrument_handler("regex_wishlist_a_book")
         def regex_finished_a_book(message: telebot.types.Message) -> None:
             self.current_book_status = WISHLIST
             # Extract book title from message text
@@ -754,6 +1253,7 @@ class ChatBot:
         #     self.current_book_status = WISHLIST
 
         @self.bot.message_handler(commands=["readingabook"])
+        @self.instrument_handler("command_readingabook")
         def command_reading_a_book(message: telebot.types.Message) -> None:
             """
             Handles the "/readingabook" command and prompts the user for the book title.
@@ -770,6 +1270,7 @@ class ChatBot:
             self.extract_book_title_from_regex(message)
 
         @self.bot.message_handler(commands=["finishedabook"])
+        @self.instrument_handler("command_finishedabook")
         def command_reading_a_book(message: telebot.types.Message) -> None:
             """
             Handles the "/finishedabook" command and prompts the user for the book title.
@@ -786,6 +1287,7 @@ class ChatBot:
             self.extract_book_title_from_regex(message)
 
         @self.bot.message_handler(commands=["wishlistabook"])
+        @self.instrument_handler("command_wishlistabook")
         def command_reading_a_book(message: telebot.types.Message) -> None:
             """
             Handles the "/wishlistabook" command and prompts the user for the book title.
@@ -801,51 +1303,71 @@ class ChatBot:
             self.process_book_info_directly = True
             self.extract_book_title_from_regex(message)
 
-        @self.bot.callback_query_handler(lambda query: query.data in ["confirm_book_details", "get_next_book_details"])
-        def new_books_handler(query):
+        @callback_router.route("confirm_book_details", "get_next_book_details")
+        @self.instrument_handler("new_books_handler")
+        def new_books_handler(query, payload: CallbackPayload):
             """
             Handles user interactions with the "confirm_book_details" and "get_next_book_details" buttons in the Telegram chat.
 
             Args:
                 query: The Telegram callback query object.
+                payload (CallbackPayload): Decoded callback data carrying the search and the index of the shown result.
             """
             # Delete previous message containing book details
-            self.current_user_id = query.from_user.id
             self.bot.delete_message(query.message.chat.id, query.message.id)
 
             # Handle confirmation button
-            if query.data == "confirm_book_details":
+            if payload.action == "confirm_book_details":
+                if not self.load_api_result_for_button(query.message.chat.id, payload):
+                    self.bot.send_message(query.message.chat.id, "Sorry !! That result is no longer available. "
+                                                                 "Please search for the book again.")
                 # Prompt for total pages if not available
-                if self.book_bot.book_total_page_count is None or self.book_bot.book_total_page_count == 0:
+                elif not self.book_bot.book.total_pages:
                     self.check_total_pages_count(query.message)
                 else:
                     # Confirm and edit book details if total pages available
                     self.share_book_info_for_approval_and_edit(query.message)
-            elif query.data == "get_next_book_details":
+                ACCEPTED_RESULTS.inc(position=str(self.shown_api_result_index))
+            elif payload.action == "get_next_book_details":
                 # Handle get next book button
-                self.retrieve_book_data_using_api(query.message, self.current_book_title, self.current_book_author)
-
-        @self.bot.callback_query_handler(
-            lambda query: query.data in ["change_genre", "change_language", "no_change_req"])
-        def confirm_and_insert_new_book(query):
+                NEXT_CLICKS.inc()
+                if not self.restore_search_for_button(query.message.chat.id, payload):
+                    self.bot.send_message(query.message.chat.id, "Sorry !! That search is no longer available. "
+                                                                 "Please search for the book again.")
+                    return
+                next_index = None if payload.cursor is None else payload.cursor + 1
+                self.retrieve_book_data_using_api(query.message, self.current_book_title, self.current_book_author,
+                                                  next_index)
+
+        @callback_router.route("change_genre", "change_language", "no_change_req")
+        @self.instrument_handler("confirm_and_insert_new_book")
+        def confirm_and_insert_new_book(query, payload: CallbackPayload):
             """
             Processes callback queries related to confirming and inserting new book details,
             handling genre and language modifications if requested.
 
             Args:
                 query (telebot.types.CallbackQuery): The callback query object containing user's selection.
+                payload (CallbackPayload): Decoded callback data carrying the search and the index of the reviewed
+                    result.
 
             Returns:
                 None
             """
 
-            # Identify User and Remove Inline Keyboard:
-            self.current_user_id = query.from_user.id
+            # Remove Inline Keyboard; the user and the book come with the button's search
             self.bot.edit_message_reply_markup(query.message.chat.id, query.message.id, reply_markup=[])
+            if not self.load_api_result_for_button(query.message.chat.id, payload):
+                self.bot.send_message(query.message.chat.id, "Sorry !! That result is no longer available. "
+                                                             "Please search for the book again.")
             # Handle "No Change Required" Scenario:
-            if query.data == "no_change_req":
-                self.current_book_title = self.book_bot.book_title
-                if self.book_database.insert_book_details(self.book_bot):
+            elif payload.action == "no_change_req":
+                typed_title = self.current_book_title
+                self.current_book_title = self.book_bot.book.title
+                # Remember how the user typed the title, so the next time it is found without the Books API
+                if self.book_database.insert_book_details(self.book_bot.book, aliases=(typed_title,)):
+                    # Look up a missing genre or language in the background
+                    self.book_bot.enqueue_enrichment(query.message.chat.id)
                     # Successfully inserted, proceed to book status handling
                     self.insert_book_status(query.message)
                 else:
@@ -854,15 +1376,18 @@ class ChatBot:
                                           "I am sorry!\nThere was an error while saving book details. Please Try Again.")
 
             # Handle Genre Change Request:
-            elif query.data == "change_genre":
+            elif payload.action == "change_genre":
                 self.bot.send_message(query.message.chat.id, "Please enter genre.")
-                self.bot.register_next_step_handler(query.message, self.change_book_genre)
+                self.register_next_step(query.message, self.change_book_genre)
 
             # Handle Language Change Request:
-            elif query.data == "change_language":
-                self.bot.register_next_step_handler(query.message, self.change_book_language)
+            elif payload.action == "change_language":
+                self.register_next_step(query.message, self.change_book_language)
+
+        self.bot.callback_query_handler(func=callback_router.matches)(callback_router.dispatch)
 
         @self.bot.message_handler(commands=["recommendabook"])
+        @self.instrument_handler("command_recommend_a_book")
         def command_recommend_a_book(message):
             """
             Initiates the book recommendation process by prompting the user for a book title and registering a handler for their response.
@@ -878,10 +1403,32 @@ class ChatBot:
             self.bot.send_message(message.chat.id,
                                   "Hi !! I can recommend you similar books. Please enter a book's name for recommendation : ")
             # Prepare for Recommendation Retrieval:
-            self.bot.register_next_step_handler(message, self.find_recommendation)
+            self.register_next_step(message, self.find_recommendation)
+
+        @self.bot.message_handler(commands=["profile"])
+        def command_profile(message: telebot.types.Message) -> None:
+            """
+            Handles the admin-only "/profile" command.
+            """
+            self.start_profiling(message)
+
+        @self.bot.message_handler(commands=["recompute_time_left"])
+        def command_recompute_time_left(message: telebot.types.Message) -> None:
+            """
+            Handles the admin-only "/recompute_time_left" command.
+            """
+            self.recompute_reading_estimates(message)
+
+        @self.bot.inline_handler(func=lambda query: True)
+        @self.instrument_handler("inline_title_search", track_update=False)
+        def inline_title_search(query: telebot.types.InlineQuery) -> None:
+            """
+            Handles inline queries with title autocomplete.
+            """
+            self.answer_title_search(query)
 
-        self.bot.infinity_polling()
 
+if __name__ == "__main__":
+    from application import Application
 
-chatbot = ChatBot()
-chatbot.chat()
\ No newline at end of file
+    Application().chatbot.chat()
\ No newline at end of file
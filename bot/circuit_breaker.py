@@ -0,0 +1,138 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Timeout in seconds for every request to an upstream book service
+UPSTREAM_TIMEOUT = float(os.getenv("MYSCRIBE_UPSTREAM_TIMEOUT", 5))
+# Consecutive failures that open a circuit
+FAILURE_THRESHOLD = int(os.getenv("MYSCRIBE_CIRCUIT_FAILURES", 5))
+# Seconds an open circuit waits before letting one probe request through
+RESET_TIMEOUT_SECONDS = float(os.getenv("MYSCRIBE_CIRCUIT_RESET_SECONDS", 30))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = REGISTRY.gauge("myscribe_circuit_state",
+                               "Circuit breaker state per upstream: 0 closed, 1 half-open, 2 open.", ("upstream",))
+CIRCUIT_REJECTED = REGISTRY.counter("myscribe_circuit_rejected_total",
+                                    "Upstream calls refused because the circuit was open.", ("upstream",))
+
+
+class UpstreamUnavailable(Exception):
+    """
+    An upstream book service failed, timed out or is cut off by its circuit breaker.
+    """
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """
+    The call was refused without being made because the upstream's circuit is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and calls fail fast with CircuitOpen. Once
+    ``reset_timeout`` seconds have passed it is half-open: a single probe call goes through, and its outcome closes
+    the circuit again or re-opens it for another ``reset_timeout``.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT_SECONDS):
+        """
+        Args:
+            name (str): The upstream, used in metrics and logs.
+            failure_threshold (int): Consecutive failures that open the circuit.
+            reset_timeout (float): Seconds before an open circuit lets a probe through.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        CIRCUIT_STATE.set(0, upstream=name)
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            log_event(logger, logging.WARNING if state == OPEN else logging.INFO, "circuit_state_changed",
+                      upstream=self.name, previous=self.state, state=state)
+        self.state = state
+        CIRCUIT_STATE.set(_STATE_VALUES[state], upstream=self.name)
+
+    def allow(self) -> bool:
+        """
+        Tells whether a call may be made now. In the half-open state only the first caller gets to probe.
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.probe_in_flight = False
+            self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    @contextlib.contextmanager
+    def guard(self):
+        """
+        Context manager around one upstream call.
+
+        Raises:
+            CircuitOpen: If the circuit is open; the body does not run.
+            UpstreamUnavailable: If the body raised; the original exception is chained.
+        """
+        if not self.allow():
+            CIRCUIT_REJECTED.inc(upstream=self.name)
+            raise CircuitOpen(self.name)
+        try:
+            yield
+        except Exception as e:
+            self.record_failure()
+            raise UpstreamUnavailable(f"{self.name}: {e!r}") from e
+        self.record_success()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(upstream: str) -> CircuitBreaker:
+    """
+    Returns the process-wide breaker of an upstream, e.g. ``circuit_breaker("google_books")``.
+    """
+    breaker = _breakers.get(upstream)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(upstream)
+            if breaker is None:
+                breaker = _breakers[upstream] = CircuitBreaker(upstream)
+    return breaker
@@ -0,0 +1,228 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import InstrumentedConnection
+
+load_dotenv()
+
+CONVERSATION_TTL_SECONDS = int(os.getenv("MYSCRIBE_CONVERSATION_TTL", 30 * 60))
+MAX_CONVERSATIONS = int(os.getenv("MYSCRIBE_MAX_CONVERSATIONS", 10_000))
+# How many saves happen between two clean-ups of expired and excess conversations
+PRUNE_EVERY = 100
+
+# The ChatBot methods a conversation can be waiting in, i.e. the states of the multi-step flows:
+# title -> author -> (total pages) -> confirm (genre / language) -> pages read or rating, and recommendations.
+CONVERSATION_STEPS = frozenset({
+    "get_book_title_from_message",
+    "get_author_name",
+    "enter_total_pages_if_empty",
+    "change_book_genre",
+    "change_book_language",
+    "update_pages_read",
+    "insert_book_rating",
+    "find_recommendation",
+    "log_reading_progress",
+})
+
+
+class Conversation:
+    """
+    A chat that is waiting for the user's next message.
+
+    Attributes:
+        chat_id (int): The Telegram chat.
+        step (str): The ChatBot method that handles the next message, one of CONVERSATION_STEPS.
+        data (dict): JSON-serialisable flow state (current book, status, ...) needed to resume the flow.
+        expires_at (float): Unix time after which the conversation is abandoned.
+        updated_at (float): Unix time of the save, which tells this conversation apart from a later one of the chat.
+    """
+
+    __slots__ = ("chat_id", "step", "data", "expires_at", "updated_at")
+
+    def __init__(self, chat_id: int, step: str, data: dict, expires_at: float, updated_at: float):
+        self.chat_id = chat_id
+        self.step = step
+        self.data = data
+        self.expires_at = expires_at
+        self.updated_at = updated_at
+
+
+class ConversationStore:
+    """
+    Persists the next-step state of every chat in SQLite so any bot process can resume a flow, even after a restart.
+
+    Conversations expire after a TTL and the number of live conversations is capped; the least recently updated ones
+    are dropped first.
+
+    The Books API searches whose results a chat is browsing are stored here too, under a short id that the inline
+    buttons carry (see callback_data.py): the search and the record the user edits do not fit in Telegram's 64 bytes
+    of callback data. A click is resolved from that id alone, by whichever process receives it.
+    Searches expire and are capped like conversations.
+    """
+
+    def __init__(self, database_path: str | None = None, ttl_seconds: int = CONVERSATION_TTL_SECONDS,
+                 max_conversations: int = MAX_CONVERSATIONS):
+        """
+        Args:
+            database_path (str | None): SQLite file, MYSCRIBE_DATABASE by default.
+            ttl_seconds (int): Seconds of inactivity after which a conversation is abandoned.
+            max_conversations (int): Maximum number of live conversations kept.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_conversations = max_conversations
+        self.conn = sqlite3.connect(database_path or os.getenv("MYSCRIBE_DATABASE"), check_same_thread=False,
+                                    factory=InstrumentedConnection)
+        self.lock = threading.Lock()
+        self.saves_since_prune = 0
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS conversations ("
+                              "chat_id INTEGER PRIMARY KEY, "
+                              "step TEXT NOT NULL, "
+                              "data TEXT NOT NULL, "
+                              "updated_at REAL NOT NULL, "
+                              "expires_at REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS conversations_expires_at ON conversations (expires_at)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS book_searches ("
+                              "search_id INTEGER PRIMARY KEY, "
+                              "chat_id INTEGER NOT NULL, "
+                              "data TEXT NOT NULL, "
+                              "expires_at REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS book_searches_expires_at ON book_searches (expires_at)")
+            self.conn.commit()
+
+    def save(self, chat_id: int, step: str, data: dict) -> None:
+        """
+        Stores the step a chat is waiting in, replacing any previous one.
+
+        Args:
+            chat_id (int): The Telegram chat.
+            step (str): The ChatBot method that should handle the chat's next message.
+            data (dict): Flow state needed by that method.
+
+        Raises:
+            ValueError: If ``step`` is not a known conversation step.
+        """
+        if step not in CONVERSATION_STEPS:
+            raise ValueError(f"Unknown conversation step: {step}")
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT INTO conversations (chat_id, step, data, updated_at, expires_at) "
+                              "VALUES (?,?,?,?,?) "
+                              "ON CONFLICT (chat_id) DO UPDATE SET step = excluded.step, data = excluded.data, "
+                              "updated_at = excluded.updated_at, expires_at = excluded.expires_at",
+                              (chat_id, step, json.dumps(data), now, now + self.ttl_seconds))
+            self.conn.commit()
+            self.saves_since_prune += 1
+            prune = self.saves_since_prune >= PRUNE_EVERY
+        if prune:
+            self.prune()
+
+    def has_pending(self, chat_id: int) -> bool:
+        """
+        Tells whether the chat is waiting in a live (not expired) conversation step.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM conversations WHERE chat_id = ? AND expires_at > ?",
+                                    (chat_id, time.time())).fetchone()
+        return row is not None
+
+    def get(self, chat_id: int) -> Conversation | None:
+        """
+        The chat's live conversation. It stays stored until ``finish``, so a step that fails leaves the chat waiting
+        in it.
+
+        Returns:
+            Conversation | None: The conversation, or None if there is none or it expired.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT step, data, expires_at, updated_at FROM conversations "
+                                    "WHERE chat_id = ? AND expires_at > ?", (chat_id, time.time())).fetchone()
+        if not row:
+            return None
+        return Conversation(chat_id, row[0], json.loads(row[1]), row[2], row[3])
+
+    def finish(self, conversation: Conversation) -> bool:
+        """
+        Deletes a conversation whose step has run, unless the chat has been saved in a successor step since.
+
+        Returns:
+            bool: True if it was deleted.
+        """
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM conversations WHERE chat_id = ? AND updated_at = ?",
+                                        (conversation.chat_id, conversation.updated_at)).rowcount
+            self.conn.commit()
+        return bool(deleted)
+
+    def delete(self, chat_id: int) -> None:
+        """
+        Abandons the chat's conversation.
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM conversations WHERE chat_id = ?", (chat_id,))
+            self.conn.commit()
+
+    def save_search(self, chat_id: int, data: dict, search_id: int | None = None) -> int:
+        """
+        Stores a chat's Books API search and the flow state it was made in.
+
+        Args:
+            chat_id (int): The Telegram chat.
+            data (dict): JSON-serialisable search and flow state.
+            search_id (int | None): The search to update; a new one is stored if None.
+
+        Returns:
+            int: The search id.
+        """
+        expires_at = time.time() + self.ttl_seconds
+        with self.lock:
+            updated = search_id is not None and self.conn.execute(
+                "UPDATE book_searches SET data = ?, expires_at = ? WHERE search_id = ? AND chat_id = ?",
+                (json.dumps(data), expires_at, search_id, chat_id)).rowcount
+            if not updated:
+                search_id = self.conn.execute("INSERT INTO book_searches (chat_id, data, expires_at) VALUES (?,?,?)",
+                                              (chat_id, json.dumps(data), expires_at)).lastrowid
+            self.conn.commit()
+            self.saves_since_prune += 1
+            prune = self.saves_since_prune >= PRUNE_EVERY
+        if prune:
+            self.prune()
+        return search_id
+
+    def get_search(self, chat_id: int, search_id: int) -> dict | None:
+        """
+        A live search of the chat stored by ``save_search``.
+
+        Returns:
+            dict | None: Its data, or None if there is no such search for this chat or it expired.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM book_searches WHERE search_id = ? AND chat_id = ? "
+                                    "AND expires_at > ?", (search_id, chat_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def prune(self) -> int:
+        """
+        Deletes expired conversations and searches and, above the cap, the least recently updated ones.
+
+        Returns:
+            int: The number of conversations and searches deleted.
+        """
+        with self.lock:
+            self.saves_since_prune = 0
+            deleted = 0
+            for table, key, order in (("conversations", "chat_id", "updated_at"),
+                                      ("book_searches", "search_id", "expires_at")):
+                deleted += self.conn.execute(f"DELETE FROM {table} WHERE expires_at <= ?", (time.time(),)).rowcount
+                live = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                if live > self.max_conversations:
+                    deleted += self.conn.execute(f"DELETE FROM {table} WHERE {key} IN ("
+                                                 f"SELECT {key} FROM {table} ORDER BY {order} LIMIT ?)",
+                                                 (live - self.max_conversations,)).rowcount
+            self.conn.commit()
+        return deleted
@@ -0,0 +1,224 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Seconds between two maintenance checks
+MAINTENANCE_TICK_SECONDS = float(os.getenv("MYSCRIBE_MAINTENANCE_TICK", 10))
+# The database counts as quiet once no process has committed for this long
+QUIET_SECONDS = float(os.getenv("MYSCRIBE_MAINTENANCE_QUIET", 30))
+# Seconds a maintenance statement waits for the bot's writes to finish before giving up until the next check
+MAINTENANCE_BUSY_TIMEOUT_SECONDS = 0.2
+# Free pages released per incremental vacuum slice, and slices per quiet check
+VACUUM_PAGES_PER_SLICE = int(os.getenv("MYSCRIBE_VACUUM_PAGES", 128))
+VACUUM_SLICES_PER_TICK = int(os.getenv("MYSCRIBE_VACUUM_SLICES", 8))
+# Seconds between two PRAGMA optimize runs, and between two full (but limited) ANALYZE runs
+OPTIMIZE_INTERVAL_SECONDS = float(os.getenv("MYSCRIBE_OPTIMIZE_INTERVAL", 60 * 60))
+ANALYZE_INTERVAL_SECONDS = float(os.getenv("MYSCRIBE_ANALYZE_INTERVAL", 24 * 60 * 60))
+# Rows ANALYZE samples per index, so it stays fast on large tables
+ANALYSIS_LIMIT = int(os.getenv("MYSCRIBE_ANALYSIS_LIMIT", 1000))
+# Switching an existing database to incremental auto_vacuum rewrites it with VACUUM; larger files are left to
+# "python bot/maintenance.py enable-incremental-vacuum"
+AUTO_VACUUM_CONVERT_MAX_BYTES = int(os.getenv("MYSCRIBE_AUTO_VACUUM_CONVERT_MAX_BYTES", 256 * 1024 * 1024))
+
+INCREMENTAL = 2
+
+DATABASE_BYTES = REGISTRY.gauge("myscribe_db_file_bytes", "Size of the database files.", ("file",))
+DATABASE_PAGES = REGISTRY.gauge("myscribe_db_pages", "Pages in the database file, by use.", ("use",))
+CACHE_COVERAGE = REGISTRY.gauge("myscribe_db_cache_coverage_ratio",
+                                "Share of the database's pages a connection's page cache can hold.")
+MAINTENANCE_RUNS = REGISTRY.counter("myscribe_db_maintenance_total", "Database maintenance tasks run.", ("task",))
+MAINTENANCE_DURATION = REGISTRY.histogram("myscribe_db_maintenance_seconds", "Time one maintenance task took.",
+                                          ("task",), buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+PAGES_VACUUMED = REGISTRY.counter("myscribe_db_pages_vacuumed_total", "Free pages returned to the file system.")
+
+
+class DatabaseMaintenance:
+    """
+    Keeps the database file compact and its query plans current, from a background thread.
+
+    Every ``tick`` seconds it exports the file size and page usage. Once no process has committed for ``quiet``
+    seconds (SQLite's ``data_version`` tells commits by other connections apart, whichever process made them), it
+    checkpoints and truncates the WAL, returns free pages to the file system with incremental vacuum in small slices
+    (stopping as soon as someone writes again), and periodically runs ``PRAGMA optimize`` and a sample-limited
+    ``ANALYZE``. A database not yet in incremental auto_vacuum mode is converted in its first quiet period, if it is
+    small enough to be rewritten quickly.
+
+    One process runs it: the bot itself, or the ingress process in sharded mode.
+    """
+
+    def __init__(self, database_path: str | None = None, tick: float = MAINTENANCE_TICK_SECONDS,
+                 quiet: float = QUIET_SECONDS, vacuum_pages: int = VACUUM_PAGES_PER_SLICE,
+                 vacuum_slices: int = VACUUM_SLICES_PER_TICK):
+        """
+        Args:
+            database_path (str | None): SQLite file, MYSCRIBE_DATABASE by default.
+            tick (float): Seconds between two checks.
+            quiet (float): Seconds without commits after which maintenance runs.
+            vacuum_pages (int): Free pages released per incremental vacuum slice.
+            vacuum_slices (int): Slices run per quiet check at most.
+        """
+        self.database_path = database_path or os.getenv("MYSCRIBE_DATABASE")
+        self.tick = tick
+        self.quiet = quiet
+        self.vacuum_pages = vacuum_pages
+        self.vacuum_slices = vacuum_slices
+        # Autocommit: every PRAGMA and VACUUM commits on its own, so no slice holds the write lock for long. A short
+        # busy timeout makes maintenance give way to the bot instead of queueing behind its writes
+        self.conn = sqlite3.connect(self.database_path, check_same_thread=False, isolation_level=None,
+                                    timeout=MAINTENANCE_BUSY_TIMEOUT_SECONDS)
+        self.conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        self.data_version = None
+        self.last_write = time.monotonic()
+        self.optimized_at = time.monotonic()
+        self.analyzed_at = None
+        self.convert_checked = False
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+            self.thread.start()
+
+    def close(self) -> None:
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout=self.tick * 2)
+        self.conn.close()
+
+    def _run(self) -> None:
+        while not self.stopping.wait(self.tick):
+            try:
+                self.run_once()
+            except sqlite3.Error as e:
+                log_event(logger, logging.WARNING, "db_maintenance_failed", error=str(e))
+
+    def written_since_last_check(self) -> bool:
+        """
+        Tells whether another connection committed since the previous call.
+        """
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        written = self.data_version is not None and data_version != self.data_version
+        self.data_version = data_version
+        return written
+
+    def run_once(self, force: bool = False) -> dict:
+        """
+        Reports the file statistics and, if the database is quiet (or ``force``), runs the maintenance tasks due.
+
+        Returns:
+            dict: The statistics, plus what was done.
+        """
+        now = time.monotonic()
+        if self.written_since_last_check():
+            self.last_write = now
+        report = self.report()
+        if not force and now - self.last_write < self.quiet:
+            return report
+        if not self.convert_checked:
+            self.convert_checked = True
+            report["converted"] = self.convert_to_incremental_vacuum(AUTO_VACUUM_CONVERT_MAX_BYTES)
+        report["vacuumed_pages"] = self.incremental_vacuum(None if force else self.vacuum_slices)
+        if force or self.analyzed_at is None or now - self.analyzed_at >= ANALYZE_INTERVAL_SECONDS:
+            self._timed("analyze", "ANALYZE")
+            self.analyzed_at = self.optimized_at = now
+            report["analyzed"] = True
+        elif now - self.optimized_at >= OPTIMIZE_INTERVAL_SECONDS:
+            # 0x10002: analyze every table that may benefit, not only those this connection queried (SQLite 3.46+;
+            # earlier versions ignore the extra bit)
+            self._timed("optimize", "PRAGMA optimize = 0x10002")
+            self.optimized_at = now
+            report["optimized"] = True
+        if report["wal_bytes"] or report.get("vacuumed_pages") or report.get("converted"):
+            report["checkpoint"] = self._timed("checkpoint", "PRAGMA wal_checkpoint(TRUNCATE)")[0]
+        return report
+
+    def report(self) -> dict:
+        """
+        Exports and returns the database's file size and page usage.
+        """
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        cache_size = self.conn.execute("PRAGMA cache_size").fetchone()[0]
+        # A negative cache_size is in KiB rather than pages
+        cache_pages = cache_size if cache_size >= 0 else -cache_size * 1024 // page_size
+        wal_path = self.database_path + "-wal"
+        report = {"bytes": os.path.getsize(self.database_path),
+                  "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+                  "pages": pages, "free_pages": free_pages,
+                  "cache_coverage": round(min(1.0, cache_pages / pages), 4) if pages else 1.0}
+        DATABASE_BYTES.set(report["bytes"], file="database")
+        DATABASE_BYTES.set(report["wal_bytes"], file="wal")
+        DATABASE_PAGES.set(pages - free_pages, use="used")
+        DATABASE_PAGES.set(free_pages, use="free")
+        CACHE_COVERAGE.set(report["cache_coverage"])
+        return report
+
+    def convert_to_incremental_vacuum(self, max_bytes: int | None = None) -> bool:
+        """
+        Switches the database to ``auto_vacuum = INCREMENTAL``, which takes a VACUUM rewriting the whole file.
+
+        Args:
+            max_bytes (int | None): Leave larger files alone (and log how to convert them).
+
+        Returns:
+            bool: True if the database was converted now.
+        """
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == INCREMENTAL:
+            return False
+        size = os.path.getsize(self.database_path)
+        if max_bytes is not None and size > max_bytes:
+            log_event(logger, logging.WARNING, "auto_vacuum_conversion_skipped", bytes=size, max_bytes=max_bytes,
+                      hint="run python bot/maintenance.py enable-incremental-vacuum in a quiet period")
+            return False
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._timed("vacuum", "VACUUM")
+        log_event(logger, logging.INFO, "auto_vacuum_converted", bytes_before=size,
+                  bytes_after=os.path.getsize(self.database_path))
+        return True
+
+    def incremental_vacuum(self, max_slices: int | None = None) -> int:
+        """
+        Returns free pages to the file system, ``vacuum_pages`` per transaction, until none is left, ``max_slices``
+        slices ran or another connection wrote meanwhile.
+
+        Returns:
+            int: Pages released.
+        """
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != INCREMENTAL:
+            return 0
+        released = 0
+        slices = 0
+        while max_slices is None or slices < max_slices:
+            free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free_pages or (slices and self.written_since_last_check()):
+                break
+            # execute() would step the pragma once, releasing a single page; executescript() runs it to completion
+            self._timed("incremental_vacuum", f"PRAGMA incremental_vacuum({self.vacuum_pages})", script=True)
+            released += free_pages - self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            slices += 1
+        if released:
+            PAGES_VACUUMED.inc(released)
+            log_event(logger, logging.INFO, "incremental_vacuum_ran", pages=released, slices=slices)
+        return released
+
+    def _timed(self, task: str, sql: str, script: bool = False) -> list | None:
+        start = time.perf_counter()
+        if script:
+            self.conn.executescript(sql)
+            rows = None
+        else:
+            rows = self.conn.execute(sql).fetchall()
+        MAINTENANCE_DURATION.observe(time.perf_counter() - start, task=task)
+        MAINTENANCE_RUNS.inc(task=task)
+        return rows
@@ -0,0 +1,357 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import InstrumentedConnection, REGISTRY
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("MYSCRIBE_JOB_WORKERS", 2))
+# Seconds a claimed job stays invisible to other workers; a worker that crashed loses its claim after this long
+VISIBILITY_TIMEOUT_SECONDS = float(os.getenv("MYSCRIBE_JOB_VISIBILITY_TIMEOUT", 120))
+MAX_ATTEMPTS = int(os.getenv("MYSCRIBE_JOB_MAX_ATTEMPTS", 4))
+# Retry n waits about RETRY_BACKOFF_SECONDS * 2 ** (n - 1), capped at MAX_RETRY_BACKOFF_SECONDS
+RETRY_BACKOFF_SECONDS = float(os.getenv("MYSCRIBE_JOB_BACKOFF", 5))
+MAX_RETRY_BACKOFF_SECONDS = 10 * 60
+# Idle workers look for due jobs (retries, jobs enqueued by other processes) this often
+POLL_INTERVAL_SECONDS = float(os.getenv("MYSCRIBE_JOB_POLL_INTERVAL", 1))
+# Finished and failed jobs are kept this long, then pruned
+JOB_RETENTION_SECONDS = int(os.getenv("MYSCRIBE_JOB_RETENTION", 7 * 24 * 60 * 60))
+# How many finished jobs happen between two prunes
+PRUNE_EVERY = 500
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# Priorities: jobs a user is waiting for run before background enrichment
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BACKGROUND = 0
+
+JOBS_ENQUEUED = REGISTRY.counter("myscribe_jobs_enqueued_total", "Background jobs enqueued.", ("kind",))
+JOBS_DEDUPLICATED = REGISTRY.counter("myscribe_jobs_deduplicated_total",
+                                     "Background jobs not enqueued because an identical one was pending.", ("kind",))
+JOBS_FINISHED = REGISTRY.counter("myscribe_jobs_finished_total",
+                                 "Background job attempts by outcome: done, retried or failed.", ("kind", "outcome"))
+JOB_DURATION = REGISTRY.histogram("myscribe_job_duration_seconds", "Time one background job attempt took.",
+                                  ("kind",), buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+
+class Job:
+    """
+    A job claimed by a worker.
+
+    Attributes:
+        job_id (int): Row id in the ``jobs`` table.
+        kind (str): The registered job kind.
+        payload (dict): JSON arguments of the job.
+        chat_id (int | None): The chat the result is delivered to.
+        attempts (int): Attempts so far, including this one; also the claim's lease token.
+        max_attempts (int): Attempts before the job is given up.
+    """
+
+    __slots__ = ("job_id", "kind", "payload", "chat_id", "attempts", "max_attempts")
+
+    def __init__(self, job_id: int, kind: str, payload: dict, chat_id: int | None, attempts: int, max_attempts: int):
+        self.job_id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.chat_id = chat_id
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+
+class _JobKind:
+    __slots__ = ("handler", "deliver", "max_attempts")
+
+    def __init__(self, handler, deliver, max_attempts):
+        self.handler = handler
+        self.deliver = deliver
+        self.max_attempts = max_attempts
+
+
+class JobQueue:
+    """
+    Durable background job queue kept in the ``jobs`` table of the bot's database.
+
+    Slow work (recommendation scraping, Wikipedia enrichment) is enqueued by handlers and run by a pool of worker
+    threads, so it survives a crash and never holds up a handler. Any bot process may run workers: a job is claimed
+    atomically, and stays invisible to other workers for the visibility timeout, after which a job whose worker died
+    is claimed again. Failed attempts are retried with exponential backoff up to ``max_attempts``. A dedup key keeps
+    a job from being enqueued twice while an identical one is pending.
+
+    When a job finishes, its kind's ``deliver(chat_id, result)`` sends the result back to the chat; it is called with
+    None once the job has failed for good. Delivery happens after the result is committed, so a crash in between
+    loses the message but never repeats the work.
+    """
+
+    def __init__(self, database_path: str | None = None, workers: int = JOB_WORKERS,
+                 visibility_timeout: float = VISIBILITY_TIMEOUT_SECONDS, poll_interval: float = POLL_INTERVAL_SECONDS):
+        """
+        Args:
+            database_path (str | None): SQLite file, MYSCRIBE_DATABASE by default.
+            workers (int): Worker threads started by ``start``.
+            visibility_timeout (float): Seconds a claimed job is hidden from other workers.
+            poll_interval (float): Seconds an idle worker waits before looking for due jobs again.
+        """
+        self.workers = workers
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.conn = sqlite3.connect(database_path or os.getenv("MYSCRIBE_DATABASE"), check_same_thread=False,
+                                    factory=InstrumentedConnection)
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.wake = threading.Condition()
+        self.stopping = False
+        self.threads = []
+        self.finished_since_prune = 0
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                              "id INTEGER PRIMARY KEY, "
+                              "kind TEXT NOT NULL, "
+                              "payload TEXT NOT NULL, "
+                              "chat_id INTEGER, "
+                              "priority INTEGER NOT NULL DEFAULT 0, "
+                              "dedup_key TEXT, "
+                              "state TEXT NOT NULL, "
+                              "attempts INTEGER NOT NULL DEFAULT 0, "
+                              "max_attempts INTEGER NOT NULL, "
+                              "run_at REAL NOT NULL, "
+                              "locked_until REAL, "
+                              "result TEXT, "
+                              "error TEXT, "
+                              "updated_at REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, priority DESC, run_at)")
+            # Only one pending job per dedup key; finished jobs leave the index
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedup_key ON jobs (dedup_key) "
+                              "WHERE dedup_key IS NOT NULL AND state IN ('queued', 'running')")
+            self.conn.commit()
+
+    def register(self, kind: str, handler, deliver=None, max_attempts: int = MAX_ATTEMPTS) -> None:
+        """
+        Registers how jobs of a kind are run. Only registered kinds are claimed by this process's workers.
+
+        Args:
+            kind (str): The job kind, e.g. ``"recommendations"``.
+            handler: Called as ``handler(payload)``; returns a JSON-serialisable result or raises to be retried.
+            deliver: Optional, called as ``deliver(chat_id, result)`` once the job is done, or with None once it failed
+                for good.
+            max_attempts (int): Attempts before the job is given up.
+        """
+        self.kinds[kind] = _JobKind(handler, deliver, max_attempts)
+
+    def enqueue(self, kind: str, payload: dict, chat_id: int | None = None, priority: int = PRIORITY_BACKGROUND,
+                dedup_key: str | None = None, delay: float = 0) -> int:
+        """
+        Adds a job to the queue.
+
+        Args:
+            kind (str): The job kind.
+            payload (dict): JSON-serialisable arguments for the kind's handler.
+            chat_id (int | None): The chat its result is delivered to.
+            priority (int): Higher priorities are claimed first.
+            dedup_key (str | None): If a pending job has the same key, no new job is added.
+            delay (float): Seconds before the job may run.
+
+        Returns:
+            int: The id of the new job, or of the pending job with the same dedup key.
+        """
+        now = time.time()
+        max_attempts = self.kinds[kind].max_attempts if kind in self.kinds else MAX_ATTEMPTS
+        with self.lock:
+            inserted = self.conn.execute("INSERT INTO jobs (kind, payload, chat_id, priority, dedup_key, state, "
+                                         "max_attempts, run_at, updated_at) VALUES (?,?,?,?,?,?,?,?,?) "
+                                         "ON CONFLICT (dedup_key) WHERE dedup_key IS NOT NULL "
+                                         "AND state IN ('queued', 'running') DO NOTHING RETURNING id",
+                                         (kind, json.dumps(payload), chat_id, priority, dedup_key, QUEUED,
+                                          max_attempts, now + delay, now)).fetchone()
+            pending = None
+            if inserted is None:
+                pending = self.conn.execute("SELECT id FROM jobs WHERE dedup_key = ? "
+                                            "AND state IN ('queued', 'running')", (dedup_key,)).fetchone()
+            self.conn.commit()
+        if inserted is None:
+            JOBS_DEDUPLICATED.inc(kind=kind)
+            log_event(logger, logging.DEBUG, "job_deduplicated", kind=kind, dedup_key=dedup_key)
+            return pending[0] if pending else 0
+        JOBS_ENQUEUED.inc(kind=kind)
+        with self.wake:
+            self.wake.notify()
+        return inserted[0]
+
+    def status(self, job_id: int) -> tuple | None:
+        """
+        Returns ``(state, result)`` of a job, the result decoded, or None if the job does not exist (any more).
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT state, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] is not None else None
+
+    def claim(self) -> Job | None:
+        """
+        Atomically claims the most urgent due job of a registered kind, including jobs whose claim has expired.
+
+        Returns:
+            Job | None: The claimed job, or None if nothing is due.
+        """
+        if not self.kinds:
+            return None
+        now = time.time()
+        placeholders = ",".join("?" * len(self.kinds))
+        with self.lock:
+            row = self.conn.execute(f"UPDATE jobs SET state = ?, attempts = attempts + 1, locked_until = ?, "
+                                    f"updated_at = ? WHERE id = ("
+                                    f"SELECT id FROM jobs WHERE kind IN ({placeholders}) "
+                                    f"AND ((state = ? AND run_at <= ?) OR (state = ? AND locked_until <= ?)) "
+                                    f"ORDER BY priority DESC, run_at, id LIMIT 1) "
+                                    f"RETURNING id, kind, payload, chat_id, attempts, max_attempts",
+                                    (RUNNING, now + self.visibility_timeout, now, *self.kinds,
+                                     QUEUED, now, RUNNING, now)).fetchone()
+            self.conn.commit()
+        if row is None:
+            return None
+        return Job(row[0], row[1], json.loads(row[2]), row[3], row[4], row[5])
+
+    def complete(self, job: Job, result) -> bool:
+        """
+        Stores the result of a claimed job.
+
+        Returns:
+            bool: False if the claim had expired and another worker took the job over.
+        """
+        with self.lock:
+            updated = self.conn.execute("UPDATE jobs SET state = ?, result = ?, locked_until = NULL, updated_at = ? "
+                                        "WHERE id = ? AND state = ? AND attempts = ?",
+                                        (DONE, json.dumps(result), time.time(), job.job_id, RUNNING,
+                                         job.attempts)).rowcount
+            self.conn.commit()
+        return updated == 1
+
+    def fail(self, job: Job, error: str) -> bool:
+        """
+        Schedules a retry of a claimed job after a backoff, or gives it up after its last attempt.
+
+        Returns:
+            bool: True if the job was given up for good.
+        """
+        now = time.time()
+        given_up = job.attempts >= job.max_attempts
+        backoff = min(MAX_RETRY_BACKOFF_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1))
+        # Jitter keeps jobs that failed together (an upstream outage) from all retrying at the same moment
+        run_at = now + backoff * random.uniform(0.5, 1.0)
+        with self.lock:
+            updated = self.conn.execute("UPDATE jobs SET state = ?, error = ?, run_at = ?, locked_until = NULL, "
+                                        "updated_at = ? WHERE id = ? AND state = ? AND attempts = ?",
+                                        (FAILED if given_up else QUEUED, error, run_at, now, job.job_id, RUNNING,
+                                         job.attempts)).rowcount
+            self.conn.commit()
+        return given_up and updated == 1
+
+    def run_job(self, job: Job) -> None:
+        """
+        Runs a claimed job, records its outcome and delivers the result.
+        """
+        kind = self.kinds[job.kind]
+        start = time.perf_counter()
+        try:
+            result = kind.handler(job.payload)
+        except Exception as e:
+            JOB_DURATION.observe(time.perf_counter() - start, kind=job.kind)
+            given_up = self.fail(job, repr(e))
+            JOBS_FINISHED.inc(kind=job.kind, outcome=FAILED if given_up else "retried")
+            log_event(logger, logging.ERROR if given_up else logging.WARNING, "job_failed", kind=job.kind,
+                      job_id=job.job_id, attempt=job.attempts, given_up=given_up, error=repr(e))
+            if given_up:
+                self._deliver(job, kind, None)
+            return
+        JOB_DURATION.observe(time.perf_counter() - start, kind=job.kind)
+        if not self.complete(job, result):
+            log_event(logger, logging.WARNING, "job_claim_expired", kind=job.kind, job_id=job.job_id)
+            return
+        JOBS_FINISHED.inc(kind=job.kind, outcome=DONE)
+        self._deliver(job, kind, result)
+        self.finished_since_prune += 1
+        if self.finished_since_prune >= PRUNE_EVERY:
+            self.prune()
+
+    def _deliver(self, job: Job, kind: _JobKind, result) -> None:
+        if kind.deliver is None or job.chat_id is None:
+            return
+        try:
+            kind.deliver(job.chat_id, result)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "job_delivery_failed", kind=job.kind, job_id=job.job_id, error=repr(e))
+
+    def run_pending(self, limit: int | None = None) -> int:
+        """
+        Runs due jobs in the calling thread until none is left, or ``limit`` jobs ran.
+
+        Returns:
+            int: The number of jobs run.
+        """
+        ran = 0
+        while limit is None or ran < limit:
+            job = self.claim()
+            if job is None:
+                break
+            self.run_job(job)
+            ran += 1
+        return ran
+
+    def start(self) -> None:
+        """
+        Starts the worker threads.
+        """
+        if self.threads:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def close(self) -> None:
+        """
+        Stops the workers after their current job. Jobs left unfinished are picked up again after a restart.
+        """
+        with self.wake:
+            self.stopping = True
+            self.wake.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=self.poll_interval * 2)
+        self.threads = []
+
+    def _work(self) -> None:
+        while not self.stopping:
+            try:
+                job = self.claim()
+            except sqlite3.Error as e:
+                log_event(logger, logging.ERROR, "job_claim_failed", error=str(e))
+                job = None
+            if job is None:
+                with self.wake:
+                    if not self.stopping:
+                        self.wake.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def prune(self) -> int:
+        """
+        Deletes finished and failed jobs older than the retention.
+
+        Returns:
+            int: The number of jobs deleted.
+        """
+        self.finished_since_prune = 0
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                                        (DONE, FAILED, time.time() - JOB_RETENTION_SECONDS)).rowcount
+            self.conn.commit()
+        return deleted
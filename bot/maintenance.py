@@ -0,0 +1,88 @@
+"""
+Maintenance tasks on the MyScribe database (MYSCRIBE_DATABASE), safe to run while the bot is serving.
+
+Commands:
+    recompute-time-left   recompute books_and_users.time_left of every reader with batched set-based UPDATEs, e.g.
+                          after AVG_WORDS_PER_PAGE or AVG_READING_SPEED changed
+    backup                take an online backup snapshot now and rotate old ones (see backup.py)
+    maintain              run the maintenance db_maintenance.py runs in quiet periods now: incremental vacuum of
+                          every free page, ANALYZE and a WAL checkpoint
+    enable-incremental-vacuum
+                          switch the database to auto_vacuum=INCREMENTAL; rewrites the file with VACUUM, so run it
+                          when the bot is quiet
+
+Usage:
+    python bot/maintenance.py recompute-time-left
+    python bot/maintenance.py recompute-time-left --batch-size 20000
+    python bot/maintenance.py backup --keep 3
+    python bot/maintenance.py maintain
+"""
+import argparse
+import sys
+
+from backup import BACKUP_KEEP, DatabaseBackup
+from book_database import TIME_LEFT_BATCH_SIZE, BookDatabase
+from db_maintenance import DatabaseMaintenance
+from structured_logging import configure_logging
+
+
+def recompute_time_left(arguments: argparse.Namespace) -> int:
+    book_database = BookDatabase()
+    try:
+        updated = book_database.recompute_time_left(arguments.batch_size)
+    finally:
+        book_database.close()
+    print(f"time_left recomputed, {updated} rows changed")
+    return 0
+
+
+def backup(arguments: argparse.Namespace) -> int:
+    database_backup = DatabaseBackup(keep=arguments.keep)
+    path = database_backup.backup()
+    deleted = database_backup.rotate()
+    print(f"backup written to {path}, {len(deleted)} old backups deleted")
+    return 0
+
+
+def maintain(arguments: argparse.Namespace) -> int:
+    database_maintenance = DatabaseMaintenance()
+    try:
+        report = database_maintenance.run_once(force=True)
+    finally:
+        database_maintenance.close()
+    print(", ".join(f"{name}: {value}" for name, value in report.items()))
+    return 0
+
+
+def enable_incremental_vacuum(arguments: argparse.Namespace) -> int:
+    database_maintenance = DatabaseMaintenance()
+    try:
+        converted = database_maintenance.convert_to_incremental_vacuum()
+    finally:
+        database_maintenance.close()
+    print("database converted to incremental auto_vacuum" if converted
+          else "database already uses incremental auto_vacuum")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    recompute = commands.add_parser("recompute-time-left", help="recompute every reader's reading time left")
+    recompute.add_argument("--batch-size", type=int, default=TIME_LEFT_BATCH_SIZE,
+                           help="reading rows updated per transaction")
+    recompute.set_defaults(run=recompute_time_left)
+    backup_command = commands.add_parser("backup", help="take an online backup snapshot now")
+    backup_command.add_argument("--keep", type=int, default=BACKUP_KEEP, help="snapshots kept by rotation")
+    backup_command.set_defaults(run=backup)
+    commands.add_parser("maintain", help="run database maintenance now").set_defaults(run=maintain)
+    commands.add_parser("enable-incremental-vacuum", help="switch the database to incremental auto_vacuum"
+                        ).set_defaults(run=enable_incremental_vacuum)
+    arguments = parser.parse_args()
+
+    configure_logging()
+    return arguments.run(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bounds (seconds) of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_SQL_TABLE_PATTERN = re.compile(r"(?i)\b(?:FROM|INTO|UPDATE|TABLE)\s+\"?(\w+)")
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    """
+    Renders a label set in the Prometheus text format, e.g. ``{handler="command_start"}``.
+    """
+    pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    A monotonically increasing value, kept separately for every label combination.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increments the counter for the given labels.
+
+        Args:
+            amount (float): How much to add.
+            **labels: One value per label name.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down, kept separately for every label combination.
+    """
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Sets the gauge for the given labels.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+        with self.lock:
+            self.values[key] = value
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, kept separately for every label combination.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Records one observation for the given labels.
+
+        Args:
+            value (float): The observed value, in seconds for latencies.
+            **labels: One value per label name.
+        """
+        key = tuple(labels[name] for name in self.label_names)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series[index] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                cumulative = 0
+                for upper_bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    labels = _format_labels(self.label_names, key, f'le="{upper_bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                cumulative += series[len(self.buckets)]
+                labels = _format_labels(self.label_names, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds every metric of the process and renders them in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()) -> Counter:
+        return self._register(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: tuple = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, label_names)
+
+    def histogram(self, name: str, documentation: str, label_names: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, label_names, buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_LATENCY = REGISTRY.histogram("myscribe_handler_duration_seconds",
+                                     "Time spent in a Telegram handler or next-step continuation.", ("handler",))
+HANDLER_CALLS = REGISTRY.counter("myscribe_handler_calls_total",
+                                 "Telegram handler and next-step continuation invocations.", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("myscribe_handler_errors_total",
+                                  "Telegram handler invocations that raised.", ("handler",))
+DEPENDENCY_LATENCY = REGISTRY.histogram("myscribe_dependency_duration_seconds",
+                                        "Time spent waiting on SQLite, upstream HTTP APIs or the Telegram Bot API.",
+                                        ("dependency", "operation"))
+DEPENDENCY_CALLS = REGISTRY.counter("myscribe_dependency_calls_total",
+                                    "Calls made to SQLite, upstream HTTP APIs or the Telegram Bot API.",
+                                    ("dependency", "operation"))
+DEPENDENCY_ERRORS = REGISTRY.counter("myscribe_dependency_errors_total",
+                                     "Dependency calls that raised.", ("dependency", "operation"))
+
+
+def track_handler(handler_name: str):
+    """
+    Decorator recording latency, call count and errors of a Telegram handler under the given name.
+
+    Args:
+        handler_name (str): Label used for the handler in every metric.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=handler_name)
+                raise
+            finally:
+                HANDLER_CALLS.inc(handler=handler_name)
+                HANDLER_LATENCY.observe(time.perf_counter() - start, handler=handler_name)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track_dependency(dependency: str, operation: str):
+    """
+    Context manager recording latency, call count and errors of one call to an external dependency.
+
+    Args:
+        dependency (str): The dependency called, e.g. ``sqlite``, ``google_books`` or ``telegram``.
+        operation (str): What was done, e.g. ``SELECT books`` or ``sendMessage``.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        DEPENDENCY_CALLS.inc(dependency=dependency, operation=operation)
+        DEPENDENCY_LATENCY.observe(time.perf_counter() - start, dependency=dependency, operation=operation)
+
+
+@functools.lru_cache(maxsize=512)
+def sql_operation(sql: str) -> str:
+    """
+    Reduces an SQL statement to a low-cardinality label such as ``SELECT books``.
+    """
+    verb = sql.split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+    table = _SQL_TABLE_PATTERN.search(sql)
+    return f"{verb} {table.group(1)}" if table else verb
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    sqlite3 cursor timing every statement it executes.
+    """
+
+    def execute(self, sql, parameters=()):
+        with track_dependency("sqlite", sql_operation(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with track_dependency("sqlite", sql_operation(sql)):
+            return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        with track_dependency("sqlite", "SCRIPT"):
+            return super().executescript(sql_script)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection whose cursors are instrumented and whose commits are timed.
+
+    Pass it as ``factory`` to ``sqlite3.connect``.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        with track_dependency("sqlite", "COMMIT"):
+            return super().commit()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would otherwise flood stderr.
+        pass
+
+
+def start_metrics_server(port: int | None = None, host: str | None = None) -> ThreadingHTTPServer | None:
+    """
+    Serves the metrics in Prometheus format from a daemon thread.
+
+    The port and host default to the ``MYSCRIBE_METRICS_PORT`` and ``MYSCRIBE_METRICS_HOST`` environment variables.
+    Nothing is started if no port is configured.
+
+    Args:
+        port (int | None): Port to listen on.
+        host (str | None): Interface to bind, 127.0.0.1 by default so the endpoint stays local.
+
+    Returns:
+        ThreadingHTTPServer | None: The running server, or None if metrics serving is disabled.
+    """
+    port = port or os.getenv("MYSCRIBE_METRICS_PORT")
+    if not port:
+        return None
+    host = host or os.getenv("MYSCRIBE_METRICS_HOST", "127.0.0.1")
+    server = ThreadingHTTPServer((host, int(port)), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
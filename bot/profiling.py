@@ -0,0 +1,175 @@
+import collections
+import functools
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_DIR = os.getenv("MYSCRIBE_PROFILE_DIR", "profiles")
+DEFAULT_PROFILE_SECONDS = int(os.getenv("MYSCRIBE_PROFILE_SECONDS", 30))
+SAMPLE_INTERVAL_SECONDS = int(os.getenv("MYSCRIBE_PROFILE_INTERVAL_MS", 5)) / 1000
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 30
+
+
+class SamplingProfiler:
+    """
+    On-demand stack sampler for the running bot.
+
+    While active, a background thread samples the stack of every other thread at a fixed interval and attributes each
+    sample to the handler that thread is running. When the session ends it writes one folded-stack file per handler
+    (the input format of flamegraph.pl and speedscope) and a tracemalloc top-allocations snapshot.
+
+    While inactive the only cost is one attribute check per handler call.
+    """
+
+    def __init__(self, output_dir: str = PROFILE_DIR, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.active = False
+        self.lock = threading.Lock()
+        self.current_handlers = {}
+        self.samples = collections.Counter()
+        self.handled_updates = 0
+        self.max_updates = None
+        self.session_dir = None
+        self.started_tracemalloc = False
+        self._stop_event = threading.Event()
+
+    def start(self, seconds: int | None = None, updates: int | None = None) -> str | None:
+        """
+        Starts a profiling session that ends after the given time or number of handled updates, whichever is first.
+
+        Args:
+            seconds (int | None): Session length in seconds. Defaults to MYSCRIBE_PROFILE_SECONDS if updates is None.
+            updates (int | None): Number of handled updates after which the session ends.
+
+        Returns:
+            str | None: The directory the results will be written to, or None if a session is already running.
+        """
+        with self.lock:
+            if self.active:
+                return None
+            if seconds is None and updates is None:
+                seconds = DEFAULT_PROFILE_SECONDS
+            self.samples.clear()
+            self.handled_updates = 0
+            self.max_updates = updates
+            self.session_dir = os.path.join(self.output_dir, time.strftime("profile-%Y%m%d-%H%M%S"))
+            self._stop_event.clear()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self.started_tracemalloc = True
+            self.active = True
+
+        threading.Thread(target=self._sample, args=(seconds,), name="profiler-sampler", daemon=True).start()
+        return self.session_dir
+
+    def stop(self) -> None:
+        """
+        Ends the running session. The sampler thread writes the results before it exits.
+        """
+        self._stop_event.set()
+
+    def track_handler(self, handler_name: str):
+        """
+        Decorator attributing samples taken while the handler runs to the given handler name.
+
+        Args:
+            handler_name (str): Name the handler's samples are filed under.
+        """
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                if not self.active:
+                    return handler(*args, **kwargs)
+                thread_id = threading.get_ident()
+                self.current_handlers[thread_id] = handler_name
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    self.current_handlers.pop(thread_id, None)
+                    self._count_update()
+            return wrapper
+        return decorator
+
+    def install_signal_handler(self, signal_number: int | None = None) -> bool:
+        """
+        Starts a default-length session whenever the process receives the given signal (SIGUSR1 by default).
+
+        Must be called from the main thread.
+
+        Returns:
+            bool: True if the handler was installed, False on platforms without the signal.
+        """
+        signal_number = signal_number or getattr(signal, "SIGUSR1", None)
+        if signal_number is None:
+            return False
+        # Start from a fresh thread so the signal never waits on a lock the interrupted thread holds
+        signal.signal(signal_number,
+                      lambda signum, frame: threading.Thread(target=self.start, daemon=True).start())
+        return True
+
+    def _count_update(self) -> None:
+        with self.lock:
+            self.handled_updates += 1
+            if self.max_updates is not None and self.handled_updates >= self.max_updates:
+                self._stop_event.set()
+
+    def _sample(self, seconds: int | None) -> None:
+        own_thread_id = threading.get_ident()
+        thread_names = {}
+        deadline = time.monotonic() + seconds if seconds else None
+        while not self._stop_event.wait(self.interval):
+            if deadline and time.monotonic() >= deadline:
+                break
+            if len(thread_names) != threading.active_count():
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                label = self.current_handlers.get(thread_id) or f"[{thread_names.get(thread_id, thread_id)}]"
+                self.samples[(label, self._fold(frame))] += 1
+        self._write_results()
+
+    @staticmethod
+    def _fold(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _write_results(self) -> None:
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+        os.makedirs(self.session_dir, exist_ok=True)
+        per_handler = collections.defaultdict(list)
+        for (label, stack), count in self.samples.items():
+            per_handler[label].append(f"{label};{stack} {count}")
+        for label, lines in per_handler.items():
+            file_name = "flame-" + "".join(c if c.isalnum() or c in "-_" else "_" for c in label) + ".folded"
+            with open(os.path.join(self.session_dir, file_name), "w") as flame_file:
+                flame_file.write("\n".join(lines) + "\n")
+
+        if snapshot:
+            with open(os.path.join(self.session_dir, "tracemalloc-top.txt"), "w") as allocations_file:
+                for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                    allocations_file.write(f"{statistic}\n")
+
+        with self.lock:
+            self.active = False
+            self.current_handlers.clear()
+
+
+PROFILER = SamplingProfiler()
@@ -0,0 +1,300 @@
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from scheduler import TokenBucket
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 24 * 60 * 60
+# Expected time between two progress logs of a reader without history, and the bounds of a learned one
+DEFAULT_INTERVAL_SECONDS = 2 * DAY_SECONDS
+MIN_INTERVAL_SECONDS = DAY_SECONDS
+MAX_INTERVAL_SECONDS = 7 * DAY_SECONDS
+# A reader is nudged once they are this much later than their usual interval
+GRACE_FACTOR = 1.5
+# Unanswered reminders in a row after which a book is no longer reminded about
+MAX_REMINDERS = int(os.getenv("MYSCRIBE_MAX_REMINDERS", 3))
+# Reminders sent per batch and per second, per process; Telegram allows a bot about 30 messages per second overall
+REMINDER_BATCH_SIZE = int(os.getenv("MYSCRIBE_REMINDER_BATCH", 25))
+REMINDERS_PER_SECOND = float(os.getenv("MYSCRIBE_REMINDERS_PER_SECOND", 20))
+# Upcoming reminders held in the timer heap, and how often it is reloaded to see other processes' changes
+HEAP_WINDOW = 1000
+HEAP_REFRESH_SECONDS = 300
+
+# The book_status id of "currently reading"
+CURRENTLY_READING = 1
+
+REMINDERS_SENT = REGISTRY.counter("myscribe_reminders_sent_total", "Reading reminders by outcome.", ("outcome",))
+REMINDER_LAG = REGISTRY.histogram("myscribe_reminder_lag_seconds", "How late reading reminders were sent.",
+                                  buckets=(1, 5, 15, 60, 300, 900, 3600))
+
+
+class ReadingReminders:
+    """
+    Due times of reading reminders, kept in the ``reading_reminders`` table.
+
+    Every book a user is currently reading has a row with the time they should be nudged if they have not logged
+    pages by then. The time follows the reader's own rhythm: the interval between their progress logs is learned as a
+    moving average, and they are reminded once they are ``GRACE_FACTOR`` times later than usual. Unanswered reminders
+    back off exponentially and stop after MAX_REMINDERS. Rows that are not due any more have a NULL due time and drop
+    out of the partial index, so finding due reminders is one index range scan however many users there are.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock, execute_writes):
+        """
+        Args:
+            conn (sqlite3.Connection): BookDatabase's connection.
+            lock (threading.RLock): Lock guarding ``conn``.
+            execute_writes: BookDatabase.execute_writes, so a schedule change commits with the handler's update.
+        """
+        self.conn = conn
+        self.lock = lock
+        self.execute_writes = execute_writes
+        # Called as on_scheduled(due_at) when a reminder is (re)scheduled, see ReminderScheduler
+        self.on_scheduled = None
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS reading_reminders ("
+                              "user_id INTEGER NOT NULL, "
+                              "book_id INTEGER NOT NULL, "
+                              "due_at REAL, "
+                              "interval_seconds REAL NOT NULL, "
+                              "last_logged_at REAL, "
+                              "reminders_sent INTEGER NOT NULL DEFAULT 0, "
+                              "PRIMARY KEY (user_id, book_id))")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS reading_reminders_due ON reading_reminders (due_at) "
+                              "WHERE due_at IS NOT NULL")
+            self.conn.commit()
+
+    def _schedule_statement(self, user_id: int, book_id: int, due_at: float, interval: float,
+                            last_logged_at: float | None) -> tuple:
+        if self.on_scheduled:
+            self.on_scheduled(due_at)
+        return ("INSERT INTO reading_reminders (user_id, book_id, due_at, interval_seconds, last_logged_at, "
+                "reminders_sent) VALUES (?,?,?,?,?,0) ON CONFLICT (user_id, book_id) DO UPDATE SET "
+                "due_at = excluded.due_at, interval_seconds = excluded.interval_seconds, "
+                "last_logged_at = excluded.last_logged_at, reminders_sent = 0",
+                (user_id, book_id, due_at, interval, last_logged_at))
+
+    def _history(self, user_id: int, book_ids: list) -> dict:
+        placeholders = ",".join("?" * len(book_ids))
+        with self.lock:
+            rows = self.conn.execute(f"SELECT book_id, interval_seconds, last_logged_at FROM reading_reminders "
+                                     f"WHERE user_id = ? AND book_id IN ({placeholders})",
+                                     (user_id, *book_ids)).fetchall()
+        return {book_id: (interval, last_logged_at) for book_id, interval, last_logged_at in rows}
+
+    def start_reading_statement(self, user_id: int, book_id: int) -> tuple:
+        """
+        The statement scheduling the first reminder for a book the user started reading, for the caller to apply in
+        its own transaction.
+        """
+        interval, last_logged_at = self._history(user_id, [book_id]).get(book_id, (DEFAULT_INTERVAL_SECONDS, None))
+        return self._schedule_statement(user_id, book_id, time.time() + interval * GRACE_FACTOR, interval,
+                                        last_logged_at)
+
+    def start_reading(self, user_id: int, book_id: int) -> None:
+        """
+        Schedules the first reminder for a book the user started reading.
+        """
+        self.execute_writes([self.start_reading_statement(user_id, book_id)], user_id)
+
+    def progress_statements(self, user_id: int, book_ids: list) -> list:
+        """
+        Statements learning from a progress log on each of the books and pushing their next reminders out, for the
+        caller to apply in its own transaction. The reading history of all books is read with one query.
+
+        Returns:
+            list: ``(sql, parameters)`` pairs.
+        """
+        if not book_ids:
+            return []
+        now = time.time()
+        history = self._history(user_id, book_ids)
+        statements = []
+        for book_id in book_ids:
+            interval, last_logged_at = history.get(book_id, (DEFAULT_INTERVAL_SECONDS, None))
+            if last_logged_at is not None:
+                gap = min(max(now - last_logged_at, MIN_INTERVAL_SECONDS), MAX_INTERVAL_SECONDS)
+                interval = 0.5 * interval + 0.5 * gap
+            statements.append(self._schedule_statement(user_id, book_id, now + interval * GRACE_FACTOR, interval, now))
+        return statements
+
+    def record_progress(self, user_id: int, book_id: int) -> None:
+        """
+        Learns from a progress log and pushes the book's next reminder out accordingly.
+        """
+        self.execute_writes(self.progress_statements(user_id, [book_id]), user_id)
+
+    def cancel_statement(self, user_id: int, book_id: int) -> tuple:
+        """
+        The statement stopping reminders for one book, for the caller to apply in its own transaction.
+        """
+        return "UPDATE reading_reminders SET due_at = NULL WHERE user_id = ? AND book_id = ?", (user_id, book_id)
+
+    def cancel(self, user_id: int, book_id: int | None = None) -> None:
+        """
+        Stops reminders for one book of the user, or for all of them.
+        """
+        if book_id is None:
+            self.execute_writes([("UPDATE reading_reminders SET due_at = NULL WHERE user_id = ?", (user_id,))], user_id)
+        else:
+            self.execute_writes([self.cancel_statement(user_id, book_id)], user_id)
+
+    def due(self, now: float, limit: int) -> list:
+        """
+        Returns up to ``limit`` reminders due by ``now``, earliest first, as ``(user_id, book_id, due_at, title)``.
+        """
+        with self.lock:
+            return self.conn.execute("SELECT r.user_id, r.book_id, r.due_at, b.title FROM reading_reminders AS r "
+                                     "JOIN books AS b ON b.id = r.book_id "
+                                     "WHERE r.due_at <= ? ORDER BY r.due_at LIMIT ?", (now, limit)).fetchall()
+
+    def upcoming(self, limit: int) -> list:
+        """
+        Returns the due times of the next ``limit`` reminders, earliest first.
+        """
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT due_at FROM reading_reminders "
+                                                        "WHERE due_at IS NOT NULL ORDER BY due_at LIMIT ?", (limit,))]
+
+    def claim(self, user_id: int, book_id: int, due_at: float) -> bool:
+        """
+        Marks a due reminder as sent and schedules the next one with an exponential backoff, unless it was already
+        claimed by another process or rescheduled in the meantime.
+
+        Returns:
+            bool: True if the caller should send the reminder.
+        """
+        with self.lock:
+            claimed = self.conn.execute("UPDATE reading_reminders SET reminders_sent = reminders_sent + 1, "
+                                        "due_at = CASE WHEN reminders_sent + 1 >= ? THEN NULL "
+                                        "ELSE ? + interval_seconds * (2 << reminders_sent) END "
+                                        "WHERE user_id = ? AND book_id = ? AND due_at = ?",
+                                        (MAX_REMINDERS, time.time(), user_id, book_id, due_at)).rowcount
+            self.conn.commit()
+        return claimed == 1
+
+
+class ReminderScheduler:
+    """
+    Sends due reading reminders from a background thread.
+
+    The thread sleeps on a heap of the next HEAP_WINDOW due times instead of polling all users: it wakes when the
+    earliest one is due (or a sooner one is scheduled in this process), fetches due reminders from the index in
+    batches, and sends them through a token bucket so they never exceed ``per_second``. The table stays the source of
+    truth: stale heap entries only cause a cheap empty query, and every reminder is claimed before it is sent, so
+    several processes can run a scheduler without sending one twice.
+    """
+
+    def __init__(self, reminders: ReadingReminders, send, batch_size: int = REMINDER_BATCH_SIZE,
+                 per_second: float = REMINDERS_PER_SECOND):
+        """
+        Args:
+            reminders (ReadingReminders): The reminder table.
+            send: Called as ``send(user_id, book_title)`` for every reminder.
+            batch_size (int): Due reminders fetched per query.
+            per_second (float): Sending rate limit.
+        """
+        self.reminders = reminders
+        self.send = send
+        self.batch_size = batch_size
+        self.bucket = TokenBucket(batch_size, per_second)
+        self.heap = []
+        self.horizon = 0.0
+        self.refresh_at = 0.0
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = None
+        reminders.on_scheduled = self.scheduled
+
+    def scheduled(self, due_at: float) -> None:
+        """
+        Wakes the thread for a reminder due before the end of the loaded heap window.
+        """
+        with self.condition:
+            if due_at < self.horizon:
+                heapq.heappush(self.heap, due_at)
+                if self.heap[0] == due_at:
+                    self.condition.notify()
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+            self.thread.start()
+
+    def close(self) -> None:
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def refresh(self) -> None:
+        """
+        Reloads the heap with the next HEAP_WINDOW due times.
+        """
+        upcoming = self.reminders.upcoming(HEAP_WINDOW)
+        with self.condition:
+            self.heap = upcoming
+            heapq.heapify(self.heap)
+            # Beyond the last loaded reminder nothing is known until the next refresh
+            self.horizon = upcoming[-1] if len(upcoming) == HEAP_WINDOW else float("inf")
+            self.refresh_at = time.time() + HEAP_REFRESH_SECONDS
+
+    def send_due(self) -> int:
+        """
+        Sends every reminder due now, batch by batch.
+
+        Returns:
+            int: The number of reminders sent.
+        """
+        sent = 0
+        while True:
+            now = time.time()
+            batch = self.reminders.due(now, self.batch_size)
+            for user_id, book_id, due_at, title in batch:
+                if not self.reminders.claim(user_id, book_id, due_at):
+                    REMINDERS_SENT.inc(outcome="claimed_elsewhere")
+                    continue
+                while not self.bucket.try_take():
+                    time.sleep(1 / self.bucket.rate)
+                REMINDER_LAG.observe(max(0.0, time.time() - due_at))
+                try:
+                    self.send(user_id, title)
+                except Exception as e:
+                    REMINDERS_SENT.inc(outcome="failed")
+                    log_event(logger, logging.WARNING, "reminder_failed", telegram_id=user_id, book_id=book_id,
+                              error=repr(e))
+                else:
+                    REMINDERS_SENT.inc(outcome="sent")
+                    sent += 1
+            with self.condition:
+                while self.heap and self.heap[0] <= now:
+                    heapq.heappop(self.heap)
+            if len(batch) < self.batch_size or self.stopping:
+                return sent
+
+    def _run(self) -> None:
+        while not self.stopping:
+            try:
+                if time.time() >= self.refresh_at:
+                    self.refresh()
+                with self.condition:
+                    now = time.time()
+                    next_due = self.heap[0] if self.heap else self.refresh_at
+                    if next_due > now:
+                        self.condition.wait(min(next_due, self.refresh_at) - now)
+                        continue
+                self.send_due()
+            except sqlite3.Error as e:
+                log_event(logger, logging.ERROR, "reminder_scheduler_failed", error=str(e))
+                with self.condition:
+                    self.condition.wait(HEAP_REFRESH_SECONDS / 10)
@@ -0,0 +1,131 @@
+import collections
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+
+load_dotenv()
+
+# Entries kept per cache, and how long one is served before it is read again (other processes may change rows)
+ROW_CACHE_SIZE = int(os.getenv("MYSCRIBE_ROW_CACHE_SIZE", 10_000))
+ROW_CACHE_TTL_SECONDS = float(os.getenv("MYSCRIBE_ROW_CACHE_TTL", 300))
+
+CACHE_LOOKUPS = REGISTRY.counter("myscribe_row_cache_lookups_total", "Row cache lookups by cache and result.",
+                                 ("cache", "result"))
+CACHE_INVALIDATIONS = REGISTRY.counter("myscribe_row_cache_invalidations_total", "Row cache entries invalidated.",
+                                       ("cache",))
+CACHE_SIZE = REGISTRY.gauge("myscribe_row_cache_entries", "Entries held per row cache.", ("cache",))
+
+MISSING = object()
+
+
+class RowCache:
+    """
+    Bounded, thread-safe LRU cache of database values, such as a user's reading speed or a book's details.
+
+    BookDatabase writes through it: every statement changing a cached value also puts the new value (or invalidates
+    the entry), so a cached value is never older than this process's last write. Entries expire after ``ttl_seconds``
+    so changes made by other processes are picked up too. Callbacks registered with ``on_invalidate`` are told about
+    every invalidation, e.g. to drop values derived from the entry.
+    """
+
+    def __init__(self, name: str, max_size: int = ROW_CACHE_SIZE, ttl_seconds: float | None = ROW_CACHE_TTL_SECONDS):
+        """
+        Args:
+            name (str): Label of the cache in metrics and stats.
+            max_size (int): Entries kept; the least recently used one is dropped beyond that.
+            ttl_seconds (float | None): How long an entry is served, forever if None.
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidation_hooks = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key, default=MISSING):
+        """
+        The cached value of ``key``, or ``default`` (the MISSING sentinel unless given) if it is not cached.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                hit = True
+            else:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                hit = False
+        CACHE_LOOKUPS.inc(cache=self.name, result="hit" if hit else "miss")
+        return entry[1] if hit else default
+
+    def put(self, key, value) -> None:
+        """
+        Caches ``value`` for ``key``, replacing any previous value.
+        """
+        expires_at = None if self.ttl_seconds is None else time.monotonic() + self.ttl_seconds
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            size = len(self.entries)
+        CACHE_SIZE.set(size, cache=self.name)
+
+    def get_or_load(self, key, load):
+        """
+        The cached value of ``key``, or the value ``load()`` returns, which is cached unless it is None.
+        """
+        value = self.get(key)
+        if value is MISSING:
+            value = load()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def invalidate(self, key) -> None:
+        """
+        Drops ``key`` and tells the invalidation hooks.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            size = len(self.entries)
+        CACHE_INVALIDATIONS.inc(cache=self.name)
+        CACHE_SIZE.set(size, cache=self.name)
+        for hook in self.invalidation_hooks:
+            hook(key)
+
+    def clear(self) -> None:
+        """
+        Drops every entry; the invalidation hooks are called with None.
+        """
+        with self.lock:
+            self.entries.clear()
+        CACHE_SIZE.set(0, cache=self.name)
+        for hook in self.invalidation_hooks:
+            hook(None)
+
+    def on_invalidate(self, hook) -> None:
+        """
+        Registers ``hook(key)``, called after an entry is invalidated (``key`` None when the cache is cleared).
+        """
+        self.invalidation_hooks.append(hook)
+
+    def stats(self) -> dict:
+        """
+        Hits, misses, hit rate and size since the cache was created.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                    "entries": len(self.entries), "max_size": self.max_size}
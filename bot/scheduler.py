@@ -0,0 +1,270 @@
+import collections
+import functools
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Handlers and conversation steps that make slow outbound calls (Books API, CSE, Goodreads)
+EXPENSIVE_HANDLERS = frozenset({
+    "find_recommendation",
+    "get_author_name",
+    "new_books_handler",
+})
+
+SCHEDULER_WORKERS = int(os.getenv("MYSCRIBE_SCHEDULER_WORKERS", 8))
+# Expensive work never occupies more workers than this, so cheap interactions always find a free one
+EXPENSIVE_CONCURRENCY = int(os.getenv("MYSCRIBE_EXPENSIVE_CONCURRENCY", max(1, SCHEDULER_WORKERS - 2)))
+# Per-chat token bucket for expensive intents: burst size and sustained rate
+EXPENSIVE_BURST = int(os.getenv("MYSCRIBE_EXPENSIVE_BURST", 3))
+EXPENSIVE_PER_MINUTE = float(os.getenv("MYSCRIBE_EXPENSIVE_PER_MINUTE", 3))
+# Expensive work is shed above this many waiting tasks, or once tasks wait longer than this many seconds
+MAX_EXPENSIVE_QUEUE = int(os.getenv("MYSCRIBE_MAX_EXPENSIVE_QUEUE", 20))
+MAX_QUEUE_WAIT_SECONDS = float(os.getenv("MYSCRIBE_MAX_QUEUE_WAIT", 15))
+# Buckets kept before idle (full) ones are dropped
+MAX_BUCKETS = 10_000
+
+CHEAP, EXPENSIVE = "cheap", "expensive"
+RATE_LIMITED, QUEUE_FULL, QUEUE_LATENCY = "rate_limited", "queue_depth", "latency"
+
+QUEUE_DEPTH = REGISTRY.gauge("myscribe_scheduler_queue_depth", "Handler tasks waiting per lane.", ("lane",))
+QUEUE_WAIT = REGISTRY.histogram("myscribe_scheduler_queue_wait_seconds",
+                                "Time handler tasks waited for a worker.", ("lane",))
+SHED_TASKS = REGISTRY.counter("myscribe_scheduler_shed_total",
+                              "Expensive handler tasks refused with a busy reply.", ("reason",))
+
+
+def update_chat_id(update) -> int | None:
+    """
+    The chat of a telebot Message or CallbackQuery, falling back to the user.
+    """
+    chat = getattr(update, "chat", None) or getattr(getattr(update, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "from_user", None)
+    return user.id if user else None
+
+
+class TokenBucket:
+    """
+    Allows ``capacity`` actions at once, refilled at ``rate`` actions per second.
+    """
+
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self) -> bool:
+        self.refill(time.monotonic())
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class _Task:
+    __slots__ = ("handler_name", "update", "run", "on_shed", "lane", "chat_id", "enqueued_at")
+
+    def __init__(self, handler_name, update, run, on_shed, lane=CHEAP):
+        self.handler_name = handler_name
+        self.update = update
+        self.run = run
+        self.on_shed = on_shed
+        self.lane = lane
+        self.chat_id = update_chat_id(update)
+        self.enqueued_at = time.monotonic()
+
+
+class Scheduler:
+    """
+    Runs handlers on a worker pool with two lanes.
+
+    Cheap interactions (/start, ratings, page updates) go to the high-priority lane and are always taken first.
+    Expensive intents (EXPENSIVE_HANDLERS) go to the low-priority lane, may use at most ``expensive_concurrency``
+    workers, are limited per chat by a token bucket, and are shed with a friendly busy reply once too many are waiting
+    or they wait too long.
+
+    A chat's updates are handled in the order they arrived: at most one task per chat is in a lane or running, and the
+    chat's later tasks wait in its backlog until that one is done, whatever their lane.
+
+    In ``inline`` mode (sharding workers, which must keep a chat's updates in order) handlers run in the caller's
+    thread and only the per-chat token buckets apply.
+    """
+
+    def __init__(self, on_shed=None, workers: int = SCHEDULER_WORKERS,
+                 expensive_concurrency: int = EXPENSIVE_CONCURRENCY, inline: bool = False):
+        """
+        Args:
+            on_shed: Called as ``on_shed(update, reason)`` when an expensive task is refused.
+            workers (int): Worker threads.
+            expensive_concurrency (int): Workers expensive tasks may occupy at the same time.
+            inline (bool): Run handlers in the caller's thread instead of the pool.
+        """
+        self.on_shed = on_shed
+        self.workers = workers
+        self.expensive_concurrency = min(expensive_concurrency, workers)
+        self.inline = inline
+        self.lanes = {CHEAP: collections.deque(), EXPENSIVE: collections.deque()}
+        self.running_expensive = 0
+        # Chats with a task in a lane or running, and their tasks waiting for it in arrival order
+        self.chat_backlogs = {}
+        self.condition = threading.Condition()
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.threads = []
+
+    def start(self) -> None:
+        """
+        Starts the worker threads. Without them tasks are run inline.
+        """
+        if self.inline or self.threads:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"scheduler-{number}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def schedule(self, handler_name: str):
+        """
+        Decorator submitting every call of a handler to the scheduler instead of running it directly.
+        """
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(update, *args, **kwargs):
+                self.submit(handler_name, update, lambda: handler(update, *args, **kwargs))
+            return wrapper
+        return decorator
+
+    def submit(self, handler_name: str, update, run, on_shed=None) -> bool:
+        """
+        Queues (or, inline, runs) a handler task.
+
+        Args:
+            handler_name (str): The handler or conversation step, which decides the lane.
+            update: The Message or CallbackQuery being handled.
+            run: Zero-argument callable doing the work.
+            on_shed: Called as ``on_shed(update, reason)`` instead of the scheduler's default if the task is refused.
+
+        Returns:
+            bool: False if the task was refused right away.
+        """
+        on_shed = on_shed or self.on_shed
+        lane = EXPENSIVE if handler_name in EXPENSIVE_HANDLERS else CHEAP
+        if lane == EXPENSIVE and not self._take_token(update_chat_id(update)):
+            self._shed(_Task(handler_name, update, run, on_shed), RATE_LIMITED)
+            return False
+        if self.inline or not self.threads:
+            run()
+            return True
+        task = _Task(handler_name, update, run, on_shed, lane)
+        reason = None
+        with self.condition:
+            waiting = self.lanes[lane]
+            backlog = self.chat_backlogs.get(task.chat_id)
+            if backlog is not None:
+                # Runs once the chat's earlier tasks are done
+                backlog.append(task)
+            elif lane == EXPENSIVE and len(waiting) >= MAX_EXPENSIVE_QUEUE:
+                reason = QUEUE_FULL
+            elif lane == EXPENSIVE and waiting and task.enqueued_at - waiting[0].enqueued_at > MAX_QUEUE_WAIT_SECONDS:
+                reason = QUEUE_LATENCY
+            else:
+                if task.chat_id is not None:
+                    self.chat_backlogs[task.chat_id] = collections.deque()
+                waiting.append(task)
+                QUEUE_DEPTH.set(len(waiting), lane=lane)
+                self.condition.notify()
+        if reason:
+            # The busy reply is sent outside the lock
+            self._shed(task, reason)
+            return False
+        return True
+
+    def _take_token(self, chat_id: int | None) -> bool:
+        if chat_id is None:
+            return True
+        with self.buckets_lock:
+            bucket = self.buckets.get(chat_id)
+            if bucket is None:
+                if len(self.buckets) >= MAX_BUCKETS:
+                    self._drop_idle_buckets()
+                bucket = self.buckets[chat_id] = TokenBucket(EXPENSIVE_BURST, EXPENSIVE_PER_MINUTE / 60)
+            return bucket.try_take()
+
+    def _drop_idle_buckets(self) -> None:
+        now = time.monotonic()
+        for chat_id, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[chat_id]
+
+    def _shed(self, task: _Task, reason: str) -> None:
+        SHED_TASKS.inc(reason=reason)
+        log_event(logger, logging.WARNING, "handler_shed", handler=task.handler_name, reason=reason,
+                  chat_id=update_chat_id(task.update))
+        if task.on_shed:
+            try:
+                task.on_shed(task.update, reason)
+            except Exception as e:
+                log_event(logger, logging.ERROR, "busy_reply_failed", handler=task.handler_name, error=repr(e))
+
+    def _finish_task(self, task: _Task) -> None:
+        with self.condition:
+            if task.lane == EXPENSIVE:
+                self.running_expensive -= 1
+            if task.chat_id is not None:
+                backlog = self.chat_backlogs[task.chat_id]
+                if backlog:
+                    # Ahead of other chats' tasks: it has already waited for its own chat
+                    following = backlog.popleft()
+                    self.lanes[following.lane].appendleft(following)
+                    QUEUE_DEPTH.set(len(self.lanes[following.lane]), lane=following.lane)
+                else:
+                    del self.chat_backlogs[task.chat_id]
+            self.condition.notify()
+
+    def _next_task(self) -> tuple:
+        with self.condition:
+            while True:
+                if self.lanes[CHEAP]:
+                    lane = CHEAP
+                    break
+                if self.lanes[EXPENSIVE] and self.running_expensive < self.expensive_concurrency:
+                    lane = EXPENSIVE
+                    self.running_expensive += 1
+                    break
+                self.condition.wait()
+            task = self.lanes[lane].popleft()
+            QUEUE_DEPTH.set(len(self.lanes[lane]), lane=lane)
+            return lane, task
+
+    def _work(self) -> None:
+        while True:
+            lane, task = self._next_task()
+            waited = time.monotonic() - task.enqueued_at
+            QUEUE_WAIT.observe(waited, lane=lane)
+            try:
+                if lane == EXPENSIVE and waited > MAX_QUEUE_WAIT_SECONDS:
+                    # The user has waited long enough; answer now instead of after the slow work
+                    self._shed(task, QUEUE_LATENCY)
+                else:
+                    task.run()
+            except Exception as e:
+                log_event(logger, logging.ERROR, "scheduled_handler_failed", handler=task.handler_name, error=repr(e))
+            finally:
+                self._finish_task(task)
@@ -0,0 +1,441 @@
+import bisect
+import collections
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from dotenv import load_dotenv
+from db_maintenance import DatabaseMaintenance
+from metrics import start_metrics_server
+from structured_logging import configure_logging, log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Number of worker processes; 1 keeps the classic single polling process (see main.py)
+WORKER_COUNT = int(os.getenv("MYSCRIBE_WORKERS", 1))
+# Updates waiting per worker before the ingress blocks, so a slow worker slows polling instead of eating memory
+WORKER_QUEUE_SIZE = int(os.getenv("MYSCRIBE_WORKER_QUEUE_SIZE", 1000))
+# "polling" or "webhook"
+INGRESS_MODE = os.getenv("MYSCRIBE_INGRESS", "polling")
+WEBHOOK_HOST = os.getenv("MYSCRIBE_WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("MYSCRIBE_WEBHOOK_PORT", 8443))
+WEBHOOK_SECRET = os.getenv("MYSCRIBE_WEBHOOK_SECRET")
+# Points per worker on the hash ring; more points spread chats more evenly
+VIRTUAL_NODES = 64
+# Signals asking a running ingress for one worker more or one less, as with gunicorn
+ADD_WORKER_SIGNAL, REMOVE_WORKER_SIGNAL = signal.SIGTTIN, signal.SIGTTOU
+# How often drain checks whether the workers are done
+DRAIN_POLL_SECONDS = 0.1
+
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping chat ids to worker names.
+
+    Adding or removing a worker only moves the chats that hash next to its points (about 1/N of them); every other
+    chat keeps its worker.
+    """
+
+    def __init__(self, nodes=(), virtual_nodes: int = VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self.points = []
+        self.owners = []
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self) -> set:
+        return set(self.owners)
+
+    def add_node(self, node: str) -> None:
+        for replica in range(self.virtual_nodes):
+            point = _ring_hash(f"{node}#{replica}")
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove_node(self, node: str) -> None:
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def node_for(self, key) -> str:
+        """
+        Returns the worker owning the key.
+
+        Raises:
+            LookupError: If the ring is empty.
+        """
+        if not self.points:
+            raise LookupError("The hash ring has no workers")
+        index = bisect.bisect(self.points, _ring_hash(str(key))) % len(self.points)
+        return self.owners[index]
+
+
+def update_chat_id(update: dict) -> int | None:
+    """
+    Extracts the chat an incoming Bot API update belongs to.
+
+    Callback queries belong to the chat of the message their keyboard is attached to; updates without a chat
+    (inline queries, poll answers, ...) fall back to the user.
+
+    Args:
+        update (dict): The raw JSON update.
+
+    Returns:
+        int | None: The chat id, or None if the update names neither a chat nor a user.
+    """
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        if "chat" in value:
+            return value["chat"]["id"]
+        message = value.get("message")
+        if isinstance(message, dict) and "chat" in message:
+            return message["chat"]["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return None
+
+
+def worker_metrics_port(name: str) -> int | None:
+    """
+    The port a worker serves its metrics on, after the ingress's MYSCRIBE_METRICS_PORT; None if metrics are off.
+    """
+    port = os.getenv("MYSCRIBE_METRICS_PORT")
+    if not port:
+        return None
+    return int(port) + 1 + int(name.rsplit("-", 1)[-1])
+
+
+class WorkerQueue:
+    """
+    A worker's bounded update queue, with the count of updates the worker finished.
+
+    The ingress counts what it puts in, the worker what it is done with, so the ingress knows how many updates are in
+    flight. Unlike ``JoinableQueue.join``, the count is repaired when a worker dies in the middle of an update, see
+    ``count_lost``.
+    """
+
+    def __init__(self, maxsize: int):
+        self.updates = multiprocessing.Queue(maxsize)
+        self.handled = multiprocessing.Value("Q", 0)
+        # Only maintained in the ingress process
+        self.dispatched = 0
+
+    def put(self, update: dict | None) -> None:
+        """
+        Queues an update, or None to stop the worker once it is done with the others.
+        """
+        self.updates.put(update)
+        self.dispatched += 1
+
+    def get(self) -> dict | None:
+        return self.updates.get()
+
+    def task_done(self) -> None:
+        """
+        Called by the worker once it is done with an update it got.
+        """
+        with self.handled.get_lock():
+            self.handled.value += 1
+
+    def in_flight(self) -> int:
+        """
+        Updates queued or being handled.
+        """
+        return self.dispatched - self.handled.value
+
+    def count_lost(self) -> int:
+        """
+        After the worker died, counts the update it had taken off the queue without finishing as done: the update is
+        lost with the worker and must not keep ``drain`` waiting.
+
+        Returns:
+            int: The number of updates lost.
+        """
+        with self.handled.get_lock():
+            lost = self.dispatched - self.handled.value - self.updates.qsize()
+            self.handled.value += lost
+        return lost
+
+
+def run_worker(updates: WorkerQueue, name: str) -> None:
+    """
+    Worker process: builds its own bot and handles the updates the ingress routes to it, one at a time.
+
+    Updates are handled in arrival order, which keeps every chat's messages in order; parallelism comes from the
+    number of workers.
+    """
+    from telebot import types
+    from application import Application
+    from reminders import REMINDERS_PER_SECOND
+
+    configure_logging()
+    chatbot = Application().chatbot
+    chatbot.register_handlers()
+    chatbot.book_database.load_title_index(background=True)
+    # Stored reading estimates are refreshed if a release changed the constants they are computed with
+    chatbot.book_database.recompute_time_left_if_stale(background=True)
+    # Handle updates inline instead of on telebot's thread pool, which would reorder a chat's messages
+    chatbot.bot.threaded = False
+    # Every worker also runs background jobs; each job is claimed by exactly one of them
+    chatbot.register_jobs()
+    chatbot.job_queue.start()
+    # Reminders are claimed before sending, so workers never send one twice; they split the rate limit
+    chatbot.start_reminders(per_second=REMINDERS_PER_SECOND / max(1, WORKER_COUNT))
+    # Handler metrics are per process: worker N serves them on MYSCRIBE_METRICS_PORT + 1 + N
+    start_metrics_server(worker_metrics_port(name))
+    log_event(logger, logging.INFO, "worker_started", worker=name, pid=os.getpid())
+    while True:
+        raw_update = updates.get()
+        try:
+            if raw_update is None:
+                return
+            chatbot.bot.process_new_updates([types.Update.de_json(raw_update)])
+        except Exception as e:
+            log_event(logger, logging.ERROR, "worker_update_failed", worker=name,
+                      update_id=raw_update.get("update_id"), error=repr(e))
+        finally:
+            updates.task_done()
+
+
+class ShardedIngress:
+    """
+    Receives Telegram updates in one process and routes each one, by chat id, to one of several worker processes.
+
+    Each worker has its own bounded queue, and a chat is always routed to the same worker while the set of workers
+    is unchanged, so per-chat ordering is kept. Workers are placed on a consistent hash ring; ``add_worker`` and
+    ``remove_worker`` first wait for all queues to drain so no chat has updates in flight on two workers. A running
+    ingress adds a worker on ADD_WORKER_SIGNAL and removes one on REMOVE_WORKER_SIGNAL, between two updates.
+
+    Conversation state lives in the conversation store and button context in the callback data, so a chat that moves
+    to another worker continues where it left off.
+    """
+
+    def __init__(self, workers: int = WORKER_COUNT, worker_target=run_worker, worker_args: tuple = (),
+                 queue_size: int = WORKER_QUEUE_SIZE):
+        """
+        Args:
+            workers (int): Number of worker processes to start.
+            worker_target: Function run in each worker as ``worker_target(queue, name, *worker_args)``.
+            worker_args (tuple): Extra arguments for ``worker_target``.
+            queue_size (int): Updates waiting per worker before ``dispatch`` blocks.
+        """
+        self.worker_target = worker_target
+        self.worker_args = worker_args
+        self.queue_size = queue_size
+        self.queues = {}
+        self.processes = {}
+        self.ring = HashRing()
+        self.next_worker_number = 0
+        self.dispatched = 0
+        # +1 or -1 per requested worker change, see request_scaling
+        self.scaling_requests = collections.deque()
+        for _ in range(workers):
+            self._start_worker()
+
+    def _start_worker(self, name: str | None = None) -> str:
+        if name is None:
+            name = f"worker-{self.next_worker_number}"
+            self.next_worker_number += 1
+        updates = self.queues.get(name) or WorkerQueue(self.queue_size)
+        process = multiprocessing.Process(target=self.worker_target, args=(updates, name, *self.worker_args),
+                                          name=f"myscribe-{name}", daemon=True)
+        process.start()
+        self.queues[name] = updates
+        self.processes[name] = process
+        if name not in self.ring.nodes:
+            self.ring.add_node(name)
+        return name
+
+    def dispatch(self, update: dict) -> str:
+        """
+        Routes one raw update to the worker owning its chat.
+
+        Returns:
+            str: The name of the worker.
+        """
+        chat_id = update_chat_id(update)
+        name = self.ring.node_for(chat_id if chat_id is not None else update.get("update_id"))
+        self.queues[name].put(update)
+        self.dispatched += 1
+        return name
+
+    def drain(self) -> None:
+        """
+        Blocks until every routed update has been handled, restarting workers that die meanwhile; the update a dead
+        worker was handling is lost with it.
+        """
+        while True:
+            self.restart_dead_workers()
+            if not any(updates.in_flight() for updates in self.queues.values()):
+                return
+            time.sleep(DRAIN_POLL_SECONDS)
+
+    def add_worker(self) -> str:
+        """
+        Starts one more worker; about 1/N of the chats move to it.
+        """
+        self.drain()
+        name = self._start_worker()
+        log_event(logger, logging.INFO, "worker_added", worker=name, workers=len(self.processes))
+        return name
+
+    def remove_worker(self, name: str | None = None) -> str:
+        """
+        Stops a worker (the newest one by default) after it finished its queue; its chats spread over the others.
+        """
+        if len(self.processes) <= 1:
+            raise ValueError("Cannot remove the last worker")
+        name = name or max(self.processes, key=lambda worker: int(worker.rsplit("-", 1)[1]))
+        self.drain()
+        self.ring.remove_node(name)
+        self.queues.pop(name).put(None)
+        self.processes.pop(name).join()
+        log_event(logger, logging.INFO, "worker_removed", worker=name, workers=len(self.processes))
+        return name
+
+    def restart_dead_workers(self) -> None:
+        """
+        Restarts workers that exited unexpectedly; their queued updates are kept.
+        """
+        for name, process in list(self.processes.items()):
+            if not process.is_alive():
+                log_event(logger, logging.ERROR, "worker_died", worker=name, exitcode=process.exitcode,
+                          lost_updates=self.queues[name].count_lost())
+                self._start_worker(name)
+
+    def request_scaling(self, change: int) -> None:
+        """
+        Asks for one worker more (+1) or one less (-1). Only records the request, so it is safe in a signal handler;
+        ``service_actions`` applies it between two updates.
+        """
+        self.scaling_requests.append(change)
+
+    def service_actions(self) -> None:
+        """
+        Restarts dead workers and applies requested worker changes. Run by the ingress loop between updates.
+        """
+        self.restart_dead_workers()
+        while self.scaling_requests:
+            change = self.scaling_requests.popleft()
+            try:
+                if change > 0:
+                    self.add_worker()
+                else:
+                    self.remove_worker()
+            except ValueError as e:
+                log_event(logger, logging.WARNING, "worker_change_refused", error=str(e))
+
+    def close(self) -> None:
+        """
+        Lets every worker finish its queue, then stops it.
+        """
+        for updates in self.queues.values():
+            updates.put(None)
+        for process in self.processes.values():
+            process.join()
+        self.queues.clear()
+        self.processes.clear()
+
+    def poll(self, token: str, long_polling_timeout: int = 20) -> None:
+        """
+        Long-polls getUpdates forever and routes every update.
+
+        Args:
+            token (str): The bot token.
+            long_polling_timeout (int): Seconds Telegram holds a getUpdates request open.
+        """
+        from telebot import apihelper
+
+        # Polling and a webhook are mutually exclusive on Telegram's side
+        apihelper.delete_webhook(token)
+        offset = None
+        while True:
+            try:
+                updates = apihelper.get_updates(token, offset=offset, timeout=long_polling_timeout + 5,
+                                                long_polling_timeout=long_polling_timeout)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "ingress_poll_failed", error=repr(e))
+                time.sleep(3)
+                continue
+            self.service_actions()
+            for update in updates:
+                self.dispatch(update)
+                offset = update["update_id"] + 1
+
+    def serve_webhook(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, secret: str | None = WEBHOOK_SECRET):
+        """
+        Receives updates pushed by Telegram and routes them. The webhook URL itself is registered with Telegram
+        separately (setWebhook), typically behind a TLS-terminating reverse proxy.
+
+        Args:
+            host (str): Interface to bind.
+            port (int): Port to listen on.
+            secret (str | None): Expected X-Telegram-Bot-Api-Secret-Token header, if one was set with setWebhook.
+        """
+        ingress = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if secret and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    ingress.dispatch(json.loads(body))
+                except ValueError:
+                    self.send_response(400)
+                else:
+                    self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        # One request at a time: updates are routed in the order Telegram delivered them, which keeps every chat's
+        # updates in order. The serving loop restarts crashed workers and adds or removes workers between requests
+        server = HTTPServer((host, port), WebhookRequestHandler)
+        server.service_actions = self.service_actions
+        server.serve_forever()
+
+
+def run_sharded(workers: int = WORKER_COUNT, mode: str = INGRESS_MODE) -> None:
+    """
+    Runs the bot as one ingress process and ``workers`` worker processes.
+
+    Args:
+        workers (int): Number of worker processes.
+        mode (str): "polling" or "webhook".
+    """
+    configure_logging()
+    ingress = ShardedIngress(workers)
+    # kill -TTIN / -TTOU <ingress pid> adds or removes a worker
+    signal.signal(ADD_WORKER_SIGNAL, lambda signum, frame: ingress.request_scaling(1))
+    signal.signal(REMOVE_WORKER_SIGNAL, lambda signum, frame: ingress.request_scaling(-1))
+    # The workers share one database; the ingress process keeps it maintained
+    DatabaseMaintenance().start()
+    # Routing, queue and maintenance metrics of the ingress; each worker serves its own on the next ports
+    start_metrics_server()
+    log_event(logger, logging.INFO, "ingress_started", mode=mode, workers=workers)
+    try:
+        if mode == "webhook":
+            ingress.serve_webhook()
+        else:
+            from telegram_bot import TelegramBot
+            ingress.poll(TelegramBot.TOKEN)
+    finally:
+        ingress.close()
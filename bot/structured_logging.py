@@ -0,0 +1,153 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("MYSCRIBE_LOG_LEVEL", "INFO").upper()
+# Comma separated event=rate pairs, e.g. "book_id_retrieved=0.01,volume_info=0.1"
+LOG_SAMPLING = os.getenv("MYSCRIBE_LOG_SAMPLING", "")
+
+# Identifies the Telegram update being handled, so every log line it causes can be tied together.
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+_listener = None
+
+
+def parse_sampling_rates(setting: str) -> dict:
+    """
+    Parses the MYSCRIBE_LOG_SAMPLING setting into a mapping of event name to the fraction of events kept.
+    """
+    rates = {}
+    for pair in setting.split(","):
+        if "=" in pair:
+            event, rate = pair.split("=", 1)
+            rates[event.strip()] = float(rate)
+    return rates
+
+
+class CorrelationFilter(logging.Filter):
+    """
+    Stamps each record with the correlation id of the update being handled in the calling thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a configured fraction of records per event. Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.msg)
+        return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": round(record.created, 3),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "event": record.getMessage(),
+                 "correlation_id": getattr(record, "correlation_id", None)}
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL, sampling: str = LOG_SAMPLING, stream=None) -> None:
+    """
+    Routes all logging through a queue so handlers never block on stderr.
+
+    Records are filtered, stamped and queued in the calling thread; a background listener formats them as JSON and
+    writes them out. Calling it more than once has no effect.
+
+    Args:
+        level (str): Minimum level to log.
+        sampling (str): Per-event sampling rates, see MYSCRIBE_LOG_SAMPLING.
+        stream: Where the listener writes, stderr by default.
+    """
+    global _listener
+    if _listener:
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sampling_rates(sampling)))
+    queue_handler.addFilter(CorrelationFilter())
+
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    # Flush what is still queued when the bot shuts down
+    atexit.register(_listener.stop)
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields) -> None:
+    """
+    Logs a structured event. Nothing is built or queued if the level is disabled.
+
+    Args:
+        logger (logging.Logger): The module's logger.
+        level (int): A logging level such as ``logging.DEBUG``.
+        event (str): Short snake_case event name, also used as the sampling key.
+        **fields: Extra key/value pairs written with the event.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def with_correlation_id(handler):
+    """
+    Decorator binding a correlation id for the Telegram message, callback query or inline query a handler receives.
+    """
+    @functools.wraps(handler)
+    def wrapper(update, *args, **kwargs):
+        if hasattr(update, "data"):
+            # Callback query
+            update_key = f"cq{update.id}"
+        elif hasattr(update, "query") and hasattr(update, "offset"):
+            # Inline query
+            update_key = f"iq{update.id}"
+        elif hasattr(update, "chat"):
+            update_key = f"{update.chat.id}-{update.message_id}"
+        else:
+            update_key = f"t{time.time_ns()}"
+        token = correlation_id.set(update_key)
+        try:
+            return handler(update, *args, **kwargs)
+        finally:
+            correlation_id.reset(token)
+    return wrapper
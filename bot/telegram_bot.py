@@ -1,10 +1,37 @@
 import os
 
-from telebot import TeleBot, types, util
+import requests
+from telebot import TeleBot, apihelper, types, util
 from dotenv import load_dotenv
+from callback_data import encode_callback
+from metrics import track_dependency
 
 load_dotenv()
 
+# Keeps connections to api.telegram.org alive between sends.
+_telegram_session = requests.Session()
+
+
+def send_instrumented_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Sends a Bot API request while recording its latency under the Bot API method name (sendMessage, sendPhoto, ...).
+
+    Installed as ``telebot.apihelper.CUSTOM_REQUEST_SENDER`` so every call made by the bot goes through it.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The Bot API URL, ending with the Bot API method name.
+        **kwargs: Passed through to ``requests``.
+
+    Returns:
+        requests.Response: The Bot API response.
+    """
+    with track_dependency("telegram", url.rsplit("/", 1)[-1]):
+        return _telegram_session.request(method, url, **kwargs)
+
+
+apihelper.CUSTOM_REQUEST_SENDER = send_instrumented_request
+
 
 class TelegramBot:
     """
@@ -12,13 +39,11 @@ class TelegramBot:
 
     Attributes:
         bot (telebot.TeleBot): The underlying Telegram bot instance.
-        reading_book_markup (telebot.types.ReplyKeyboardMarkup): Keyboard markup used
-            for the reading book confirmation dialogue.
-        confirm_book_markup (telebot.types.ReplyKeyboardMarkup): Keyboard markup used
-            for confirming book details.
 
     Methods:
         __init__(self): Initializes the bot with the bot token and parses mode.
+        done_reading_button, new_book_markup, confirm_book_markup, recommendation_markup: Build inline keyboards
+            whose callback data encodes the context of the click.
     """
     TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
@@ -29,19 +54,61 @@ class TelegramBot:
             'Enter Reading Speed': {'callback_data': 'next_book'},
             'Use Average Reading Speed (240WPM)': {'callback_data': 'enter_author_name'}
         }, row_width=1)
-        self.done_reading_button = util.quick_markup({
-            "Done !!": {"callback_data": "reading_done"}
+
+    # Inline keyboards carry their own context (see callback_data), so any bot process can handle a click.
+    def done_reading_button(self, started_at: int) -> types.InlineKeyboardMarkup:
+        """
+        Keyboard of the reading speed test, carrying the time the paragraph was sent.
+
+        Args:
+            started_at (int): Unix time at which the user started reading.
+        """
+        return util.quick_markup({
+            "Done !!": {"callback_data": encode_callback("reading_done", cursor=started_at)}
         }, row_width=1)
-        self.new_book_markup = util.quick_markup({
-            'Yes': {'callback_data': 'confirm_book_details'},
-            'Next': {'callback_data': 'get_next_book_details'}
+
+    def new_book_markup(self, result_index: int, search_id: int | None = None) -> types.InlineKeyboardMarkup:
+        """
+        Keyboard shown under a book found in the API.
+
+        Args:
+            result_index (int): Index of the shown API search result.
+            search_id (int | None): The chat's stored search the result belongs to.
+        """
+        return util.quick_markup({
+            'Yes': {'callback_data': encode_callback("confirm_book_details", cursor=result_index,
+                                                     search_id=search_id)},
+            'Next': {'callback_data': encode_callback("get_next_book_details", cursor=result_index,
+                                                      search_id=search_id)}
         }, row_width=2)
-        self.confirm_book_markup = util.quick_markup({
-            'Change Genre': {'callback_data': 'change_genre'},
-            'Change Language': {'callback_data': 'change_language'},
-            'Everything Looks Good!': {'callback_data': 'no_change_req'},
+
+    def confirm_book_markup(self, result_index: int | None = None,
+                            search_id: int | None = None) -> types.InlineKeyboardMarkup:
+        """
+        Keyboard for reviewing the details of a new book before it is saved.
+
+        Args:
+            result_index (int | None): Index of the API search result being reviewed.
+            search_id (int | None): The chat's stored search the result belongs to.
+        """
+        return util.quick_markup({
+            'Change Genre': {'callback_data': encode_callback("change_genre", cursor=result_index,
+                                                              search_id=search_id)},
+            'Change Language': {'callback_data': encode_callback("change_language", cursor=result_index,
+                                                                 search_id=search_id)},
+            'Everything Looks Good!': {'callback_data': encode_callback("no_change_req", cursor=result_index,
+                                                                        search_id=search_id)},
         }, row_width=2)
-        self.recommendation_markup = util.quick_markup({
-            'Wishlist': {'callback_data': 'recommendation_wishlist'},
-            'Next Recommendation': {'callback_data': 'recommendation_next_book'},
+
+    def recommendation_markup(self, book_id: int | None = None, cursor: int | None = None) -> types.InlineKeyboardMarkup:
+        """
+        Keyboard shown under a recommendation.
+
+        Args:
+            book_id (int | None): The recommended book, when it is in the database.
+            cursor (int | None): Index of the shown recommendation.
+        """
+        return util.quick_markup({
+            'Wishlist': {'callback_data': encode_callback("recommendation_wishlist", book_id, cursor)},
+            'Next Recommendation': {'callback_data': encode_callback("recommendation_next_book", book_id, cursor)},
         }, row_width=1)
@@ -0,0 +1,227 @@
+import bisect
+import collections
+import functools
+import logging
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Suggestions returned per search; Telegram shows at most 50 inline results
+TITLE_SEARCH_LIMIT = int(os.getenv("MYSCRIBE_TITLE_SEARCH_LIMIT", 10))
+# Prefix matches ranked per search. Short prefixes ("t") match most of the catalogue; only the first ones are ranked
+MAX_PREFIX_CANDIDATES = 500
+# Trigrams shared by more books than this ("the", "ing") say little about a typo and are skipped
+MAX_TRIGRAM_BOOKS = 2000
+# Share of the query's trigrams a book needs for a fuzzy match
+MIN_TRIGRAM_SIMILARITY = 0.5
+# Searches slower than this are logged
+SEARCH_BUDGET_SECONDS = 0.01
+
+TITLE_SEARCH_LATENCY = REGISTRY.histogram("myscribe_title_search_seconds", "Latency of title autocomplete searches.",
+                                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05))
+TITLE_INDEX_BOOKS = REGISTRY.gauge("myscribe_title_index_books", "Books held in the title autocomplete index.")
+
+NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text: str | None) -> str:
+    """
+    Lower-cases the text and collapses punctuation and whitespace into single spaces.
+    """
+    return NON_WORD.sub(" ", (text or "").lower()).strip()
+
+
+@functools.lru_cache(maxsize=65536)
+def word_trigrams(word: str) -> frozenset:
+    padded = f"  {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def trigrams(text: str) -> set:
+    """
+    The three-character substrings of every word in an already normalized text, padded so word starts count.
+    """
+    found = set()
+    for word in text.split():
+        found |= word_trigrams(word)
+    return found
+
+
+class IndexedBook:
+    """
+    A book as the title index knows it.
+    """
+
+    __slots__ = ("book_id", "title", "author", "readers")
+
+    def __init__(self, book_id: int, title: str, author: str, readers: int):
+        self.book_id = book_id
+        self.title = title
+        self.author = author
+        self.readers = readers
+
+    def as_dict(self) -> dict:
+        return {"book_id": self.book_id, "title": self.title, "author": self.author, "readers": self.readers}
+
+
+class TitleIndex:
+    """
+    In-memory autocomplete over the titles and authors in the ``books`` table, used to answer inline queries without
+    touching the database or the Books API.
+
+    Every word of a title or author starts a key in a sorted list, so any prefix of a title, of a later part of it
+    ("rings" for "the lord of the rings") or of the author's name is found with a binary search. Queries that match
+    no key, usually because of a typo, fall back to books sharing most of the query's trigrams. Matches are ranked by
+    how many users track the book.
+
+    The index is filled once at startup (``BookDatabase.load_title_index``, in the background since it takes a few
+    seconds for 100k books) and then kept up to date by the same process's book inserts and new readers. Other
+    processes' inserts are picked up by reloading.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.books = {}
+        # Sorted (key, book_id) pairs, a key being a title or author from one of its words to the end
+        self.keys = []
+        self.trigram_books = collections.defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self.books)
+
+    @staticmethod
+    def _keys(book: IndexedBook) -> tuple:
+        """
+        The book's autocomplete keys and trigrams.
+        """
+        keys, book_trigrams = set(), set()
+        for text in (normalize(book.title), normalize(book.author)):
+            words = text.split(" ")
+            keys.update(" ".join(words[i:]) for i in range(len(words)) if words[i])
+            book_trigrams |= trigrams(text)
+        return keys, book_trigrams
+
+    def load(self, rows) -> None:
+        """
+        Replaces the index content.
+
+        Args:
+            rows: ``(book_id, title, author, readers)`` tuples, ``readers`` being the number of users tracking it.
+        """
+        start = time.perf_counter()
+        books, keys, trigram_books = {}, [], collections.defaultdict(set)
+        for book_id, title, author, readers in rows:
+            book = books[book_id] = IndexedBook(book_id, title, author or "", readers or 0)
+            book_keys, book_trigrams = self._keys(book)
+            keys.extend((key, book_id) for key in book_keys)
+            for trigram in book_trigrams:
+                trigram_books[trigram].add(book_id)
+        keys.sort()
+        with self.lock:
+            # Books added while the rows were indexed are not in them
+            added = [book for book_id, book in self.books.items() if book_id not in books]
+            self.books, self.keys, self.trigram_books = books, keys, trigram_books
+            for book in added:
+                self._insert(book)
+        TITLE_INDEX_BOOKS.set(len(books))
+        log_event(logger, logging.INFO, "title_index_loaded", books=len(books), keys=len(keys),
+                  duration_ms=round((time.perf_counter() - start) * 1000, 1))
+
+    def add(self, book_id: int, title: str, author: str | None, readers: int = 0) -> None:
+        """
+        Adds a newly stored book, or updates the title and author of a known one.
+        """
+        with self.lock:
+            if book_id in self.books:
+                self._remove(book_id)
+            self._insert(IndexedBook(book_id, title, author or "", readers))
+        TITLE_INDEX_BOOKS.set(len(self.books))
+
+    def _insert(self, book: IndexedBook) -> None:
+        self.books[book.book_id] = book
+        book_keys, book_trigrams = self._keys(book)
+        for key in book_keys:
+            bisect.insort(self.keys, (key, book.book_id))
+        for trigram in book_trigrams:
+            self.trigram_books[trigram].add(book.book_id)
+
+    def _remove(self, book_id: int) -> None:
+        book_keys, book_trigrams = self._keys(self.books.pop(book_id))
+        for key in book_keys:
+            position = bisect.bisect_left(self.keys, (key, book_id))
+            if position < len(self.keys) and self.keys[position] == (key, book_id):
+                del self.keys[position]
+        for trigram in book_trigrams:
+            self.trigram_books[trigram].discard(book_id)
+
+    def add_reader(self, book_id: int) -> None:
+        """
+        Counts one more user tracking the book.
+        """
+        with self.lock:
+            book = self.books.get(book_id)
+            if book is not None:
+                book.readers += 1
+
+    def _prefix_matches(self, query: str) -> list:
+        matches = set()
+        position = bisect.bisect_left(self.keys, (query,))
+        while position < len(self.keys) and len(matches) < MAX_PREFIX_CANDIDATES:
+            key, book_id = self.keys[position]
+            if not key.startswith(query):
+                break
+            matches.add(book_id)
+            position += 1
+        return [self.books[book_id] for book_id in matches]
+
+    def _fuzzy_matches(self, query: str, exclude: set) -> list:
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+        shared = collections.Counter()
+        for trigram in query_trigrams:
+            book_ids = self.trigram_books.get(trigram)
+            if book_ids and len(book_ids) <= MAX_TRIGRAM_BOOKS:
+                shared.update(book_ids)
+        needed = MIN_TRIGRAM_SIMILARITY * len(query_trigrams)
+        scored = [(count, self.books[book_id]) for book_id, count in shared.items()
+                  if count >= needed and book_id not in exclude]
+        scored.sort(key=lambda match: (-match[0], -match[1].readers, len(match[1].title)))
+        return [book for _, book in scored]
+
+    def search(self, query: str, limit: int = TITLE_SEARCH_LIMIT) -> list:
+        """
+        Suggests stored books for what the user typed so far.
+
+        Args:
+            query (str): Part of a title or author, possibly misspelled.
+            limit (int): Most suggestions returned.
+
+        Returns:
+            list: Dicts with ``book_id``, ``title``, ``author`` and ``readers``; prefix matches first, most tracked
+            first, then fuzzy matches. Empty for an empty query.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        start = time.perf_counter()
+        with self.lock:
+            books = self._prefix_matches(query)
+            books.sort(key=lambda book: (-book.readers, len(book.title)))
+            if len(books) < limit and len(query) >= 3:
+                books += self._fuzzy_matches(query, {book.book_id for book in books})
+            results = [book.as_dict() for book in books[:limit]]
+        duration = time.perf_counter() - start
+        TITLE_SEARCH_LATENCY.observe(duration)
+        if duration > SEARCH_BUDGET_SECONDS:
+            log_event(logger, logging.WARNING, "title_search_slow", query=query, books=len(self.books),
+                      duration_ms=round(duration * 1000, 2))
+        return results
@@ -0,0 +1,187 @@
+import contextvars
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from metrics import REGISTRY
+from structured_logging import log_event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Telegram keeps undelivered updates for 24 hours, so older ids can never come back
+LEDGER_RETENTION_SECONDS = int(os.getenv("MYSCRIBE_LEDGER_RETENTION", 48 * 60 * 60))
+# How many recorded updates happen between two prunes of the ledger
+PRUNE_EVERY = 1000
+
+CLAIM_SQL = "INSERT INTO processed_updates (update_id, processed_at) VALUES (?,?)"
+
+DUPLICATE_UPDATES = REGISTRY.counter("myscribe_duplicate_updates_total",
+                                     "Redelivered Telegram updates that were dropped.", ("stage",))
+
+# The update the current handler is processing, see UpdateLedger.track
+current_update = contextvars.ContextVar("current_update", default=None)
+
+
+class UpdateClaim:
+    """
+    Ledger state of the update a handler is processing.
+
+    Attributes:
+        update_id (int): The Telegram update id.
+        claimed (bool): Whether a committed (or queued) write already recorded the update in the ledger.
+        duplicate (bool): Whether the ledger turned out to hold the update already, so its writes must be skipped.
+    """
+
+    __slots__ = ("update_id", "claimed", "duplicate")
+
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+        self.claimed = False
+        self.duplicate = False
+
+
+def claim_update(cursor: sqlite3.Cursor | sqlite3.Connection, update_id: int) -> bool:
+    """
+    Records the update in the ledger inside the caller's open transaction.
+
+    Returns:
+        bool: False if the update was already recorded, i.e. this is a redelivery.
+    """
+    try:
+        cursor.execute(CLAIM_SQL, (update_id, time.time()))
+    except sqlite3.IntegrityError:
+        DUPLICATE_UPDATES.inc(stage="write")
+        return False
+    return True
+
+
+class UpdateLedger:
+    """
+    Ledger of processed Telegram update ids, kept in the ``processed_updates`` table of the bot's database.
+
+    The first state change an update makes is committed in the same transaction as its ledger row (see
+    BookDatabase.execute_write), and updates that change nothing are recorded once their handler returns. A redelivered
+    update (after a crash before the polling offset was acknowledged, or delivered to two workers) is therefore
+    dropped before any handler runs, and a change is never applied twice, e.g. pages read added again.
+    Rows older than the retention are pruned periodically.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock, write_buffer=None,
+                 retention_seconds: int = LEDGER_RETENTION_SECONDS):
+        """
+        Args:
+            conn (sqlite3.Connection): BookDatabase's connection, so ledger rows share its transactions.
+            lock (threading.RLock): Lock guarding ``conn``.
+            write_buffer (WriteBehindBuffer | None): BookDatabase's group-commit buffer, if enabled.
+            retention_seconds (int): How long processed update ids are remembered.
+        """
+        self.conn = conn
+        self.lock = lock
+        self.write_buffer = write_buffer
+        self.retention_seconds = retention_seconds
+        self.records_since_prune = 0
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS processed_updates ("
+                              "update_id INTEGER PRIMARY KEY, "
+                              "processed_at REAL NOT NULL)")
+            self.conn.commit()
+
+    def processed(self, update_ids: list) -> set:
+        """
+        Returns which of the given update ids are already recorded.
+        """
+        if not update_ids:
+            return set()
+        placeholders = ",".join("?" * len(update_ids))
+        with self.lock:
+            rows = self.conn.execute(f"SELECT update_id FROM processed_updates WHERE update_id IN ({placeholders})",
+                                     list(update_ids)).fetchall()
+        return {row[0] for row in rows}
+
+    def filter_updates(self, process_new_updates):
+        """
+        Wraps ``TeleBot.process_new_updates`` so already processed updates are dropped with one query per batch, and
+        the remaining ones tag their message or callback query with ``update_id`` for ``track``.
+        """
+        @functools.wraps(process_new_updates)
+        def wrapper(updates: list) -> None:
+            seen = self.processed([update.update_id for update in updates])
+            fresh = []
+            for update in updates:
+                if update.update_id in seen:
+                    DUPLICATE_UPDATES.inc(stage="ingress")
+                    log_event(logger, logging.INFO, "duplicate_update_dropped", update_id=update.update_id)
+                    continue
+                for content in vars(update).values():
+                    if hasattr(content, "__dict__"):
+                        content.update_id = update.update_id
+                fresh.append(update)
+            if fresh:
+                process_new_updates(fresh)
+        return wrapper
+
+    def track(self, handler):
+        """
+        Decorator binding the update a handler processes, so BookDatabase claims it with the first write, and
+        recording it afterwards if the handler returned without writing anything.
+        """
+        @functools.wraps(handler)
+        def wrapper(update, *args, **kwargs):
+            update_id = getattr(update, "update_id", None)
+            if update_id is None or current_update.get() is not None:
+                return handler(update, *args, **kwargs)
+            claim = UpdateClaim(update_id)
+            token = current_update.set(claim)
+            try:
+                result = handler(update, *args, **kwargs)
+            finally:
+                current_update.reset(token)
+            # A handler that raised is not recorded, so a redelivery of the update is processed again
+            if not claim.claimed and not claim.duplicate:
+                self.record(update_id)
+            return result
+        return wrapper
+
+    def record(self, update_id: int) -> None:
+        """
+        Records an update that made no state change.
+        """
+        parameters = (update_id, time.time())
+        sql = "INSERT OR IGNORE INTO processed_updates (update_id, processed_at) VALUES (?,?)"
+        try:
+            if self.write_buffer:
+                self.write_buffer.submit(sql, parameters)
+            else:
+                with self.lock:
+                    self.conn.execute(sql, parameters)
+                    self.conn.commit()
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "update_record_failed", update_id=update_id, error=str(e))
+        self.count_recorded()
+
+    def count_recorded(self) -> None:
+        """
+        Counts one more ledger row and prunes every PRUNE_EVERY rows.
+        """
+        self.records_since_prune += 1
+        if self.records_since_prune >= PRUNE_EVERY:
+            self.prune()
+
+    def prune(self) -> int:
+        """
+        Forgets update ids older than the retention.
+
+        Returns:
+            int: The number of ids deleted.
+        """
+        self.records_since_prune = 0
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM processed_updates WHERE processed_at < ?",
+                                        (time.time() - self.retention_seconds,)).rowcount
+            self.conn.commit()
+        return deleted
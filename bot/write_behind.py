@@ -0,0 +1,289 @@
+import collections
+import logging
+import sqlite3
+import threading
+import time
+
+from structured_logging import log_event
+from update_ledger import claim_update
+
+logger = logging.getLogger(__name__)
+
+
+# Stands for "no user" when the background thread flushes
+_BACKGROUND = object()
+
+
+class WriteBehindFailed(sqlite3.Error):
+    """
+    Raised by a flush when queued groups could not be committed.
+
+    Attributes:
+        groups (list): The failed PendingWrite groups, each with its ``error``.
+    """
+
+    def __init__(self, groups: list):
+        super().__init__(f"{len(groups)} write-behind group(s) failed: {groups[0].error}")
+        self.groups = groups
+
+
+class PendingWrite:
+    """
+    A group of statements queued in the write-behind buffer.
+    """
+
+    __slots__ = ("statements", "telegram_id", "update_id", "claim", "done", "error", "reported")
+
+    def __init__(self, statements: list, telegram_id: int | None, update_id: int | None, claim: bool):
+        self.statements = statements
+        self.telegram_id = telegram_id
+        self.update_id = update_id
+        self.claim = claim
+        self.done = threading.Event()
+        self.error = None
+        # Set once a waiter was told about the error; flushes then no longer report it
+        self.reported = False
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Waits until the group was flushed.
+
+        Returns:
+            bool: False if the timeout expired first.
+
+        Raises:
+            sqlite3.Error: The error the group's transaction failed with.
+        """
+        if not self.done.wait(timeout):
+            return False
+        if self.error is not None:
+            self.reported = True
+            raise self.error
+        return True
+
+
+class WriteBehindBuffer:
+    """
+    Group-commit buffer for BookDatabase mutations.
+
+    Statements are queued instead of being committed one by one, and a background thread applies everything queued
+    in a single transaction every ``flush_interval_ms`` or as soon as ``max_batch`` statements are waiting. The queue is
+    bounded: once ``max_pending`` statements are waiting, the submitting thread flushes synchronously.
+
+    Reads stay consistent for the user who wrote: ``flush_for_user`` flushes first if that user has queued writes.
+
+    Statements are submitted in groups that are committed in the same transaction or not at all. A group can carry
+    the Telegram update it belongs to; it claims the update in the update ledger in its transaction, and groups of an
+    update the ledger already holds are skipped. A group that cannot be committed is reported to whoever waits on it
+    (``PendingWrite.wait``) and to the caller of the flush that tried it.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock, flush_interval_ms: int = 50,
+                 max_batch: int = 200, max_pending: int = 5000):
+        """
+        Args:
+            conn (sqlite3.Connection): The connection the statements are applied on.
+            lock (threading.RLock): Lock guarding ``conn``, shared with BookDatabase.
+            flush_interval_ms (int): Longest time a statement waits before being committed.
+            max_batch (int): Number of waiting statements that triggers an immediate flush.
+            max_pending (int): Queue bound. Submitting beyond it flushes in the caller's thread.
+        """
+        self.conn = conn
+        self.lock = lock
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+
+        self.pending = collections.deque()
+        self.pending_statements = 0
+        self.pending_per_user = collections.Counter()
+        self.condition = threading.Condition()
+        self.closed = False
+        # Groups that failed after their caller moved on, by user, until a flush for that user reports them
+        self.unreported_failures = collections.defaultdict(list)
+        # Updates found in the ledger already; their remaining statements are skipped
+        self.duplicate_updates = set()
+        self.flushes = 0
+        self.flushed_statements = 0
+
+        self.flusher = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self.flusher.start()
+
+    def submit(self, sql: str, parameters: tuple, telegram_id: int | None = None, update_id: int | None = None,
+               claim: bool = False) -> "PendingWrite":
+        """
+        Queues one statement.
+
+        Args:
+            sql (str): The statement.
+            parameters (tuple): Its parameters.
+            telegram_id (int | None): The user the statement belongs to, used for read-your-writes.
+            update_id (int | None): The Telegram update the statement belongs to.
+            claim (bool): Record ``update_id`` in the update ledger together with this statement.
+
+        Returns:
+            PendingWrite: Lets the caller wait for the commit and see its failure.
+        """
+        return self.submit_many([(sql, parameters)], telegram_id, update_id, claim)
+
+    def submit_many(self, statements: list, telegram_id: int | None = None, update_id: int | None = None,
+                    claim: bool = False) -> "PendingWrite":
+        """
+        Queues several statements at once. They are one group: committed in the same transaction or not at all.
+
+        Args:
+            statements (list): ``(sql, parameters)`` pairs.
+            telegram_id (int | None): The user the statements belong to.
+            update_id (int | None): The Telegram update the statements belong to.
+            claim (bool): Record ``update_id`` in the update ledger together with the statements.
+
+        Returns:
+            PendingWrite: Lets the caller wait for the commit and see its failure.
+        """
+        group = PendingWrite(list(statements), telegram_id, update_id, claim)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("write-behind buffer is closed")
+            self.pending.append(group)
+            self.pending_statements += len(group.statements)
+            self.pending_per_user[telegram_id] += 1
+            queued = self.pending_statements
+            if queued >= self.max_batch:
+                self.condition.notify()
+        if queued >= self.max_pending:
+            self.flush(_BACKGROUND if telegram_id is None else telegram_id)
+        return group
+
+    def has_pending(self, telegram_id: int) -> bool:
+        """
+        Tells whether the user has writes that are not committed yet.
+        """
+        return self.pending_per_user.get(telegram_id, 0) > 0
+
+    def flush_for_user(self, telegram_id: int) -> None:
+        """
+        Flushes if the user has queued writes, so a following read sees them.
+
+        Raises:
+            WriteBehindFailed: If one of the user's groups could not be committed, in this flush or in an earlier one
+                that did not report it.
+        """
+        if self.has_pending(telegram_id) or telegram_id in self.unreported_failures:
+            self.flush(telegram_id)
+
+    def flush(self, telegram_id: int | None = None) -> int:
+        """
+        Applies every queued group in one transaction.
+
+        If that transaction fails it is rolled back and the groups are replayed one transaction each, so one bad
+        group cannot lose the others and no group is ever partly committed.
+
+        Args:
+            telegram_id (int | None): Only report failed groups of this user; those of every user if None.
+
+        Returns:
+            int: The number of statements applied.
+
+        Raises:
+            WriteBehindFailed: If a group could not be committed, now or in an earlier flush that did not report it.
+                The other groups are committed regardless.
+        """
+        with self.lock:
+            with self.condition:
+                batch = list(self.pending)
+                self.pending.clear()
+                self.pending_statements = 0
+            failed = []
+            try:
+                if batch:
+                    for group in batch:
+                        self._apply(group)
+                    self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                log_event(logger, logging.WARNING, "write_behind_batch_failed", groups=len(batch), error=str(e))
+                failed = self._replay_groups(batch)
+            finally:
+                with self.condition:
+                    for group in batch:
+                        self.pending_per_user[group.telegram_id] -= 1
+                        if self.pending_per_user[group.telegram_id] <= 0:
+                            del self.pending_per_user[group.telegram_id]
+            for group in batch:
+                group.done.set()
+            statements = sum(len(group.statements) for group in batch)
+            if batch:
+                self.flushes += 1
+                self.flushed_statements += statements
+            with self.condition:
+                for group in failed:
+                    self.unreported_failures[group.telegram_id].append(group)
+                if telegram_id is None:
+                    failed = [group for groups in self.unreported_failures.values() for group in groups]
+                    self.unreported_failures.clear()
+                else:
+                    failed = self.unreported_failures.pop(telegram_id, [])
+            failed = [group for group in failed if not group.reported]
+        if failed:
+            raise WriteBehindFailed(failed)
+        return statements
+
+    def close(self) -> None:
+        """
+        Stops the background thread and durably flushes whatever is still queued.
+
+        Raises:
+            WriteBehindFailed: If a queued group could not be committed.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.flusher.join(timeout=max(1.0, self.flush_interval * 4))
+        self.flush()
+
+    def _apply(self, group: "PendingWrite") -> None:
+        if group.update_id is not None:
+            if group.claim and not claim_update(self.conn, group.update_id):
+                if len(self.duplicate_updates) >= 10_000:
+                    self.duplicate_updates.clear()
+                self.duplicate_updates.add(group.update_id)
+                log_event(logger, logging.INFO, "duplicate_update_write_skipped", update_id=group.update_id)
+                return
+            if group.update_id in self.duplicate_updates:
+                return
+        for sql, parameters in group.statements:
+            self.conn.execute(sql, parameters)
+
+    def _replay_groups(self, batch: list) -> list:
+        """
+        Commits each group in its own transaction. Returns the groups that failed, with their error set.
+        """
+        failed = []
+        for group in batch:
+            try:
+                self._apply(group)
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                group.error = e
+                failed.append(group)
+                log_event(logger, logging.ERROR, "write_behind_group_failed", telegram_id=group.telegram_id,
+                          update_id=group.update_id, statements=len(group.statements), error=str(e))
+        return failed
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self.closed and self.pending_statements < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                if self.closed:
+                    return
+            try:
+                # Reports nothing: failed groups are kept for their waiters and their users' next flush
+                self.flush(telegram_id=_BACKGROUND)
+            except sqlite3.Error as e:
+                log_event(logger, logging.ERROR, "write_behind_flush_failed", error=str(e))
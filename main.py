@@ -1,5 +1,15 @@
-from chatbot import ChatBot
+import os
+import sys
 
-if "__name__" == "__main__":
-    myscribe_chatbot = ChatBot()
-    myscribe_chatbot.chat()
\ No newline at end of file
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot"))
+
+from application import Application
+from sharding import WORKER_COUNT, run_sharded
+
+if __name__ == "__main__":
+    if WORKER_COUNT > 1:
+        # One ingress process routing updates by chat id to MYSCRIBE_WORKERS worker processes
+        run_sharded()
+    else:
+        myscribe_chatbot = Application().chatbot
+        myscribe_chatbot.chat()